@@ -0,0 +1,202 @@
+"""CSC 111 Final Project: All-Pairs Springs
+
+Module Description
+==================
+A complete graph on n vertices has n(n - 1) / 2 edges, so CompleteGraph(1000, ...) would need
+half a million Edge objects, or rows of a GraphStore, just to say that every pair is joined.
+AllPairsSprings stands in for all of those edges. It only keeps the positions the rest lengths
+are measured between, and works through the pairs one square tile of TILE by TILE vertices at a
+time, so the memory it uses grows with TILE ** 2 rather than n ** 2.
+
+The springs act exactly like the edges CompleteGraph used to add, Edge(vertices[i],
+vertices[j]) for every i < j, up to floating point summation order. Whatever needs them as
+edges (saving to csv, drawing, the equilibrium solver) gets them block by block from
+edge_blocks, in that same order.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from typing import Iterator
+import numpy as np
+from array_physics import ArrayState, MAX_FORCE, rest_lengths
+from edge import MIN_DISTANCE
+
+# the number of vertices along each side of a tile of pairs
+TILE = 256
+
+
+class AllPairsSprings:
+    """Springs between every pair of the first n vertices of a graph, where the spring between
+    vertices i < j starts at i.
+
+    Instance Attributes:
+    - rest_x, rest_y: the rest length of the spring between vertices i and j is the distance
+        between (rest_x[i], rest_y[i]) and (rest_x[j], rest_y[j]), or MIN_DISTANCE if that is
+        longer, as Edge would make it for vertices at those positions
+    - tile: the number of vertices along each side of a tile
+
+    Representation Invariants:
+    - len(self.rest_x) == len(self.rest_y)
+    - self.tile >= 1
+    """
+    rest_x: np.ndarray
+    rest_y: np.ndarray
+    tile: int
+
+    def __init__(self, rest_x: np.ndarray, rest_y: np.ndarray, tile: int = TILE) -> None:
+        self.rest_x = np.array(rest_x, dtype=np.float64)
+        self.rest_y = np.array(rest_y, dtype=np.float64)
+        self.tile = tile
+
+    @property
+    def n(self) -> int:
+        """The number of vertices joined."""
+        return len(self.rest_x)
+
+    @property
+    def n_edges(self) -> int:
+        """The number of springs, one per pair of vertices."""
+        return self.n * (self.n - 1) // 2
+
+    def tiles(self) -> Iterator[tuple[slice, slice]]:
+        """Yield the (rows, columns) of the tiles covering every pair i < j, with i in rows and
+        j in columns."""
+        n, tile = self.n, self.tile
+        for first_row in range(0, n, tile):
+            rows = slice(first_row, min(first_row + tile, n))
+            for first_column in range(first_row, n, tile):
+                yield rows, slice(first_column, min(first_column + tile, n))
+
+    def edge_blocks(self) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield the (start, end, rest) of the springs as edges, in blocks of about
+        self.tile ** 2, ordered by start and then end.
+
+        >>> springs = AllPairsSprings(np.array([0.0, 30.0, 30.0]), np.array([0.0, 0.0, 40.0]))
+        >>> [block for block in springs.edge_blocks()]
+        [(array([0, 0, 1]), array([1, 2, 2]), array([30., 50., 40.]))]
+        """
+        n = self.n
+        rows_per_block = max(1, self.tile * self.tile // max(n, 1))
+        for first_row in range(0, n - 1, rows_per_block):
+            rows = np.arange(first_row, min(first_row + rows_per_block, n - 1))
+            counts = n - 1 - rows
+            start = np.repeat(rows, counts)
+            # each row's ends count up from the vertex after it
+            end = np.arange(len(start)) - np.repeat(np.cumsum(counts) - counts - rows - 1,
+                                                    counts)
+            yield start, end, rest_lengths(self.rest_x, self.rest_y, start, end)
+
+    def with_edges(self, state: ArrayState) -> ArrayState:
+        """Return an ArrayState with the vertices of state and its edges followed by every
+        spring of self as an edge. This takes memory proportional to the number of pairs."""
+        blocks = [(state.start, state.end, state.rest), *self.edge_blocks()]
+        return ArrayState(
+            state.x, state.y, state.vx, state.vy, state.mass, state.pinned,
+            start=np.concatenate([block[0] for block in blocks]).astype(np.intp),
+            end=np.concatenate([block[1] for block in blocks]).astype(np.intp),
+            rest=np.concatenate([block[2] for block in blocks]),
+        )
+
+    def update(self, state: ArrayState, spring_constant: float, dt: float = 1.0,
+               energy: bool = True) -> float:
+        """Apply the springs' forces for a step of length dt to the velocities of state, like
+        array_physics._update_edges does for edges, and return their elastic potential energy,
+        or 0.0 if energy is False."""
+        potential_energy = 0.0
+        vx, vy, mass = state.vx, state.vy, state.mass
+        for rows, columns in self.tiles():
+            dx, dy, distance, rest, pairs = self._pairs(state, rows, columns)
+            dlen = np.clip(spring_constant * (distance - rest), -MAX_FORCE, MAX_FORCE)
+
+            distance[distance == 0] = 0.0001
+            if energy:
+                stretch = distance - rest
+                pair_energy = spring_constant * (stretch * stretch)
+                potential_energy += float(np.sum(pair_energy if pairs is None
+                                                 else pair_energy[pairs]))
+
+            fx = dx * dlen / distance * dt
+            fy = dy * dlen / distance * dt
+            start_multiplier, end_multiplier = _multipliers(state, rows, columns, pairs)
+            vx[rows] -= np.sum(start_multiplier * fx, axis=1) / mass[rows]
+            vy[rows] -= np.sum(start_multiplier * fy, axis=1) / mass[rows]
+            vx[columns] += np.sum(end_multiplier * fx, axis=0) / mass[columns]
+            vy[columns] += np.sum(end_multiplier * fy, axis=0) / mass[columns]
+        return potential_energy
+
+    def potential_energy(self, state: ArrayState, spring_constant: float) -> float:
+        """Return the elastic potential energy of the springs between the vertices of state as
+        they are now, like array_physics.energies."""
+        potential_energy = 0.0
+        for rows, columns in self.tiles():
+            _, _, distance, rest, pairs = self._pairs(state, rows, columns)
+            distance[distance == 0] = 0.0001
+            stretch = distance - rest
+            pair_energy = spring_constant * (stretch * stretch)
+            potential_energy += float(np.sum(pair_energy if pairs is None else pair_energy[pairs]))
+        return potential_energy
+
+    def pull(self, state: ArrayState,
+             spring_constant: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the net x and y pull of the springs on each of the first n vertices of state,
+        and the stiffness of each one's springs, as substepping.motion finds them for edges."""
+        fx, fy, stiffness = np.zeros(self.n), np.zeros(self.n), np.zeros(self.n)
+        for rows, columns in self.tiles():
+            dx, dy, distance, rest, pairs = self._pairs(state, rows, columns)
+            distance[distance == 0] = 0.0001
+            pull = np.clip(spring_constant * (distance - rest), -MAX_FORCE, MAX_FORCE) / distance
+            start_multiplier, end_multiplier = _multipliers(state, rows, columns, pairs)
+            fx[rows] -= np.sum(start_multiplier * pull * dx, axis=1)
+            fy[rows] -= np.sum(start_multiplier * pull * dy, axis=1)
+            fx[columns] += np.sum(end_multiplier * pull * dx, axis=0)
+            fy[columns] += np.sum(end_multiplier * pull * dy, axis=0)
+            # see substepping.motion
+            stiffness[rows] += np.sum(start_multiplier * (1 + ~state.pinned[np.newaxis, columns]),
+                                      axis=1)
+            stiffness[columns] += np.sum(end_multiplier * (1 + ~state.pinned[rows, np.newaxis]),
+                                         axis=0)
+        return fx, fy, stiffness
+
+    def _pairs(self, state: ArrayState, rows: slice, columns: slice) -> tuple:
+        """Return the (dx, dy, distance, rest, pairs) of the tile of rows by columns: the extent
+        (start minus end), length and rest length of the spring between each row and column,
+        and a mask of the row and column pairs that are springs, or None if all of them are."""
+        x, y, rest_x, rest_y = state.x, state.y, self.rest_x, self.rest_y
+        dx = x[rows, np.newaxis] - x[np.newaxis, columns]
+        dy = y[rows, np.newaxis] - y[np.newaxis, columns]
+        rest_dx = rest_x[rows, np.newaxis] - rest_x[np.newaxis, columns]
+        rest_dy = rest_y[rows, np.newaxis] - rest_y[np.newaxis, columns]
+        rest = np.maximum(MIN_DISTANCE, np.sqrt(rest_dx * rest_dx + rest_dy * rest_dy))
+        pairs = None
+        if rows.start == columns.start:
+            # a tile on the diagonal only holds the pairs above it
+            pairs = np.arange(rows.start, rows.stop)[:, np.newaxis] \
+                < np.arange(columns.start, columns.stop)[np.newaxis, :]
+        return dx, dy, np.sqrt(dx * dx + dy * dy), rest, pairs
+
+
+def _multipliers(state: ArrayState, rows: slice, columns: slice,
+                 pairs: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+    """Return how much of each spring's force in the tile of rows by columns goes to its start
+    and to its end, as in array_physics._update_edges, with 0 for pairs that aren't springs."""
+    start_pinned = state.pinned[rows, np.newaxis]
+    end_pinned = state.pinned[np.newaxis, columns]
+    active = ~(start_pinned & end_pinned)
+    if pairs is not None:
+        active = active & pairs
+    return np.where(end_pinned, 1.0, 0.5) * active, np.where(start_pinned, 1.0, 0.5) * active
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["typing", "numpy", "array_physics", "edge"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -0,0 +1,341 @@
+"""CSC 111 Final Project: Array Physics Backend
+
+Module Description
+==================
+This module holds the numpy version of our physics step. Instead of walking every Edge and
+Vertex object one at a time, the graph is held in flat arrays (see graph_store.py) and each part
+of the step (Hooke's law, force clamping, pinned multipliers, friction/gravity, clamping and the
+energy sums) is done as a handful of whole-array operations.
+
+The maths mirrors Edge.update, Vertex.update and Vertex.clamp exactly, so trajectories match
+the python backend up to floating point summation order.
+
+The positions and velocities may also carry a leading batch axis of B independent copies of
+the same graph (see ensemble.py). The constants are then arrays of shape (B, 1), one row per
+copy, and the energies come back as arrays of shape (B,).
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from dataclasses import dataclass
+import functools
+from typing import TYPE_CHECKING
+import numpy as np
+from edge import Edge, MIN_DISTANCE
+from profiler import Profiler
+from vertex import Vertex
+
+if TYPE_CHECKING:
+    from all_pairs import AllPairsSprings
+    from edge_coloring import ParallelEdges
+
+# the largest force magnitude a single spring may apply in one step
+MAX_FORCE = 9
+
+
+@dataclass
+class ArrayState:
+    """The state of a spring mass graph as flat arrays.
+
+    Instance Attributes:
+    - x, y: vertex positions, of shape (V,) or (B, V)
+    - vx, vy: vertex velocities, of shape (V,) or (B, V)
+    - mass: vertex masses
+    - pinned: whether each vertex is pinned
+    - start, end: the vertex indices of each edge's endpoints
+    - rest: the initial (rest) length of each edge
+
+    Representation Invariants:
+    - all vertex arrays have the same last dimension
+    - all edge arrays have the same length
+    """
+    x: np.ndarray
+    y: np.ndarray
+    vx: np.ndarray
+    vy: np.ndarray
+    mass: np.ndarray
+    pinned: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    rest: np.ndarray
+
+
+def gather(vertices: list[Vertex], edges: list[Edge]) -> ArrayState:
+    """Copy vertices and edges into a new ArrayState."""
+    n, k = len(vertices), len(edges)
+    index = {v: i for i, v in enumerate(vertices)}
+    return ArrayState(
+        x=np.fromiter((v.x for v in vertices), np.float64, count=n),
+        y=np.fromiter((v.y for v in vertices), np.float64, count=n),
+        vx=np.fromiter((v.vx for v in vertices), np.float64, count=n),
+        vy=np.fromiter((v.vy for v in vertices), np.float64, count=n),
+        mass=np.fromiter((v.mass for v in vertices), np.float64, count=n),
+        pinned=np.fromiter((v.pinned for v in vertices), np.bool_, count=n),
+        start=np.fromiter((index[e.start] for e in edges), np.intp, count=k),
+        end=np.fromiter((index[e.end] for e in edges), np.intp, count=k),
+        rest=np.fromiter((e.initial_distance for e in edges), np.float64, count=k),
+    )
+
+
+def subset(state: ArrayState, vertices: np.ndarray, edges: np.ndarray) -> ArrayState:
+    """Return a copy of the given vertices and edges of state, as a graph of its own.
+
+    Every endpoint of the edges must be one of the vertices. The vertices are renumbered in
+    the order given.
+
+    >>> state = ArrayState(np.arange(3.0), np.zeros(3), np.zeros(3), np.zeros(3), np.ones(3),
+    ...                    np.zeros(3, dtype=bool), np.array([0, 1]), np.array([1, 2]),
+    ...                    np.ones(2))
+    >>> part = subset(state, np.array([1, 2]), np.array([1]))
+    >>> part.x, part.start, part.end
+    (array([1., 2.]), array([0]), array([1]))
+    """
+    renumbered = np.empty(state.x.shape[-1], dtype=np.intp)
+    renumbered[vertices] = np.arange(len(vertices))
+    return ArrayState(
+        x=state.x[vertices], y=state.y[vertices], vx=state.vx[vertices], vy=state.vy[vertices],
+        mass=state.mass[vertices], pinned=state.pinned[vertices],
+        start=renumbered[state.start[edges]], end=renumbered[state.end[edges]],
+        rest=state.rest[edges],
+    )
+
+
+def rest_lengths(x: np.ndarray, y: np.ndarray, start: np.ndarray,
+                 end: np.ndarray) -> np.ndarray:
+    """Return the rest length Edge would give each edge from vertex start[e] to vertex end[e],
+    for vertices at x and y.
+
+    >>> rest_lengths(np.array([0.0, 30.0, 40.0]), np.array([0.0, 40.0, 40.0]),
+    ...              np.array([0, 1]), np.array([1, 2]))
+    array([50., 15.])
+    """
+    dx = x[start] - x[end]
+    dy = y[start] - y[end]
+    return np.maximum(MIN_DISTANCE, np.sqrt(dx * dx + dy * dy))
+
+
+def step(state: ArrayState, constants: tuple, size: tuple[int, int],
+         profiler: Profiler | None = None, dt: float = 1.0,
+         parallel: "ParallelEdges | None" = None,
+         owned: tuple[int, np.ndarray] | None = None,
+         all_pairs: "AllPairsSprings | None" = None, energy: bool = True) -> tuple:
+    """Run one physics step of length dt on state in place, timing each phase with profiler
+    if given. If parallel is given, the spring forces of an unbatched state are applied with
+    it, on several threads.
+
+    constants is (spring_constant, friction, gravity), either floats or, for a batched state,
+    arrays of shape (B, 1). Return the (elastic_potential_energy, kinetic_energy) of the step,
+    as numpy floats or arrays of shape (B,), or (None, None) without summing them if energy is
+    False.
+
+    If state is one domain of a larger graph (see domains.py), owned is (n, edges): only its
+    first n vertices and the edges with the given indices count towards the energies. owned
+    can't be combined with parallel.
+
+    If all_pairs is given, the forces of its springs are applied after those of the edges, and
+    their energy is added in. all_pairs can't be combined with a batched state or with owned.
+    """
+    spring_constant = constants[0]
+    friction, gravity = per_substep(constants[1], constants[2], dt)
+    owned_vertices, owned_edges = (None, None) if owned is None else owned
+    if parallel is not None:
+        update_edges = parallel.update_edges
+    elif owned is not None:
+        update_edges = functools.partial(_update_edges, owned_edges=owned_edges)
+    else:
+        update_edges = _update_edges
+    if profiler is None:
+        potential_energy = update_edges(state, spring_constant, dt, energy)
+        if all_pairs is not None:
+            potential_energy += all_pairs.update(state, spring_constant, dt, energy)
+        kinetic_energy = _update_vertices(state, friction, gravity, size[1], dt, owned_vertices,
+                                          energy)
+        _clamp_vertices(state, size)
+    else:
+        potential_energy = profiler.time("update_edges", update_edges,
+                                         state, spring_constant, dt, energy)
+        if all_pairs is not None:
+            potential_energy += profiler.time("update_all_pairs", all_pairs.update,
+                                              state, spring_constant, dt, energy)
+        kinetic_energy = profiler.time("update_vertices", _update_vertices, state, friction,
+                                       gravity, size[1], dt, owned_vertices, energy)
+        profiler.time("clamp_vertices", _clamp_vertices, state, size)
+    if not energy:
+        return None, None
+    return potential_energy, kinetic_energy
+
+
+def energies(state: ArrayState, spring_constant: float, height: int) -> tuple[float, float]:
+    """Return the elastic potential energy and kinetic energy of state as it is now, without
+    stepping it.
+
+    The kinetic energy is the one the last step returned, but the elastic potential energy is
+    that of the positions the vertices were moved to, where a step returns that of the positions
+    it started from.
+    """
+    dx = state.x[state.start] - state.x[state.end]
+    dy = state.y[state.start] - state.y[state.end]
+    distance = np.sqrt(dx * dx + dy * dy)
+    distance[distance == 0] = 0.0001
+    stretch = distance - state.rest
+    speed_squared = np.where(state.y < height, state.vx ** 2 + state.vy ** 2, state.vx ** 2)
+    masses = np.where(state.pinned, 0.0, state.mass)
+    return (float(np.sum(spring_constant * (stretch * stretch))),
+            float(0.5 * (speed_squared @ masses)))
+
+
+def per_substep(friction: float | np.ndarray, gravity: float | np.ndarray,
+                dt: float) -> tuple:
+    """Return the (friction, gravity) to apply in one step of length dt, in place of the
+    friction and gravity applied in a step of length 1.
+
+    Gravity is scaled so that vertices rest where the spring forces are mass * gravity / friction
+    whatever dt is, as they do when dt is 1.
+
+    >>> per_substep(0.98, 0.01, 1.0)
+    (0.98, 0.01)
+    >>> friction, gravity = per_substep(0.98, 0.01, 2.0)
+    >>> round(friction, 4), round(gravity, 4)
+    (0.9604, 0.0196)
+    """
+    return friction ** dt, gravity * dt * friction ** (dt - 1)
+
+
+def _update_edges(state: ArrayState, spring_constant: float | np.ndarray,
+                  dt: float = 1.0, energy: bool = True,
+                  owned_edges: np.ndarray | None = None) -> np.ndarray | float:
+    """Apply spring forces for a step of length dt to vertex velocities. Return the elastic
+    potential energy, of only the edges with the indices in owned_edges if given, or 0.0 if
+    energy is False."""
+    start, end = state.start, state.end
+    dx = np.take(state.x, start, axis=-1) - np.take(state.x, end, axis=-1)
+    dy = np.take(state.y, start, axis=-1) - np.take(state.y, end, axis=-1)
+    distance = np.sqrt(dx * dx + dy * dy)
+    stretch = distance - state.rest
+    dlen = np.clip(spring_constant * stretch, -MAX_FORCE, MAX_FORCE)
+
+    # same order as the python backend: the zero fix comes after the force is clamped
+    distance[distance == 0] = 0.0001
+    potential_energy = 0.0
+    if energy:
+        stretch = distance - state.rest
+        edge_energy = spring_constant * (stretch * stretch)
+        if owned_edges is not None:
+            edge_energy = edge_energy[..., owned_edges]
+        potential_energy = np.sum(edge_energy, axis=-1)
+
+    fx = dx * dlen / distance * dt
+    fy = dy * dlen / distance * dt
+
+    # an edge moves its free endpoint twice as much if the other endpoint is pinned
+    start_pinned, end_pinned = state.pinned[start], state.pinned[end]
+    start_multiplier = np.where(end_pinned, 1.0, 0.5)
+    end_multiplier = np.where(start_pinned, 1.0, 0.5)
+    active = ~(start_pinned & end_pinned)
+    start_multiplier *= active
+    end_multiplier *= active
+
+    n = state.x.shape[-1]
+    vx, vy = state.vx, state.vy
+    vx += (_sum_by_index(end, end_multiplier * fx, n)
+           - _sum_by_index(start, start_multiplier * fx, n)) / state.mass
+    vy += (_sum_by_index(end, end_multiplier * fy, n)
+           - _sum_by_index(start, start_multiplier * fy, n)) / state.mass
+    return potential_energy
+
+
+def apply_edge_class(state: ArrayState, spring_constant: float, dt: float,
+                     edges: np.ndarray, energy: bool = True) -> float:
+    """Apply the spring forces of the given edges for a step of length dt to vertex
+    velocities, like _update_edges. Return their elastic potential energy, or 0.0 if energy is
+    False.
+
+    No two of the edges may share a vertex (see edge_coloring.py), so every velocity is written
+    at most once and several threads may apply such sets of edges at the same time, as long as
+    no vertex is shared between the sets either.
+    """
+    start, end = state.start[edges], state.end[edges]
+    x, y = state.x, state.y
+    dx = x[start] - x[end]
+    dy = y[start] - y[end]
+    distance = np.sqrt(dx * dx + dy * dy)
+    dlen = np.clip(spring_constant * (distance - state.rest[edges]), -MAX_FORCE, MAX_FORCE)
+
+    distance[distance == 0] = 0.0001
+    potential_energy = 0.0
+    if energy:
+        stretch = distance - state.rest[edges]
+        potential_energy = float(np.sum(spring_constant * (stretch * stretch)))
+
+    fx = dx * dlen / distance * dt
+    fy = dy * dlen / distance * dt
+
+    start_pinned, end_pinned = state.pinned[start], state.pinned[end]
+    active = ~(start_pinned & end_pinned)
+    start_share = np.where(end_pinned, 1.0, 0.5) * active / state.mass[start]
+    end_share = np.where(start_pinned, 1.0, 0.5) * active / state.mass[end]
+    state.vx[start] -= start_share * fx
+    state.vy[start] -= start_share * fy
+    state.vx[end] += end_share * fx
+    state.vy[end] += end_share * fy
+    return potential_energy
+
+
+def _sum_by_index(index: np.ndarray, weights: np.ndarray, n: int) -> np.ndarray:
+    """Return an array of length n (with the batch axis of weights, if any) whose entry i is
+    the sum of weights[..., e] over all e with index[e] == i."""
+    if weights.ndim == 1:
+        return np.bincount(index, weights, n)
+
+    batch = weights.shape[0]
+    flat_index = (np.arange(batch)[:, np.newaxis] * n + index).ravel()
+    return np.bincount(flat_index, weights.ravel(), batch * n).reshape(batch, n)
+
+
+def _update_vertices(state: ArrayState, friction: float | np.ndarray,
+                     gravity: float | np.ndarray, height: int, dt: float = 1.0,
+                     owned_vertices: int | None = None, energy: bool = True) -> np.ndarray | float:
+    """Apply friction and gravity (see per_substep) and move the vertices for a step of length
+    dt. Return the kinetic energy, of only the first owned_vertices vertices if given, or 0.0 if
+    energy is False."""
+    # multiplying by free adds exactly 0 to pinned vertices, and works with or without a batch axis
+    free = ~state.pinned
+    x, y, vx, vy = state.x, state.y, state.vx, state.vy
+    vx *= friction
+    vy *= friction
+    vy += gravity * free
+    x += vx * (free * dt)
+    y += vy * (free * dt)
+    if not energy:
+        return 0.0
+
+    # vertices resting on the floor only count their horizontal velocity,
+    # and pinned vertices don't count at all
+    speed_squared = np.where(y < height, vx ** 2 + vy ** 2, vx ** 2)
+    masses = np.where(free, state.mass, 0.0)
+    return 0.5 * (speed_squared[..., :owned_vertices] @ masses[:owned_vertices])
+
+
+def _clamp_vertices(state: ArrayState, size: tuple[int, int]) -> None:
+    """Clamp free vertex coordinates to the screen."""
+    width, height = size
+    free = ~state.pinned
+    x, y = state.x, state.y
+    np.minimum(y, np.where(free, height, np.inf), out=y)
+    np.clip(x, np.where(free, 0, -np.inf), np.where(free, width, np.inf), out=x)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["dataclasses", "functools", "typing", "numpy", "all_pairs", "edge",
+                              "edge_coloring", "profiler", "vertex"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -0,0 +1,301 @@
+"""CSC 111 Final Project: Benchmarks
+
+Module Description
+==================
+This module measures how much memory and time our graph code needs, so that performance
+changes can be checked with numbers instead of guesses.
+
+Running it benchmarks every dataset in data/ and scaled-up generated graphs: physics steps/s
+with both backends, csv and binary load/save throughput, draw time on an offscreen surface and
+peak memory. The results can be saved as JSON and compared against a stored baseline, failing
+if any number got worse by more than a threshold:
+
+    python benchmarks.py --output baseline.json
+    python benchmarks.py --baseline baseline.json --threshold 0.25
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+import numpy as np
+from edge import Edge
+from graph import SpringMassGraph
+from graph_io import load_from_csv, save_to_csv, load_from_binary, save_to_binary
+from graph_store import GraphStore, VERTEX_FIELDS, EDGE_FIELDS
+from graph_types import ClothGraph, CompleteGraph, PyramidGraph, WheelGraph
+from substepping import Substepping
+from vertex import Vertex
+
+DATA_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                           "data", "*.csv")))
+
+# the seed of random, which Vertex(randomize=True) and Edge(is_random=True) use,
+# set before building each graph
+SEED = 111
+# each timing repeats its operation until at least this many seconds have passed
+MIN_SECONDS = 0.2
+# by default, a result fails if it is this fraction worse than its baseline
+REGRESSION_THRESHOLD = 0.25
+# results that are not measurements, so are never compared against a baseline
+RESULT_LABELS = ("case", "vertices", "edges")
+# smaller is better for these results, and larger is better for all others
+LOWER_IS_BETTER = ("draw_ms", "peak_memory_bytes")
+
+
+def measure_memory(build: Callable[[], object]) -> tuple[int, object]:
+    """Return the bytes still allocated after calling build, and what build returned."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def memory_benchmark(x_num: int = 200, y_num: int = 200) -> dict[str, float]:
+    """Compare the bytes per vertex and per edge of Vertex/Edge objects and of a GraphStore,
+    using the vertices and edges of a ClothGraph(x_num, y_num, 10)."""
+    graph = ClothGraph(x_num, y_num, 10)
+    n, k = len(graph.vertices), len(graph.edges)
+
+    vertex_bytes, _ = measure_memory(lambda: [Vertex(v.x, v.y) for v in graph.vertices])
+    edge_bytes, _ = measure_memory(lambda: [Edge(e.start, e.end) for e in graph.edges])
+    store_bytes, _ = measure_memory(lambda: GraphStore.from_objects(graph.vertices, graph.edges))
+
+    return {
+        "vertices": n,
+        "edges": k,
+        "object bytes/vertex": vertex_bytes / n,
+        "object bytes/edge": edge_bytes / k,
+        "store bytes/vertex": sum(np.dtype(dtype).itemsize for _, dtype in VERTEX_FIELDS),
+        "store bytes/edge": sum(np.dtype(dtype).itemsize for _, dtype in EDGE_FIELDS),
+        "object bytes total": vertex_bytes + edge_bytes,
+        "store bytes total": store_bytes,
+    }
+
+
+def tile_graph(graph: SpringMassGraph, copies: int) -> SpringMassGraph:
+    """Return a numpy backend graph made of copies side by side copies of graph."""
+    source = GraphStore.from_objects(graph.vertices, graph.edges)
+    n = source.n_vertices
+    tiled = SpringMassGraph(backend="numpy")
+    tiled.store.extend_vertices(np.tile(source.x, copies), np.tile(source.y, copies),
+                                np.tile(source.pinned, copies))
+    offsets = np.repeat(np.arange(copies) * n, source.n_edges)
+    tiled.store.extend_edges(np.tile(source.start, copies) + offsets,
+                             np.tile(source.end, copies) + offsets,
+                             np.tile(source.rest, copies))
+    return tiled
+
+
+def save_benchmark(target_edges: int = 1_000_000) -> list[dict]:
+    """Time save_to_csv on every dataset in data/, tiled until it has about target_edges edges,
+    for both the numpy and python backends."""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "out.csv")
+        for filename in DATA_FILES:
+            graph = SpringMassGraph()
+            load_from_csv(graph, filename)
+            graph = tile_graph(graph, max(1, target_edges // max(1, len(graph.edges))))
+
+            for backend in ("numpy", "python"):
+                graph.set_backend(backend)
+                start = time.perf_counter()
+                save_to_csv(graph, output)
+                seconds = time.perf_counter() - start
+                results.append({
+                    "dataset": os.path.basename(filename),
+                    "backend": backend,
+                    "vertices": len(graph.vertices),
+                    "edges": len(graph.edges),
+                    "seconds": seconds,
+                    "MB/s": os.path.getsize(output) / seconds / 1e6,
+                })
+    return results
+
+
+def benchmark_cases(scale: int = 1) -> list[tuple[str, Callable[[], SpringMassGraph]]]:
+    """Return (name, build) for every dataset in data/ and for each graph generator, with
+    generated graphs scale times as large along each of their dimensions."""
+    cases = []
+    for filename in DATA_FILES:
+        cases.append((os.path.basename(filename), lambda filename=filename: _load(filename)))
+
+    cloth, pyramid, wheel, complete = 100 * scale, 60 * scale, 1000 * scale, 100 * scale
+    cases.extend([
+        (f"cloth{cloth}x{cloth // 2}", lambda: ClothGraph(cloth, cloth // 2, 5)),
+        (f"pyramid{pyramid}", lambda: PyramidGraph(pyramid, 8)),
+        (f"wheel{wheel}", lambda: WheelGraph(wheel, 250)),
+        (f"complete{complete}", lambda: CompleteGraph(complete, 250)),
+    ])
+    return cases
+
+
+def _load(filename: str) -> SpringMassGraph:
+    """Return a new graph loaded from filename."""
+    graph = SpringMassGraph()
+    load_from_csv(graph, filename)
+    return graph
+
+
+def _per_second(run: Callable[[], object]) -> float:
+    """Return how many times per second run can be called."""
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < MIN_SECONDS:
+        run()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return calls / elapsed
+
+
+def benchmark_case(build: Callable[[], SpringMassGraph], directory: str) -> dict[str, float]:
+    """Return every measurement for the graph returned by build, using directory for files."""
+    random.seed(SEED)
+    peak_memory = _peak_memory(build)
+    random.seed(SEED)
+    graph = build()
+    results = {"vertices": len(graph.vertices), "edges": len(graph.edges)}
+
+    results["draw_ms"] = 1000 / _per_second(_offscreen_draw(graph))
+    # adaptive substepping and sleeping would make the work per frame depend on how far the
+    # graph has moved while being timed, so time the original fixed number of substeps
+    graph.substepping = Substepping(graph.SUBSTEPS, graph.SUBSTEPS)
+    graph.sleeping = False
+    for backend in SpringMassGraph.BACKENDS:
+        graph.set_backend(backend)
+        results[f"{backend}_steps_per_s"] = _per_second(graph.step)
+        results[f"{backend}_frames_per_s"] = _per_second(graph.run_substeps)
+
+    for kind, save, load in (("csv", save_to_csv, load_from_csv),
+                             ("binary", save_to_binary, load_from_binary)):
+        filename = os.path.join(directory, f"graph.{kind}")
+        saves_per_second = _per_second(lambda save=save, filename=filename: save(graph, filename))
+        megabytes = os.path.getsize(filename) / 1e6
+        loaded = SpringMassGraph(backend="numpy")
+        results[f"{kind}_save_mb_per_s"] = megabytes * saves_per_second
+        results[f"{kind}_load_mb_per_s"] = megabytes * _per_second(
+            lambda load=load, loaded=loaded, filename=filename: load(loaded, filename))
+
+    results["peak_memory_bytes"] = peak_memory
+    return results
+
+
+def _peak_memory(build: Callable[[], SpringMassGraph]) -> int:
+    """Return the most bytes allocated at once while building a graph and running a frame of it
+    with the numpy backend."""
+    tracemalloc.start()
+    graph = build()
+    graph.set_backend("numpy")
+    graph.run_substeps()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def _offscreen_draw(graph: SpringMassGraph) -> Callable[[], None]:
+    """Return a function drawing graph on a surface that is never shown."""
+    # pylint: disable=import-outside-toplevel
+    # drawing is the only benchmark needing pygame, and it must not open a window
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    pygame.display.init()
+    surface = pygame.Surface(graph.size)
+    return lambda: graph.draw(surface)
+
+
+def run_suite(scale: int = 1) -> list[dict[str, float]]:
+    """Run benchmark_case on every case of benchmark_cases(scale), printing each result."""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, build in benchmark_cases(scale):
+            result = {"case": name, **benchmark_case(build, directory)}
+            print(", ".join(f"{key} {value:,.6g}" if isinstance(value, float)
+                            else f"{key} {value}" for key, value in result.items()))
+            results.append(result)
+    return results
+
+
+def find_regressions(results: list[dict], baseline: list[dict],
+                     threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """Return a description of every result more than threshold worse than the result of the
+    same case and name in baseline. Cases and results missing from baseline are skipped."""
+    baseline_cases = {result["case"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_cases.get(result["case"], {})
+        for key, value in result.items():
+            if key in RESULT_LABELS or key not in old:
+                continue
+            if key in LOWER_IS_BETTER:
+                worse = value > old[key] * (1 + threshold)
+            else:
+                worse = value < old[key] * (1 - threshold)
+            if worse:
+                regressions.append(f"{result['case']} {key}: {value:,.6g} "
+                                   f"(baseline {old[key]:,.6g})")
+    return regressions
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line arguments in argv."""
+    parser = argparse.ArgumentParser(description="Benchmark the graph code.")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="how many times larger to make the generated graphs")
+    parser.add_argument("--output", help="json file to save the results to")
+    parser.add_argument("--baseline", help="json file of earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="the fraction by which a result may be worse than the baseline")
+    parser.add_argument("--storage", action="store_true",
+                        help="also compare Vertex/Edge objects with a GraphStore")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]) -> int:
+    """Run the benchmarks as described by the arguments in argv. Return 1 if any result
+    regressed from the baseline, and 0 otherwise."""
+    args = parse_args(argv)
+    if args.storage:
+        print("memory")
+        for name, value in memory_benchmark().items():
+            print(f"{name:>22}: {value:,.1f}")
+
+        print("save_to_csv")
+        for result in save_benchmark():
+            print(f"{result['dataset']:>12} {result['backend']:>6} "
+                  f"{result['vertices']:>9,} vertices {result['edges']:>9,} edges "
+                  f"{result['seconds']:7.2f}s {result['MB/s']:6.1f} MB/s")
+
+    results = run_suite(args.scale)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"seed": SEED, "scale": args.scale, "python": platform.python_version(),
+                       "numpy": np.__version__, "results": results}, file, indent=2)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = find_regressions(results, baseline["results"], args.threshold)
+    for regression in regressions:
+        print("regression:", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    # like headless.py this is a command line tool whose exit status reports regressions,
+    # so it doesn't run doctest and python_ta after main
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,589 @@
+"""CSC 111 Final Project: Domain Decomposition
+
+Module Description
+==================
+The numpy backend steps a graph one whole-array operation at a time, on one core. For cloths
+with millions of vertices, a DomainDecomposition splits the graph into domains and steps each
+domain in a worker process of its own.
+
+Every vertex is owned by one domain, chosen by partition in one of two ways:
+- "spatial" cuts the vertices in two across the longer side of their bounding box, then cuts
+    each half again, until there is one piece per domain (recursive coordinate bisection)
+- "graph" lists the vertices in breadth first order from a vertex at the far end of the graph
+    and cuts the list into runs, so each domain is a band a few edges wide whatever the layout
+Both balance the number of vertices plus edge ends, which is what a step's work grows with.
+
+Each worker keeps an ArrayState of the vertices its domain owns followed by its halo, the
+other endpoints of the edges touching them. It steps every edge touching an owned vertex, in
+the same order as the whole graph does, so the owned vertices get exactly the same forces as
+in a single process; what the step does to the halo vertices is thrown away. Between substeps
+each worker writes the positions of its vertices that are in other domains' halos to a shared
+boundary buffer, and reads its own halo back from there, so only those positions are exchanged.
+When the frame ends every worker writes its vertices back to the graph's GraphStore, whose
+positions, velocities and pins live in shared memory while the decomposition is open.
+
+The vertices end up exactly where SpringMassGraph.run_substeps, with sleeping off and one edge
+thread, would put them, with the same number of substeps. Only the energies, which are summed
+domain by domain, can differ in the last digits.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from dataclasses import dataclass
+import multiprocessing
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable
+import numpy as np
+import array_physics
+import substepping
+from array_physics import ArrayState
+from substepping import Motion, Substepping
+
+if TYPE_CHECKING:
+    from graph import SpringMassGraph
+
+# the ways partition can split a graph
+METHODS = ("spatial", "graph")
+# the vertex arrays of the graph's GraphStore that are moved into shared memory
+SHARED_FIELDS = ("x", "y", "vx", "vy", "pinned")
+
+
+@dataclass
+class Domain:
+    """The vertices and edges stepped by one worker process.
+
+    Instance Attributes:
+    - index: the number of this domain
+    - vertices: the graph's indices of the vertices the domain owns, followed by its halo
+    - n_owned: how many of vertices the domain owns
+    - start, end: the endpoints, as indices into vertices, of every edge touching an owned
+        vertex, in the graph's order
+    - rest: the rest length of each of those edges
+    - mass: the mass of each of vertices
+    - owned_edges: the indices, into start, of the edges whose energy this domain counts,
+        which are those starting at an owned vertex
+    - send: the indices, into vertices, of the owned vertices in another domain's halo
+    - send_slots: where in the boundary buffer each of send is written
+    - halo_slots: where in the boundary buffer each halo vertex is read from
+
+    Representation Invariants:
+    - 0 <= self.n_owned <= len(self.vertices)
+    - len(self.halo_slots) == len(self.vertices) - self.n_owned
+    - len(self.send) == len(self.send_slots)
+    """
+    index: int
+    vertices: np.ndarray
+    n_owned: int
+    start: np.ndarray
+    end: np.ndarray
+    rest: np.ndarray
+    mass: np.ndarray
+    owned_edges: np.ndarray
+    send: np.ndarray
+    send_slots: np.ndarray
+    halo_slots: np.ndarray
+
+
+@dataclass
+class DomainLoad:
+    """How much work one domain has done since its DomainDecomposition was opened.
+
+    Instance Attributes:
+    - vertices: the number of vertices the domain owns
+    - edges: the number of edges it steps, including those shared with other domains
+    - halo: the number of vertices whose positions it reads from other domains every substep
+    - substeps: the number of substeps it has run
+    - compute_seconds: the time spent stepping the domain
+    - communication_seconds: the time spent copying vertices to and from the graph,
+        exchanging halos and waiting for the other domains
+    """
+    vertices: int
+    edges: int
+    halo: int
+    substeps: int = 0
+    compute_seconds: float = 0.0
+    communication_seconds: float = 0.0
+
+
+def partition(state: ArrayState, n_domains: int, method: str = "spatial") -> np.ndarray:
+    """Return the domain, in range(n_domains), that owns each vertex of state, found with the
+    given method (one of METHODS).
+
+    >>> state = ArrayState(np.array([0.0, 30.0, 10.0, 20.0]), np.zeros(4), np.zeros(4),
+    ...                    np.zeros(4), np.ones(4), np.zeros(4, dtype=bool),
+    ...                    np.array([0, 2, 3]), np.array([2, 3, 1]), np.ones(3))
+    >>> partition(state, 2, "spatial")
+    array([0, 1, 0, 1])
+    >>> partition(state, 2, "graph")
+    array([1, 0, 1, 0])
+    """
+    n = len(state.x)
+    weights = 1 + np.bincount(state.start, minlength=n) + np.bincount(state.end, minlength=n)
+    owner = np.zeros(n, dtype=np.intp)
+    if method == "spatial":
+        _bisect(np.arange(n), state, weights, range(n_domains), owner)
+    else:
+        order = _breadth_first_order(n, state.start, state.end)
+        before = np.cumsum(weights[order]) - weights[order]
+        total = max(int(np.sum(weights)), 1)
+        owner[order] = np.minimum(before * n_domains // total, n_domains - 1)
+    return owner
+
+
+def _bisect(vertices: np.ndarray, state: ArrayState, weights: np.ndarray, domains: range,
+            owner: np.ndarray) -> None:
+    """Split vertices between domains by recursive coordinate bisection, writing the domain
+    of each into owner."""
+    if len(domains) == 1 or len(vertices) == 0:
+        owner[vertices] = domains.start
+        return
+    x, y = state.x[vertices], state.y[vertices]
+    coordinates = x if np.ptp(x) >= np.ptp(y) else y
+    order = vertices[np.argsort(coordinates, kind="stable")]
+    cumulative = np.cumsum(weights[order])
+    half = len(domains) // 2
+    cut = min(int(np.searchsorted(cumulative, cumulative[-1] * half / len(domains))) + 1,
+              len(order))
+    _bisect(order[:cut], state, weights, domains[:half], owner)
+    _bisect(order[cut:], state, weights, domains[half:], owner)
+
+
+def _breadth_first_order(n: int, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Return the n vertices of the graph with the given edges in breadth first order.
+
+    Each connected component is searched from a vertex at the far end of it from its lowest
+    vertex, so it is listed in thin bands. Vertices without edges come last.
+    """
+    heads = np.concatenate([start, end])
+    neighbours = np.concatenate([end, start])[np.argsort(heads, kind="stable")]
+    offsets = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(heads, minlength=n), out=offsets[1:])
+
+    isolated = offsets[1:] == offsets[:-1]
+    visited = isolated.copy()
+    order = []
+    root = 0
+    while root < n:
+        root += int(np.argmin(visited[root:]))
+        if visited[root]:
+            break
+        component = np.concatenate(_levels(root, offsets, neighbours, visited))
+        visited[component] = False
+        far = component[-1]
+        order.extend(_levels(far, offsets, neighbours, visited))
+    order.append(np.flatnonzero(isolated))
+    return np.concatenate(order)
+
+
+def _levels(root: int, offsets: np.ndarray, neighbours: np.ndarray,
+            visited: np.ndarray) -> list[np.ndarray]:
+    """Return the vertices not yet visited reachable from root, one array per distance from
+    root, and mark them visited. The neighbours of vertex i are neighbours[offsets[i]:
+    offsets[i + 1]]."""
+    levels = []
+    frontier = np.array([root])
+    visited[root] = True
+    while len(frontier) > 0:
+        levels.append(frontier)
+        first = offsets[frontier]
+        counts = offsets[frontier + 1] - first
+        positions = np.arange(np.sum(counts)) + np.repeat(first - (np.cumsum(counts) - counts),
+                                                          counts)
+        frontier = np.unique(neighbours[positions])
+        frontier = frontier[~visited[frontier]]
+        visited[frontier] = True
+    return levels
+
+
+def split_domains(state: ArrayState, owner: np.ndarray,
+                  n_domains: int) -> tuple[list[Domain], int]:
+    """Return the Domain of each of the n_domains domains of state, whose vertices are owned
+    as given by owner (see partition), and the size of the boundary buffer they share."""
+    start, end = state.start, state.end
+    start_owner, end_owner = owner[start], owner[end]
+    cut = start_owner != end_owner
+    boundary = np.unique(np.concatenate([start[cut], end[cut]]))
+
+    domains = []
+    local = np.empty(len(owner), dtype=np.intp)
+    for d in range(n_domains):
+        owned = np.flatnonzero(owner == d)
+        edges = np.flatnonzero((start_owner == d) | (end_owner == d))
+        endpoints = np.concatenate([start[edges], end[edges]])
+        halo = np.unique(endpoints[owner[endpoints] != d])
+        vertices = np.concatenate([owned, halo])
+        local[vertices] = np.arange(len(vertices))
+        send = np.flatnonzero(np.isin(owned, boundary))
+        domains.append(Domain(
+            index=d, vertices=vertices, n_owned=len(owned),
+            start=local[start[edges]], end=local[end[edges]], rest=state.rest[edges],
+            mass=state.mass[vertices], owned_edges=np.flatnonzero(start_owner[edges] == d),
+            send=send, send_slots=np.searchsorted(boundary, owned[send]),
+            halo_slots=np.searchsorted(boundary, halo),
+        ))
+    return domains, len(boundary)
+
+
+class DomainDecomposition:
+    """Steps a graph with the numpy backend in one worker process per domain.
+
+    While the decomposition is open, use its run_substeps and step in place of the graph's.
+    The graph may be read and drawn, and its vertices moved, pinned and unpinned, in between,
+    but vertices and edges may only be added or removed once close has moved the graph back
+    out of shared memory. Use it in a with statement to close it at the end.
+
+    The workers are started fresh rather than forked, so a script using a DomainDecomposition
+    must only create it under if __name__ == "__main__".
+
+    Instance Attributes:
+    - graph: the graph being stepped
+    - method: how the graph was partitioned, one of METHODS
+    - domains: the domains the graph was split into
+    - loads: the work done by each domain, in the same order
+
+    Representation Invariants:
+    - len(self.domains) == len(self.loads) == len(self._connections)
+    """
+    graph: "SpringMassGraph"
+    method: str
+    domains: list[Domain]
+    loads: list[DomainLoad]
+    _n_edges: int
+    _shared: SharedMemory | None
+    _arrays: dict[str, np.ndarray] | None
+    _barrier: threading.Barrier
+    _connections: list[Connection]
+    _processes: list[multiprocessing.Process]
+
+    def __init__(self, graph: "SpringMassGraph", n_domains: int = os.cpu_count() or 1,
+                 method: str = "spatial") -> None:
+        """Split graph into n_domains domains with the given method and start their workers.
+
+        Raise ValueError if graph doesn't use the numpy backend, has no vertices or has
+        all-pairs springs, if n_domains is less than 1, or if method is not one of METHODS.
+        """
+        store = graph.store
+        if store is None:
+            raise ValueError("domain decomposition needs a graph with the numpy backend")
+        if graph.all_pairs is not None:
+            # every vertex they join would be on the boundary of every domain
+            raise ValueError("a graph with all-pairs springs can't be split into domains")
+        if store.n_vertices == 0:
+            raise ValueError("an empty graph has no domains")
+        if n_domains < 1:
+            raise ValueError(f"need at least 1 domain, not {n_domains}")
+        if method not in METHODS:
+            raise ValueError(f"unknown method {method!r}, expected one of {METHODS}")
+
+        self.graph = graph
+        self.method = method
+        self.domains, n_boundary = split_domains(store, partition(store, n_domains, method),
+                                                 n_domains)
+        self.loads = [DomainLoad(d.n_owned, len(d.start), len(d.vertices) - d.n_owned)
+                      for d in self.domains]
+        self._n_edges = store.n_edges
+
+        fields = _fields(store.n_vertices, n_boundary, n_domains)
+        self._shared = SharedMemory(create=True, size=_size(fields))
+        self._arrays = _views(self._shared, fields)
+        arrays = store.arrays()
+        for name in SHARED_FIELDS:
+            self._arrays[name][:] = arrays[name]
+            arrays[name] = self._arrays[name]
+        store.use_arrays(arrays)
+
+        context = multiprocessing.get_context("spawn")
+        # kept until close, since the workers only find the barrier once they have started
+        self._barrier = context.Barrier(n_domains)
+        self._connections = []
+        self._processes = []
+        for domain in self.domains:
+            ours, theirs = context.Pipe()
+            process = context.Process(
+                target=_work, args=(domain, self._shared.name, fields, self._barrier, theirs),
+                name=f"domain {domain.index}", daemon=True
+            )
+            process.start()
+            theirs.close()
+            self._connections.append(ours)
+            self._processes.append(process)
+
+    def __enter__(self) -> "DomainDecomposition":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def run_substeps(self) -> None:
+        """Advance the graph by one frame, like SpringMassGraph.run_substeps with sleeping off,
+        split into substeps as the graph's substepping allows."""
+        graph = self.graph
+        settings = graph.substepping
+        if settings.min_substeps == settings.max_substeps:
+            self._run(graph.SUBSTEPS, settings.min_substeps, None)
+        else:
+            self._run(graph.SUBSTEPS, None, settings)
+
+    def step(self, dt: float = 1.0) -> None:
+        """Run one physics step of length dt, like SpringMassGraph.step."""
+        self._run(dt, 1, None)
+
+    def close(self) -> None:
+        """Stop the workers and move the graph back out of shared memory.
+
+        Does nothing if self is already closed.
+        """
+        if self._shared is None:
+            return
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass  # the worker has stopped already
+        for process, connection in zip(self._processes, self._connections):
+            process.join()
+            connection.close()
+
+        store = self.graph.store
+        if store is not None:
+            arrays = store.arrays()
+            for name in SHARED_FIELDS:
+                arrays[name] = np.array(arrays[name])
+            store.use_arrays(arrays)
+        self._arrays = None
+        try:
+            self._shared.close()
+        except BufferError:
+            pass  # arrays taken from the graph while open keep the memory mapped until freed
+        self._shared.unlink()
+        self._shared = None
+
+    def _run(self, frame_time: float, substeps: int | None,
+             settings: Substepping | None) -> None:
+        """Advance the graph by frame_time of simulated time, split into substeps substeps, or
+        as many as choose_substeps picks with settings if substeps is None.
+
+        Raise ValueError if self is closed or the graph's vertices or edges have changed, and
+        close self and raise the error of any worker that fails.
+        """
+        graph = self.graph
+        store = graph.store
+        if self._arrays is None:
+            raise ValueError("the domain decomposition is closed")
+        if store is None or store.n_edges != self._n_edges \
+                or not np.shares_memory(store.x, self._arrays["x"]) \
+                or store.n_vertices != len(self._arrays["x"]):
+            raise ValueError("the graph's vertices or edges changed while it was decomposed")
+
+        sample = graph.energy.next_frame()
+        constants = (graph.spring_constant, graph.friction, graph.gravity)
+        command = (constants, graph.size, frame_time, substeps, settings, sample)
+        for connection in self._connections:
+            connection.send(command)
+        results = [connection.recv() for connection in self._connections]
+
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            self.close()
+            # the other workers only stopped because the first failing one broke the barrier
+            raise next((error for error in errors
+                        if not isinstance(error, threading.BrokenBarrierError)), errors[0])
+
+        potential_energy = kinetic_energy = 0.0
+        for load, result in zip(self.loads, results):
+            substeps, domain_potential, domain_kinetic, compute, communication = result
+            load.substeps += substeps
+            load.compute_seconds += compute
+            load.communication_seconds += communication
+            potential_energy += domain_potential
+            kinetic_energy += domain_kinetic
+        if sample:
+            graph.metrics.elastic_potential_energy = potential_energy
+            graph.metrics.kinetic_energy = kinetic_energy
+            graph.energy.record(potential_energy, kinetic_energy)
+        graph.metrics.substeps = substeps
+        graph.vertices_moved()
+
+
+class _Worker:
+    """One domain, as stepped inside its worker process.
+
+    Instance Attributes:
+    - domain: the domain being stepped
+    - arrays: the shared arrays (see _fields)
+    - barrier: the barrier every worker waits at before reading what the others have written
+    - state: the domain's owned vertices, then its halo, and the edges touching them
+    - communication_seconds: the time spent communicating in the current command
+    """
+    domain: Domain
+    arrays: dict[str, np.ndarray]
+    barrier: threading.Barrier
+    state: ArrayState
+    communication_seconds: float
+
+    def __init__(self, domain: Domain, arrays: dict[str, np.ndarray],
+                 barrier: threading.Barrier) -> None:
+        self.domain = domain
+        self.arrays = arrays
+        self.barrier = barrier
+        n = len(domain.vertices)
+        self.state = ArrayState(np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n), domain.mass,
+                                np.zeros(n, dtype=np.bool_), domain.start, domain.end,
+                                domain.rest)
+        self.communication_seconds = 0.0
+
+    def run(self, constants: tuple, size: tuple[int, int], frame_time: float,
+            substeps: int | None, settings: Substepping | None, sample: bool) -> tuple:
+        """Run a command from DomainDecomposition._run. Return (substeps,
+        elastic_potential_energy, kinetic_energy, compute_seconds, communication_seconds),
+        where the energies are those of the last substep if sample is True and 0 otherwise."""
+        began = time.perf_counter()
+        self.communication_seconds = 0.0
+        self._communicate(self._load)
+        if substeps is None:
+            substeps = self._choose_substeps(constants, size, frame_time, settings)
+        dt = frame_time / substeps
+        owned = (self.domain.n_owned, self.domain.owned_edges)
+        potential_energy = kinetic_energy = 0.0
+        for i in range(substeps):
+            energy = sample and i == substeps - 1
+            energies = array_physics.step(self.state, constants, size, dt=dt, owned=owned,
+                                          energy=energy)
+            if energy:
+                potential_energy, kinetic_energy = energies
+            if i < substeps - 1:
+                # the buffers alternate, so a worker can write the next substep's positions
+                # while a slower one is still reading this substep's
+                self._communicate(self._exchange_halo, i % 2)
+        # every worker must have loaded its halo before any writes its vertices back
+        self._communicate(self.barrier.wait)
+        self._communicate(self._save)
+        seconds = time.perf_counter() - began
+        return (substeps, float(potential_energy), float(kinetic_energy),
+                seconds - self.communication_seconds, self.communication_seconds)
+
+    def _communicate(self, function: Callable, *args: Any) -> Any:
+        """Return function(*args), counting the time it takes as communication."""
+        began = time.perf_counter()
+        result = function(*args)
+        self.communication_seconds += time.perf_counter() - began
+        return result
+
+    def _load(self) -> None:
+        """Copy the domain's vertices, halo included, out of the graph."""
+        vertices = self.domain.vertices
+        for name in SHARED_FIELDS:
+            np.take(self.arrays[name], vertices, out=getattr(self.state, name))
+
+    def _save(self) -> None:
+        """Copy the owned vertices' positions and velocities back into the graph."""
+        n = self.domain.n_owned
+        owned = self.domain.vertices[:n]
+        for name in ("x", "y", "vx", "vy"):
+            self.arrays[name][owned] = getattr(self.state, name)[:n]
+
+    def _exchange_halo(self, buffer: int) -> None:
+        """Write the positions of the vertices in other domains' halos to the given boundary
+        buffer, wait for every domain to do the same, and read the halo's positions back."""
+        domain, state = self.domain, self.state
+        boundary = self.arrays["boundary"][buffer]
+        boundary[0, domain.send_slots] = state.x[domain.send]
+        boundary[1, domain.send_slots] = state.y[domain.send]
+        self.barrier.wait()
+        state.x[domain.n_owned:] = boundary[0, domain.halo_slots]
+        state.y[domain.n_owned:] = boundary[1, domain.halo_slots]
+
+    def _choose_substeps(self, constants: tuple, size: tuple[int, int], frame_time: float,
+                         settings: Substepping) -> int:
+        """Return the number of substeps choose_substeps picks for the whole graph.
+
+        The largest error rate is the largest of each domain's, but needs the graph's omega,
+        so the domains first share their omegas and then their rates.
+        """
+        motion = substepping.motion(self.state, constants, size)
+        n, d = self.domain.n_owned, self.domain.index
+        omegas, rates = self.arrays["omega"], self.arrays["rate"]
+        # the halo's springs are only partly known, so its stiffness is at most its owner's
+        omegas[d] = motion.omega
+        self._communicate(self.barrier.wait)
+        omega = float(np.max(omegas))
+        rates[d] = np.max(motion.acceleration[:n] + omega * motion.speed[:n], initial=0)
+        self._communicate(self.barrier.wait)
+        graph_motion = Motion(rates.copy(), np.zeros(len(rates)), omega)
+        return substepping.choose_substeps(graph_motion, frame_time, settings)
+
+
+def _work(domain: Domain, shared_name: str, fields: list[tuple], barrier: threading.Barrier,
+          connection: Connection) -> None:
+    """Step domain as commanded through connection, in a worker process, until sent None.
+
+    Errors are sent back instead of results, after breaking the barrier so the other workers
+    don't wait forever.
+    """
+    shared = SharedMemory(shared_name)
+    worker = _Worker(domain, _views(shared, fields), barrier)
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        try:
+            connection.send(worker.run(*command))
+        except Exception as error:  # pylint: disable=broad-except
+            barrier.abort()
+            connection.send(error)
+    # the arrays must be gone before the shared memory can be closed
+    worker = None
+    shared.close()
+
+
+def _fields(n_vertices: int, n_boundary: int, n_domains: int) -> list[tuple]:
+    """Return the (name, shape, dtype) of each array in the shared memory of a decomposition:
+    the shared vertex arrays, the two boundary buffers of positions, and each domain's omega
+    and error rate (see _Worker._choose_substeps)."""
+    return [("x", (n_vertices,), np.float64), ("y", (n_vertices,), np.float64),
+            ("vx", (n_vertices,), np.float64), ("vy", (n_vertices,), np.float64),
+            ("boundary", (2, 2, n_boundary), np.float64),
+            ("omega", (n_domains,), np.float64), ("rate", (n_domains,), np.float64),
+            ("pinned", (n_vertices,), np.bool_)]
+
+
+def _size(fields: list[tuple]) -> int:
+    """Return the number of bytes the arrays of fields take, laid out by _views."""
+    return sum(_padded(np.dtype(dtype).itemsize * int(np.prod(shape)))
+               for _, shape, dtype in fields)
+
+
+def _views(shared: SharedMemory, fields: list[tuple]) -> dict[str, np.ndarray]:
+    """Return arrays, by name, laid out one after another in shared as described by fields."""
+    arrays = {}
+    offset = 0
+    for name, shape, dtype in fields:
+        arrays[name] = np.ndarray(shape, dtype, shared.buf, offset)
+        offset += _padded(arrays[name].nbytes)
+    return arrays
+
+
+def _padded(n_bytes: int) -> int:
+    """Return n_bytes rounded up to a multiple of 8, so every array starts aligned."""
+    return -(-n_bytes // 8) * 8
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["dataclasses", "multiprocessing", "multiprocessing.connection",
+                              "multiprocessing.shared_memory", "os", "threading", "time",
+                              "typing", "numpy", "array_physics", "substepping", "graph"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
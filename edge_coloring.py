@@ -0,0 +1,165 @@
+"""CSC 111 Final Project: Edge Coloring
+
+Module Description
+==================
+Every spring pushes on both of its endpoints, so two threads applying the forces of different
+springs at once could both update the velocity of a vertex they share and lose one update.
+Coloring the edges so that no two edges of the same color share a vertex solves this without
+locks: the edges of one color (a color class) touch every vertex at most once, so a class can
+be split between any number of threads, and the classes are applied one after another.
+
+An EdgeColoring is kept up to date as edges are added and removed, the same way as the graph's
+Incidence: new edges take the lowest color not used next to them, and removing an edge can't
+make two edges next to each other share a color. This uses at most twice as many colors as
+the most edges at any vertex, so a cloth needs around 5 classes.
+
+ParallelEdges applies the spring forces of a graph with the numpy backend this way. The pure
+python backend can't be sped up by threads, since only one thread runs python code at a time,
+but numpy lets other threads run while it works through arrays.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from array_physics import ArrayState, apply_edge_class
+from incidence import Incidence
+
+# graphs with fewer edges than this, or fewer edges per color class on average than
+# MIN_CLASS_EDGES, are stepped on one thread, since handing out the work costs more than it saves
+MIN_PARALLEL_EDGES = 20000
+MIN_CLASS_EDGES = 2000
+
+
+class EdgeColoring:
+    """A coloring of the edges of a graph, by index, in which no two edges of the same color
+    share a vertex.
+
+    Instance Attributes:
+    - colors: colors[e] is the color of edge e
+
+    Representation Invariants:
+    - no two edges sharing a vertex have the same color
+    """
+    colors: list[int]
+    _classes: list[np.ndarray] | None
+
+    def __init__(self) -> None:
+        self.colors = []
+        self._classes = None
+
+    @property
+    def n_edges(self) -> int:
+        """The number of edges colored."""
+        return len(self.colors)
+
+    def add_edge(self, incidence: Incidence) -> None:
+        """Color the edge with index self.n_edges, which incidence must already track, with the
+        lowest color not used by an edge sharing a vertex with it.
+
+        >>> incidence = Incidence()
+        >>> for _ in range(4):
+        ...     incidence.add_vertex()
+        >>> coloring = EdgeColoring()
+        >>> for i, j in [(0, 1), (1, 2), (2, 3), (3, 0), (0, 2)]:
+        ...     incidence.add_edge(i, j)
+        ...     coloring.add_edge(incidence)
+        >>> coloring.colors
+        [0, 1, 0, 1, 2]
+        """
+        e = len(self.colors)
+        i, j = incidence.endpoints[e]
+        colors = self.colors
+        used = {colors[f] for f in incidence.edges_of[i] if f < e}
+        used.update(colors[f] for f in incidence.edges_of[j] if f < e)
+        color = 0
+        while color in used:
+            color += 1
+        colors.append(color)
+        self._classes = None
+
+    def remove_edge(self, e: int) -> None:
+        """Swap-remove edge e, like Incidence.remove_edge: the last edge takes its index and
+        keeps its color."""
+        last_color = self.colors.pop()
+        if e < len(self.colors):
+            self.colors[e] = last_color
+        self._classes = None
+
+    def classes(self) -> list[np.ndarray]:
+        """Return the indices of the edges of each color, one array per color in use.
+
+        The list is cached, and the same list is returned until an edge is added or removed.
+        """
+        if self._classes is None:
+            colors = np.array(self.colors, dtype=np.intp)
+            order = np.argsort(colors, kind="stable")
+            bounds = np.flatnonzero(np.diff(colors[order])) + 1
+            self._classes = [] if len(order) == 0 else np.split(order, bounds)
+        return self._classes
+
+
+class ParallelEdges:
+    """Applies the spring forces of a graph one color class at a time, with each class split
+    evenly between threads.
+
+    Instance Attributes:
+    - threads: the number of threads each class is split between, including the calling one
+
+    Representation Invariants:
+    - self.threads >= 1
+    """
+    threads: int
+    _executor: ThreadPoolExecutor | None
+    _classes: list[np.ndarray] | None
+    _chunks: list[list[np.ndarray]]
+
+    def __init__(self, threads: int) -> None:
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(threads - 1, thread_name_prefix="edges") \
+            if threads > 1 else None
+        self._classes = None
+        self._chunks = []
+
+    def use_classes(self, classes: list[np.ndarray]) -> None:
+        """Apply the forces of the edges in classes from now on. Every class must be a set of
+        edges no two of which share a vertex, such as those of EdgeColoring.classes."""
+        if classes is not self._classes:
+            self._classes = classes
+            self._chunks = [np.array_split(color_class, self.threads) for color_class in classes]
+
+    def update_edges(self, state: ArrayState, spring_constant: float, dt: float = 1.0,
+                     energy: bool = True) -> float:
+        """Apply the spring forces of state's edges to its velocities for a step of length dt,
+        like array_physics._update_edges, and return their elastic potential energy, or 0.0
+        if energy is False."""
+        potential_energy = 0.0
+        for chunks in self._chunks:
+            # the calling thread takes the first chunk of each class instead of waiting idle
+            futures = [self._executor.submit(apply_edge_class, state, spring_constant, dt, chunk,
+                                             energy)
+                       for chunk in chunks[1:]]
+            potential_energy += apply_edge_class(state, spring_constant, dt, chunks[0], energy)
+            # every chunk of a class must be done before the next class starts
+            potential_energy += sum(future.result() for future in futures)
+        return potential_energy
+
+    def shutdown(self) -> None:
+        """Stop the threads once they are idle."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["concurrent.futures", "numpy", "array_physics", "incidence"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -0,0 +1,154 @@
+"""CSC 111 Final Project: Energy Sampling
+
+Module Description
+==================
+Summing the elastic potential and kinetic energy of a graph costs about as much as a third of a
+physics step, and a frame is many steps, but the energies are only ever read now and then: once
+a frame by the window, once every few steps by a headless run, and so on. So the physics only
+works them out on the frames somebody asked for.
+
+Each consumer subscribes to a graph's EnergyMonitor with how often it wants a sample, and reads
+the samples from the EnergySeries it gets back, a ring buffer of the most recent ones. The
+physics asks the monitor at the start of every frame whether any series is due, and only then
+sums the energies, on the frame's last step. With no subscribers, no energy is summed at all.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import numpy as np
+
+# the default number of samples an EnergySeries keeps
+CAPACITY = 1024
+
+
+class EnergySeries:
+    """The most recent energy samples of a graph, oldest first, in a ring buffer.
+
+    Instance Attributes:
+    - every: a sample is taken at the end of every this many frames
+    - capacity: the most samples kept; older ones are overwritten
+
+    Representation Invariants:
+    - self.every >= 1
+    - self.capacity >= 1
+    - 0 <= len(self) <= self.capacity
+
+    >>> series = EnergySeries(capacity=2)
+    >>> for frame in range(1, 4):
+    ...     series.append(frame, 10.0 * frame, 1.0 * frame)
+    >>> len(series), series.latest()
+    (2, (3, 30.0, 3.0))
+    >>> series.samples()
+    (array([2, 3]), array([20., 30.]), array([2., 3.]))
+    """
+    every: int
+    capacity: int
+    _frames: np.ndarray
+    _potential: np.ndarray
+    _kinetic: np.ndarray
+    _count: int
+
+    def __init__(self, every: int = 1, capacity: int = CAPACITY) -> None:
+        if every < 1 or capacity < 1:
+            raise ValueError("a series needs every and capacity to be at least 1")
+        self.every = every
+        self.capacity = capacity
+        self._frames = np.zeros(capacity, dtype=np.int64)
+        self._potential = np.zeros(capacity)
+        self._kinetic = np.zeros(capacity)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
+
+    def append(self, frame: int, potential_energy: float, kinetic_energy: float) -> None:
+        """Add a sample taken at the end of the given frame, overwriting the oldest sample if
+        self is full."""
+        slot = self._count % self.capacity
+        self._frames[slot] = frame
+        self._potential[slot] = potential_energy
+        self._kinetic[slot] = kinetic_energy
+        self._count += 1
+
+    def latest(self) -> tuple[int, float, float] | None:
+        """Return the (frame, elastic potential energy, kinetic energy) of the newest sample,
+        or None if there are none yet."""
+        if self._count == 0:
+            return None
+        slot = (self._count - 1) % self.capacity
+        return (int(self._frames[slot]), float(self._potential[slot]),
+                float(self._kinetic[slot]))
+
+    def samples(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return copies of the frames, elastic potential energies and kinetic energies of the
+        samples kept, oldest first."""
+        order = (np.arange(len(self)) + max(self._count - self.capacity, 0)) % self.capacity
+        return self._frames[order], self._potential[order], self._kinetic[order]
+
+    def clear(self) -> None:
+        """Forget every sample."""
+        self._count = 0
+
+
+class EnergyMonitor:
+    """Decides which frames of a graph have their energies summed, and hands the sums out to
+    the series subscribed.
+
+    Instance Attributes:
+    - frame: the number of frames started so far
+    - series: the series subscribed, in the order they subscribed
+
+    >>> monitor = EnergyMonitor()
+    >>> often, rarely = monitor.subscribe(every=2), monitor.subscribe(every=3)
+    >>> for _ in range(6):
+    ...     if monitor.next_frame():
+    ...         monitor.record(1.0, 0.0)
+    >>> often.samples()[0], rarely.samples()[0]
+    (array([2, 4, 6]), array([3, 6]))
+    """
+    frame: int
+    series: list[EnergySeries]
+
+    def __init__(self) -> None:
+        self.frame = 0
+        self.series = []
+
+    def subscribe(self, every: int = 1, capacity: int = CAPACITY) -> EnergySeries:
+        """Return a new series that is sent the energies at the end of every every-th frame,
+        keeping the last capacity of them. Unsubscribe it when done reading."""
+        series = EnergySeries(every, capacity)
+        self.series.append(series)
+        return series
+
+    def unsubscribe(self, series: EnergySeries) -> None:
+        """Stop sampling energies for series."""
+        self.series.remove(series)
+
+    def next_frame(self) -> bool:
+        """Start the next frame, and return whether any series wants its energies."""
+        self.frame += 1
+        frame = self.frame
+        return any(frame % series.every == 0 for series in self.series)
+
+    def record(self, potential_energy: float, kinetic_energy: float) -> None:
+        """Send the energies at the end of the current frame to every series that wants them.
+        """
+        frame = self.frame
+        for series in self.series:
+            if frame % series.every == 0:
+                series.append(frame, potential_energy, kinetic_energy)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["numpy"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
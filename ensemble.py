@@ -0,0 +1,131 @@
+"""CSC 111 Final Project: Ensemble Simulation
+
+Module Description
+==================
+Optimization studies run the same graph under many (spring_constant, friction, gravity)
+triples. Rather than running each one separately, an Ensemble stacks B copies of one graph's
+state into arrays of shape (B, V) and steps them all at once with array_physics, each copy
+using its own constants.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import numpy as np
+import array_physics
+from array_physics import ArrayState
+from graph import SpringMassGraph
+
+# calculate_potential_score runs for 10 seconds of 60 frames of 16 substeps
+MAX_SCORE_STEPS = 10 * 60 * 16
+
+
+class Ensemble:
+    """B independent copies of one graph, stepped together.
+
+    Instance Attributes:
+    - state: the copies' state; x, y, vx and vy have shape (B, V) and the other arrays are
+        shared by every copy
+    - constants: the (spring_constant, friction, gravity) of each copy, with shape (B, 3)
+    - size: the size of the screen in pixels, as in SpringMassGraph
+    """
+    state: ArrayState
+    constants: np.ndarray
+    size: tuple[int, int]
+
+    def __init__(self, graph: SpringMassGraph,
+                 constants: list[tuple[float, float, float]]) -> None:
+        """Create an ensemble of len(constants) copies of graph's current state."""
+        base = graph.store if graph.store is not None \
+            else array_physics.gather(graph.vertices, graph.edges)
+        if graph.all_pairs is not None:
+            # every copy shares the same edges, so the springs are made edges once
+            base = graph.all_pairs.with_edges(base)
+        copies = len(constants)
+        self.state = ArrayState(
+            x=np.tile(base.x, (copies, 1)),
+            y=np.tile(base.y, (copies, 1)),
+            vx=np.tile(base.vx, (copies, 1)),
+            vy=np.tile(base.vy, (copies, 1)),
+            mass=np.array(base.mass),
+            pinned=np.array(base.pinned),
+            start=np.array(base.start),
+            end=np.array(base.end),
+            rest=np.array(base.rest),
+        )
+        self.constants = np.array(constants, dtype=np.float64).reshape(copies, 3)
+        self.size = graph.size
+
+    def __len__(self) -> int:
+        return len(self.constants)
+
+    def step(self) -> tuple[np.ndarray, np.ndarray]:
+        """Step every copy once. Return the elastic potential and kinetic energy of each."""
+        return array_physics.step(self.state, self._constant_columns(self.constants), self.size)
+
+    def potential_scores(self, max_steps: int = MAX_SCORE_STEPS) -> list[float]:
+        """Return the score measurements.calculate_potential_score would give each copy.
+
+        Copies that have come to rest stop being stepped, so a run costs as much as its
+        slowest copy rather than len(self) full runs. This advances self.state.
+        """
+        scores = np.zeros(len(self))
+        running = np.arange(len(self))
+        state = self.state
+        old_potential_energy = np.zeros(len(self))
+
+        for _i in range(max_steps):
+            potential_energy, kinetic_energy = array_physics.step(
+                state, self._constant_columns(self.constants[running]), self.size
+            )
+            done = (np.round(old_potential_energy, 5) == np.round(potential_energy, 5)) \
+                & (np.round(kinetic_energy, 5) == 0.0)
+            moving = ~done
+            scores[running[moving]] += potential_energy[moving] / (60.0 * 16.0)
+
+            if done.any():
+                self._write_back(state, running)
+                running = running[moving]
+                state = self._select(running)
+            old_potential_energy = potential_energy[moving]
+            if len(running) == 0:
+                break
+
+        self._write_back(state, running)
+        return [round(score, 4) for score in scores.tolist()]
+
+    def _select(self, members: np.ndarray) -> ArrayState:
+        """Return a copy of the state of the given members only."""
+        state = self.state
+        return ArrayState(x=state.x[members], y=state.y[members],
+                          vx=state.vx[members], vy=state.vy[members],
+                          mass=state.mass, pinned=state.pinned,
+                          start=state.start, end=state.end, rest=state.rest)
+
+    def _write_back(self, state: ArrayState, members: np.ndarray) -> None:
+        """Copy a state returned by _select back into self.state."""
+        if state is self.state:
+            return
+        self.state.x[members] = state.x
+        self.state.y[members] = state.y
+        self.state.vx[members] = state.vx
+        self.state.vy[members] = state.vy
+
+    @staticmethod
+    def _constant_columns(constants: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Split (B, 3) constants into three (B, 1) columns for array_physics.step."""
+        return constants[:, 0:1], constants[:, 1:2], constants[:, 2:3]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["numpy", "array_physics", "graph"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
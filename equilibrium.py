@@ -0,0 +1,266 @@
+"""CSC 111 Final Project: Static Equilibrium
+
+Module Description
+==================
+Stepping a graph until it stops moving can take thousands of steps, when often all we want is
+where it ends up. At rest every free vertex's spring forces cancel its weight, which is exactly
+where the energy
+
+    E = sum over edges of w * spring_energy(stretch) - sum over free vertices of mass * gravity * y
+
+is stationary. spring_energy is Hooke's k * stretch ** 2 / 2 while the force k * stretch is
+within MAX_FORCE, and grows linearly beyond that, matching the clamped force of a step. w is
+1/2 for an edge between two free vertices and 1 for an edge with a pinned endpoint, matching the
+multipliers in Edge.update.
+
+solve minimizes E with a projected truncated Newton method. Each Newton direction is found by
+conjugate gradients using Hessian-vector products computed edge by edge, so the Hessian is never
+formed, and the floor and walls are bounds on the free vertices' coordinates.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from dataclasses import dataclass
+import numpy as np
+from array_physics import ArrayState, MAX_FORCE
+
+# the default largest net force left on a free vertex for a state to count as at rest
+TOLERANCE = 1e-6
+# the default limit on Newton iterations
+MAX_ITERATIONS = 500
+# the limit on conjugate gradient iterations per Newton iteration
+MAX_CG_ITERATIONS = 250
+# spring lengths are treated as at least this long, like the 0.0001 in a physics step
+MIN_DISTANCE = 0.0001
+# a line search step is accepted if it decreases E by this fraction of the predicted decrease
+ARMIJO = 1e-4
+# the line search gives up on steps shorter than this
+MIN_STEP = 1e-12
+
+
+@dataclass
+class Equilibrium:
+    """A rest state found by solve.
+
+    Instance Attributes:
+    - x, y: the rest positions of the vertices
+    - energy: E, the spring energy minus the gravitational energy, at the rest state
+    - elastic_potential_energy: the elastic potential energy at the rest state, as in Metrics
+    - iterations: the number of Newton iterations taken
+    - converged: whether the largest net force on a free vertex fell within the tolerance
+    """
+    x: np.ndarray
+    y: np.ndarray
+    energy: float
+    elastic_potential_energy: float
+    iterations: int
+    converged: bool
+
+
+class _Springs:
+    """E, its gradient and its Hessian for one graph, over the coordinates z = [x, y].
+
+    Instance Attributes:
+    - n: the number of vertices
+    - start, end, rest: the edges, as in ArrayState
+    - weight: w for each edge, which is 0 if both endpoints are pinned
+    - spring_constant: $k$ in Hooke's law
+    - weight_gradient: the (constant) gradient of the gravitational part of E
+    - fixed: which coordinates belong to pinned vertices
+    - lower, upper: the bounds on each coordinate
+    """
+    n: int
+    start: np.ndarray
+    end: np.ndarray
+    rest: np.ndarray
+    weight: np.ndarray
+    spring_constant: float
+    weight_gradient: np.ndarray
+    fixed: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+    def __init__(self, state: ArrayState, spring_constant: float, gravity: float,
+                 size: tuple[int, int]) -> None:
+        width, height = size
+        free = ~np.asarray(state.pinned, dtype=np.bool_)
+        self.n = len(free)
+        self.start = np.asarray(state.start, dtype=np.intp)
+        self.end = np.asarray(state.end, dtype=np.intp)
+        self.rest = np.asarray(state.rest, dtype=np.float64)
+
+        start_free, end_free = free[self.start], free[self.end]
+        self.weight = np.where(start_free & end_free, 0.5, 1.0) * (start_free | end_free)
+        self.spring_constant = spring_constant
+        self.weight_gradient = np.concatenate(
+            (np.zeros(self.n), -gravity * np.where(free, state.mass, 0.0))
+        )
+
+        self.fixed = np.concatenate((~free, ~free))
+        self.lower = np.concatenate((np.where(free, 0.0, -np.inf), np.full(self.n, -np.inf)))
+        self.upper = np.concatenate((np.where(free, width, np.inf), np.where(free, height, np.inf)))
+
+    def evaluate(self, z: np.ndarray) -> tuple[float, np.ndarray, tuple]:
+        """Return E at z, its gradient, and the per-edge values hessian_product needs."""
+        n, start, end = self.n, self.start, self.end
+        x, y = z[:n], z[n:]
+        dx = x[start] - x[end]
+        dy = y[start] - y[end]
+        distance = np.maximum(np.sqrt(dx * dx + dy * dy), MIN_DISTANCE)
+        stretch = distance - self.rest
+
+        k = self.spring_constant
+        limit = MAX_FORCE / k if k > 0 else np.inf
+        elastic = np.abs(stretch) <= limit
+        force = np.clip(k * stretch, -MAX_FORCE, MAX_FORCE)
+        spring_energy = np.where(elastic, 0.5 * k * stretch * stretch,
+                                 MAX_FORCE * (np.abs(stretch) - 0.5 * limit))
+        energy = float(self.weight @ spring_energy + self.weight_gradient @ z)
+
+        ux, uy = dx / distance, dy / distance
+        fx = self.weight * force * ux
+        fy = self.weight * force * uy
+        gradient = np.concatenate((np.bincount(start, fx, n) - np.bincount(end, fx, n),
+                                   np.bincount(start, fy, n) - np.bincount(end, fy, n)))
+        gradient += self.weight_gradient
+
+        # the Hessian of an edge is a * u u^T + b * (I - u u^T), where b < 0 when compressed
+        along = self.weight * k * elastic
+        across = self.weight * force / distance
+        return energy, gradient, (ux, uy, along, across)
+
+    def hessian_product(self, cache: tuple, v: np.ndarray) -> np.ndarray:
+        """Return the Hessian of E, at the z cache was evaluated at, times v."""
+        n, start, end = self.n, self.start, self.end
+        ux, uy, along, across = cache
+        vx, vy = v[:n], v[n:]
+        ddx = vx[start] - vx[end]
+        ddy = vy[start] - vy[end]
+        projection = ux * ddx + uy * ddy
+        hx = along * projection * ux + across * (ddx - projection * ux)
+        hy = along * projection * uy + across * (ddy - projection * uy)
+        return np.concatenate((np.bincount(start, hx, n) - np.bincount(end, hx, n),
+                               np.bincount(start, hy, n) - np.bincount(end, hy, n)))
+
+    def elastic_potential_energy(self, z: np.ndarray) -> float:
+        """Return the elastic potential energy at z, as a physics step reports it."""
+        n = self.n
+        x, y = z[:n], z[n:]
+        dx = x[self.start] - x[self.end]
+        dy = y[self.start] - y[self.end]
+        stretch = np.maximum(np.sqrt(dx * dx + dy * dy), MIN_DISTANCE) - self.rest
+        return float(self.spring_constant * (stretch @ stretch))
+
+
+def solve(state: ArrayState, spring_constant: float, gravity: float, size: tuple[int, int],
+          tolerance: float = TOLERANCE, max_iterations: int = MAX_ITERATIONS) -> Equilibrium:
+    """Return the rest state reached by minimizing E from the positions in state.
+
+    Pinned vertices stay where they are, and free vertices stay within the screen, as when
+    stepping. state itself is not changed. Where a graph has several rest states (a compressed
+    spring can buckle either way) this finds one near the starting positions, which need not be
+    the one stepping would reach.
+    """
+    springs = _Springs(state, spring_constant, gravity, size)
+    z = np.clip(np.concatenate((state.x, state.y)).astype(np.float64),
+                springs.lower, springs.upper)
+    energy, gradient, cache = springs.evaluate(z)
+
+    converged = False
+    iteration = 0
+    while iteration < max_iterations:
+        # coordinates held at a bound by their gradient stay there this iteration
+        active = springs.fixed | ((z <= springs.lower) & (gradient > 0)) \
+            | ((z >= springs.upper) & (gradient < 0))
+        projected_gradient = np.where(active, 0.0, gradient)
+        if np.max(np.abs(projected_gradient), initial=0.0) <= tolerance:
+            converged = True
+            break
+        iteration += 1
+
+        direction, is_newton = _newton_direction(springs, cache, projected_gradient, active)
+        accepted = _line_search(springs, z, energy, gradient, direction, not is_newton)
+        if accepted is None:
+            break
+        z, energy, gradient, cache = accepted
+
+    n = springs.n
+    return Equilibrium(z[:n].copy(), z[n:].copy(), energy,
+                       springs.elastic_potential_energy(z), iteration, converged)
+
+
+def _newton_direction(springs: _Springs, cache: tuple, gradient: np.ndarray,
+                      active: np.ndarray) -> tuple[np.ndarray, bool]:
+    """Approximately solve H p = -gradient over the coordinates not in active with conjugate
+    gradients. Return p, and whether it is a Newton direction rather than -gradient, which is
+    used when the very first conjugate direction has no positive curvature."""
+    gradient_norm = np.sqrt(gradient @ gradient)
+    target = min(0.5, np.sqrt(gradient_norm)) * gradient_norm
+
+    p = np.zeros_like(gradient)
+    residual = -gradient
+    conjugate = residual.copy()
+    residual_squared = residual @ residual
+    for _i in range(MAX_CG_ITERATIONS):
+        product = springs.hessian_product(cache, conjugate)
+        product[active] = 0.0
+        curvature = conjugate @ product
+        if curvature <= 0:
+            # E is not convex along this direction, so stop with what we have
+            break
+        alpha = residual_squared / curvature
+        p += alpha * conjugate
+        residual -= alpha * product
+        new_residual_squared = residual @ residual
+        if np.sqrt(new_residual_squared) <= target:
+            break
+        conjugate = residual + (new_residual_squared / residual_squared) * conjugate
+        residual_squared = new_residual_squared
+
+    if not p.any():
+        return -gradient, False
+    return p, True
+
+
+def _line_search(springs: _Springs, z: np.ndarray, energy: float, gradient: np.ndarray,
+                 direction: np.ndarray, expand: bool) -> tuple | None:
+    """Return (z, energy, gradient, cache) at the first point z + step * direction, projected
+    onto the bounds, with step = 1, 1/2, 1/4, ..., that sufficiently decreases E. If expand,
+    keep doubling the step from 1 while E keeps decreasing instead, since -gradient says little
+    about how far to go. Return None if no step decreases E."""
+    step = 1.0
+    best = None
+    while step >= MIN_STEP:
+        trial = np.clip(z + step * direction, springs.lower, springs.upper)
+        evaluation = springs.evaluate(trial)
+        if evaluation[0] <= energy + ARMIJO * (gradient @ (trial - z)):
+            best = (trial,) + evaluation
+            break
+        step *= 0.5
+
+    while expand and best is not None:
+        step *= 2.0
+        trial = np.clip(z + step * direction, springs.lower, springs.upper)
+        if np.array_equal(trial, best[0]):
+            break
+        evaluation = springs.evaluate(trial)
+        if evaluation[0] >= best[1]:
+            break
+        best = (trial,) + evaluation
+
+    return best
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["dataclasses", "numpy", "array_physics"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -4,58 +4,257 @@ Module Description
 ==================
 Generate graphs and save them to csv files, creating our datasets
 
+The datasets are listed in a manifest (MANIFEST_FILE), a JSON list of entries like
+
+    {"generator": "ClothGraph",
+     "arguments": {"x_num": {"range": [10, 210]}, "y_num": 25, "separation": 10},
+     "output": "cloths/cloth{x_num}.csv"}
+
+where generator is one of GENERATORS and arguments are its keyword arguments. An argument given
+as a list, or as {"range": [start, stop, step]} (step is optional), makes the entry a family
+with one dataset for every combination of values, so the entry above is 200 cloths. Each
+dataset is saved to output, filled in with its arguments and taken relative to the manifest.
+
+Datasets are generated across a pool of processes, one per core by default. After each run,
+the hash of every dataset's entry and of the file written for it is recorded next to the
+manifest (HASHES_FILENAME), and the next run skips every dataset whose entry, file, and the code
+that makes it (SOURCE_CODE) are all unchanged. A dataset that is generated again but comes out
+holding the same graph as its file leaves the file as it is.
+
 Copyright Information
 =====================
 This file is licensed under the MIT License
 """
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import sys
+import numpy as np
+import graph_io
+import graph_types
+from graph import SpringMassGraph
 from graph_types import CompleteGraph, WheelGraph, PyramidGraph, ClothGraph
-from graph_io import save_to_csv
+from graph_io import load_graph, save_graph
+
+# the manifest of our datasets, in data/
+MANIFEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "manifest.json")
+# the name of the file, next to a manifest, recording what was generated from it
+HASHES_FILENAME = "generated.json"
+
+# the graph classes a manifest may name
+GENERATORS = {generator.__name__: generator
+              for generator in (WheelGraph, CompleteGraph, PyramidGraph, ClothGraph)}
+# the code that decides what a dataset holds: the generators, and the functions of graph_io that
+# write graphs. Changing it regenerates every dataset, while changing anything else, like the
+# physics, doesn't
+SOURCE_CODE = ((graph_types, ()),
+               (graph_io, ("save_graph", "save_to_csv", "_array_rows", "save_to_binary",
+                           "write_binary", "_binary_layout")))
+# the arrays of a graph that must match for a dataset's file to be kept
+GRAPH_FIELDS = ("x", "y", "pinned", "start", "end", "rest")
+
+
+@dataclass
+class Dataset:
+    """One graph to generate and save.
+
+    Instance Attributes:
+    - generator: the name of the graph class in GENERATORS
+    - arguments: the keyword arguments to create the graph with
+    - output: the file to save the graph to, in any format graph_io.save_graph knows
+
+    Representation Invariants:
+    - self.generator in GENERATORS
+    """
+    generator: str
+    arguments: dict
+    output: str
+
+    def key(self, source_hash: str) -> str:
+        """Return a hash of everything that decides what self's output holds, given a hash of
+        the code of SOURCE_CODE."""
+        spec = json.dumps([self.generator, self.arguments, source_hash], sort_keys=True)
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+
+def read_manifest(filename: str) -> list[Dataset]:
+    """Return every dataset listed in the manifest filename, families expanded, in order.
+
+    Raise ValueError if an entry names a generator not in GENERATORS, or if two datasets would
+    be saved to the same file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    with open(filename) as file:
+        entries = json.load(file)
+
+    datasets = []
+    for entry in entries:
+        generator = entry["generator"]
+        if generator not in GENERATORS:
+            raise ValueError(f"unknown generator {generator!r}, expected one of "
+                             f"{sorted(GENERATORS)}")
+        names = list(entry["arguments"])
+        values = [_expand(entry["arguments"][name]) for name in names]
+        for combination in itertools.product(*values):
+            arguments = dict(zip(names, combination))
+            output = os.path.join(directory, entry["output"].format(**arguments))
+            datasets.append(Dataset(generator, arguments, os.path.normpath(output)))
+
+    repeated = [output for output, count in Counter(d.output for d in datasets).items()
+                if count > 1]
+    if repeated:
+        raise ValueError(f"{filename} saves more than one dataset to {repeated[0]}")
+    return datasets
+
+
+def generate(manifest: str = MANIFEST_FILE, workers: int | None = None,
+             force: bool = False) -> tuple[list[Dataset], list[Dataset]]:
+    """Generate every dataset in manifest that changed since the last run, or every one if
+    force, with a pool of workers processes (one per core if None). Return the datasets
+    generated and the datasets skipped.
+
+    The hashes of the datasets generated so far are recorded even if one of them fails.
+    """
+    datasets = read_manifest(manifest)
+    directory = os.path.dirname(os.path.abspath(manifest))
+    hashes_file = os.path.join(directory, HASHES_FILENAME)
+    recorded = _read_hashes(hashes_file)
+    source_hash = _source_hash()
+
+    hashes, stale = {}, []
+    for dataset in datasets:
+        name = os.path.relpath(dataset.output, directory)
+        record = {"key": dataset.key(source_hash)}
+        old_record = recorded.get(name, {})
+        if not force and old_record.get("key") == record["key"] \
+                and os.path.isfile(dataset.output) \
+                and old_record.get("sha256") == _file_hash(dataset.output):
+            hashes[name] = old_record
+        else:
+            stale.append((name, record, dataset))
+
+    try:
+        if stale:
+            with ProcessPoolExecutor(workers) as executor:
+                futures = {executor.submit(_generate, dataset): (name, record)
+                           for name, record, dataset in stale}
+                for future in as_completed(futures):
+                    name, record = futures[future]
+                    record["sha256"] = future.result()
+                    hashes[name] = record
+    finally:
+        _write_hashes(hashes_file, hashes)
+
+    generated = [dataset for _, _, dataset in stale]
+    return generated, [dataset for dataset in datasets if dataset not in generated]
 
 
 def main() -> None:
     """Our main function which generates and writes graphs"""
+    parser = argparse.ArgumentParser(description="Generate the datasets listed in a manifest.")
+    parser.add_argument("--manifest", default=MANIFEST_FILE,
+                        help="the manifest of datasets to generate (default: data/manifest.json)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="how many processes to generate with (default: one per core)")
+    parser.add_argument("--force", action="store_true",
+                        help="generate every dataset, even the unchanged ones")
+    args = parser.parse_args()
+
+    generated, skipped = generate(args.manifest, args.workers, args.force)
+    print(f"generated {len(generated)} datasets, skipped {len(skipped)} unchanged ones",
+          file=sys.stderr)
+
+
+def _expand(value: object) -> list:
+    """Return the values a manifest argument stands for.
+
+    >>> _expand(3), _expand([3, 4]), _expand({"range": [2, 8, 3]})
+    ([3], [3, 4], [2, 5])
+    """
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict) and "range" in value:
+        return list(range(*value["range"]))
+    return [value]
+
+
+def _generate(dataset: Dataset) -> str:
+    """Generate dataset and save it, returning the hash of the file written.
+
+    The file is written under a temporary name and then renamed, so an interrupted run never
+    leaves half a dataset behind. If the file already holds the same graph, it is kept as it
+    is, even if saving would format it differently.
+    """
+    # every generator makes the same graph with either backend, and numpy makes it faster
+    graph = GENERATORS[dataset.generator](**{"backend": "numpy", **dataset.arguments})
+    if os.path.isfile(dataset.output) and _holds_graph(dataset.output, graph):
+        return _file_hash(dataset.output)
+    os.makedirs(os.path.dirname(dataset.output), exist_ok=True)
+    root, extension = os.path.splitext(dataset.output)
+    temporary = f"{root}.{os.getpid()}.tmp{extension}"
+    try:
+        save_graph(graph, temporary)
+        os.replace(temporary, dataset.output)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return _file_hash(dataset.output)
+
+
+def _holds_graph(filename: str, graph: SpringMassGraph) -> bool:
+    """Return whether the graph file filename holds exactly the vertices and edges of graph,
+    which uses the numpy backend."""
+    if graph.all_pairs is not None:
+        return False  # a file holds all-pairs springs as edges, so they can't be compared
+    stored = SpringMassGraph(backend="numpy")
+    try:
+        load_graph(stored, filename)
+    except (ValueError, IndexError):
+        return False
+    return all(np.array_equal(getattr(stored.store, name), getattr(graph.store, name))
+               for name in GRAPH_FIELDS)
+
+
+def _source_hash() -> str:
+    """Return a hash of the code of SOURCE_CODE: every named function of each module, or the
+    whole module if none are named."""
+    digest = hashlib.sha256()
+    for module, names in SOURCE_CODE:
+        if not names:
+            digest.update(inspect.getsource(module).encode())
+        for name in names:
+            digest.update(inspect.getsource(getattr(module, name)).encode())
+    return digest.hexdigest()
+
+
+def _file_hash(filename: str) -> str:
+    """Return the sha256 hash of the contents of filename."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_hashes(filename: str) -> dict[str, dict[str, str]]:
+    """Return the hashes recorded in filename, or none if it doesn't exist."""
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as file:
+        return json.load(file)
+
 
-    # wheels
-    graph = WheelGraph(3, 100)
-    save_to_csv(graph, "data/w3.csv")
-    graph = WheelGraph(4, 100)
-    save_to_csv(graph, "data/w4.csv")
-    graph = WheelGraph(5, 100)
-    save_to_csv(graph, "data/w5.csv")
-    graph = WheelGraph(6, 100)
-    save_to_csv(graph, "data/w6.csv")
-    graph = WheelGraph(8, 100)
-    save_to_csv(graph, "data/w8.csv")
-    graph = WheelGraph(10, 100)
-    save_to_csv(graph, "data/w10.csv")
-    graph = WheelGraph(20, 100)
-    save_to_csv(graph, "data/w20.csv")
-
-    # complete graphs
-    graph = CompleteGraph(3, 100)
-    save_to_csv(graph, "data/k3.csv")
-    graph = CompleteGraph(4, 100)
-    save_to_csv(graph, "data/k4.csv")
-    graph = CompleteGraph(7, 100)
-    save_to_csv(graph, "data/k7.csv")
-    graph = CompleteGraph(10, 100)
-    save_to_csv(graph, "data/k10.csv")
-
-    # Triangle graphs
-    graph = PyramidGraph(2, 50)
-    save_to_csv(graph, "data/tri2.csv")
-    graph = PyramidGraph(4, 50)
-    save_to_csv(graph, "data/tri2.csv")
-    graph = PyramidGraph(6, 99)
-    save_to_csv(graph, "data/tri6.csv")
-
-    # cloth graphs
-    graph = ClothGraph(25, 25, 10)
-    save_to_csv(graph, "data/cloth1.csv")
-    graph = ClothGraph(25, 10, 10)
-    save_to_csv(graph, "data/cloth2.csv")
-    graph = ClothGraph(50, 25, 10)
-    save_to_csv(graph, "data/cloth3.csv")
+def _write_hashes(filename: str, hashes: dict[str, dict[str, str]]) -> None:
+    """Record hashes in filename."""
+    with open(filename, "w") as file:
+        json.dump(hashes, file, indent=2, sort_keys=True)
+        file.write("\n")
 
 
 if __name__ == "__main__":
@@ -67,8 +266,11 @@ if __name__ == "__main__":
     import python_ta
     python_ta.check_all(
         config={
-            "extra-imports": ["tkinter", "tkinter.filedialog", "graph_types", "graph_io"],
-            "allowed-io": [],
+            "extra-imports": ["argparse", "collections", "concurrent.futures", "dataclasses",
+                              "hashlib", "inspect", "itertools", "json", "os", "sys",
+                              "numpy", "graph", "graph_types", "graph_io"],
+            "allowed-io": ["read_manifest", "main", "_file_hash",
+                           "_read_hashes", "_write_hashes"],
             "max-line-length": 100,
         }
     )
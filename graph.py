@@ -3,45 +3,97 @@
 Module Description
 ==================
 This is the critical file for our project.
-It handles the main graph creation, updating and drawing
+It handles the main graph creation, updating and drawing (see graph_drawing.py)
 
 Copyright Information
 =====================
 This file is licensed under the MIT License
 """
+import dataclasses
 from dataclasses import dataclass
-import pygame
+import itertools
+import os
+from typing import TYPE_CHECKING
+import numpy as np
+import array_physics
+import edge_coloring
+import equilibrium
+from energy import EnergyMonitor
+import sleeping
+import substepping
+from all_pairs import AllPairsSprings
+from edge_coloring import EdgeColoring, ParallelEdges
+from graph_store import GraphStore, VertexList, EdgeList
+from incidence import Incidence
+from profiler import Profiler
+from sleeping import SleepTracker
+from spatial_index import SpatialHash
+from substepping import Substepping
 from edge import Edge
 from vertex import Vertex
 
+if TYPE_CHECKING:
+    import pygame
+
 
 @dataclass
 class Metrics:
-    """Metrics for graph."""
+    """Metrics for graph. substeps is how many substeps the last frame was split into, and the
+    energies are those at the end of the last frame sampled (see energy.py)."""
     elastic_potential_energy: float = 0.0
     kinetic_energy: float = 0.0
+    substeps: int = 0
+
+
+@dataclass
+class Snapshot:
+    """The state of a graph's vertices, saved by SpringMassGraph.snapshot.
+
+    Instance Attributes:
+    - vertex_state: one row (x, y, vx, vy, pinned) per vertex
+    - metrics: a copy of the graph's metrics when the snapshot was taken
+    """
+    vertex_state: np.ndarray
+    metrics: Metrics
 
 
 class SpringMassGraph:
     """Spring mass graph.
 
     Instance Attributes:
-    - vertices: a list of vertices that are part of this graph
-    - edges: the list of edges that connect our vertices
+    - vertices: a list of vertices that are part of this graph (a VertexList when using
+        the numpy backend)
+    - edges: the list of edges that connect our vertices (an EdgeList when using the numpy backend)
     - size: the size of the screen in pixels
     - spring_constant: $k$ in Hooke's law
     - friction: the global friction applied to all vertices every step
     - gravity: the amount added to the y velocity every step
-    - metrics: used for optimizing minimums to find the best spring_constant, friction, and gravity
+    - metrics: used for optimizing minimums to find the best spring_constant, friction, and gravity.
+        The energies are only summed on the frames somebody subscribed to in self.energy
+    - energy: who wants the energies of which frames (see energy.py)
+    - backend: which physics implementation step uses, one of BACKENDS
+    - profiler: records how long each phase of a step takes, or None to not profile
+    - substepping: how many substeps run_substeps may split a frame into (see substepping.py)
+    - sleeping: whether run_substeps skips the islands of vertices that have come to rest
+        (see sleeping.py). Call wake after moving, pinning or unpinning a vertex yourself.
+    - edge_threads: how many threads the numpy backend applies the spring forces of large graphs
+        with, one color class of edges at a time (see edge_coloring.py)
+    - all_pairs: springs between every pair of the first all_pairs.n vertices, kept apart from
+        self.edges so they take no memory per pair (see all_pairs.py), or None
 
     Constants:
-    - SUBSTEPS: the number of substeps (steps per frame)
+    - SUBSTEPS: the simulated time of a frame, in steps of length 1. With adaptive substepping
+        off, this is the number of substeps (steps per frame)
     - EDGE_CREATION_RADIUS: on click, the distance within which we should create edges
     - DRAG_RADIUS: the distance within which we should drag vertices
+    - SPATIAL_CELL_SIZE: the cell size of the grid used to find vertices near a point
+    - BACKENDS: the available physics backends. "python" updates every Vertex and Edge object
+        in turn, "numpy" keeps the graph in a GraphStore (see graph_store.py) and runs the step
+        as whole-array operations on it (see array_physics.py)
     """
 
-    vertices: list[Vertex]
-    edges: list[Edge]
+    vertices: list[Vertex] | VertexList
+    edges: list[Edge] | EdgeList
 
     size: tuple[int, int] = (800, 600)
 
@@ -50,10 +102,29 @@ class SpringMassGraph:
     gravity: float
 
     metrics: float
+    energy: EnergyMonitor
+
+    backend: str
+    profiler: Profiler | None
+    substepping: Substepping
+    sleeping: bool
+    _sleep: SleepTracker | None
+    _awake_objects: tuple[list[Vertex], list[Edge]] | None
+    edge_threads: int
+    all_pairs: AllPairsSprings | None
+    _coloring: EdgeColoring | None
+    _parallel: ParallelEdges | None
+    _store: GraphStore | None
+    _spatial_index: SpatialHash | None
+    _incidence: Incidence | None
+    _vertex_slots: dict[Vertex, int]
+    _edge_slots: dict[Edge, int]
 
     SUBSTEPS: int = 16
     EDGE_CREATION_RADIUS: float = 100
     DRAG_RADIUS: float = 10
+    SPATIAL_CELL_SIZE: float = 20
+    BACKENDS: tuple = ("python", "numpy")
 
     # colors for drawing graph
     BLUE: tuple = (0, 0, 255)
@@ -65,7 +136,8 @@ class SpringMassGraph:
         self,
         spring_constant: float = 0.03,
         friction: float = 0.98,
-        gravity: float = 0.01
+        gravity: float = 0.01,
+        backend: str = "python"
     ) -> None:
         self.vertices = []
         self.edges = []
@@ -76,96 +148,543 @@ class SpringMassGraph:
 
         self.metrics = Metrics()
 
+        self.energy = EnergyMonitor()
+        self.profiler = None
+        self.substepping = Substepping()
+        self.sleeping = True
+        self._sleep = None
+        self._awake_objects = None
+        self.edge_threads = os.cpu_count() or 1
+        self.all_pairs = None
+        self._coloring = None
+        self._parallel = None
+        self.backend = "python"
+        self._store = None
+        self._spatial_index = None
+        self._incidence = None
+        self._vertex_slots = {}
+        self._edge_slots = {}
+        self.set_backend(backend)
+
+    def set_backend(self, backend: str) -> None:
+        """Choose the physics backend used by step and run_substeps.
+
+        Switching to "numpy" moves the vertices and edges into a GraphStore, and switching back
+        to "python" turns them into Vertex and Edge objects again.
+
+        Raise ValueError if backend is not one of self.BACKENDS.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}, expected one of {self.BACKENDS}")
+        if backend == self.backend:
+            return
+
+        if backend == "numpy":
+            self._store = GraphStore.from_objects(self.vertices, self.edges)
+            self.vertices = VertexList(self._store)
+            self.edges = EdgeList(self._store)
+        else:
+            self.vertices, self.edges = self._store.to_objects()
+            self._store = None
+        self.backend = backend
+        self._spatial_index = None
+        self._incidence = None
+        self._coloring = None
+        self._sleep = None
+
+    @property
+    def store(self) -> GraphStore | None:
+        """The GraphStore holding this graph with the numpy backend, or None otherwise."""
+        return self._store
+
+    def snapshot(self) -> Snapshot:
+        """Return a copy of the positions, velocities and pinned state of every vertex, and of
+        self.metrics, packed into one array."""
+        if self._store is not None:
+            store = self._store
+            vertex_state = np.column_stack((store.x, store.y, store.vx, store.vy, store.pinned))
+        else:
+            n = len(self.vertices)
+            vertex_state = np.fromiter(
+                itertools.chain.from_iterable(
+                    (v.x, v.y, v.vx, v.vy, v.pinned) for v in self.vertices
+                ), np.float64, count=5 * n
+            ).reshape(n, 5)
+        return Snapshot(vertex_state, dataclasses.replace(self.metrics))
+
+    def restore(self, snapshot: Snapshot) -> None:
+        """Put every vertex back into the state saved in snapshot, in O(V) time.
+
+        The existing vertices and edges are updated in place, nothing is reallocated.
+
+        Raise ValueError if the graph no longer has the same number of vertices as when
+        snapshot was taken.
+        """
+        vertex_state = snapshot.vertex_state
+        if len(vertex_state) != len(self.vertices):
+            raise ValueError(f"snapshot has {len(vertex_state)} vertices "
+                             f"but the graph has {len(self.vertices)}")
+
+        if self._store is not None:
+            store = self._store
+            for array, column in zip((store.x, store.y, store.vx, store.vy), vertex_state.T):
+                array[:] = column
+            store.pinned[:] = vertex_state[:, 4] != 0
+        else:
+            for v, (x, y, vx, vy, pinned) in zip(self.vertices, vertex_state.tolist()):
+                v.x, v.y, v.vx, v.vy, v.pinned = x, y, vx, vy, pinned != 0
+
+        self.metrics = dataclasses.replace(snapshot.metrics)
+        self._spatial_index = None
+        self._sleep = None
+
+    def solve_equilibrium(self, tolerance: float = equilibrium.TOLERANCE,
+                          max_iterations: int = equilibrium.MAX_ITERATIONS
+                          ) -> equilibrium.Equilibrium:
+        """Move every vertex straight to a rest state, without stepping, and stop it.
+
+        The rest state minimizes the spring energy minus the gravitational energy within the
+        screen, with pinned vertices held in place (see equilibrium.py). Update self.metrics
+        and return the Equilibrium found, including its energy.
+
+        Raise ValueError if self.friction is not positive, since then nothing ever comes to rest.
+        """
+        if self.friction <= 0:
+            raise ValueError("a graph without a positive friction has no rest state")
+        state = self._store if self._store is not None \
+            else array_physics.gather(self.vertices, self.edges)
+        if self.all_pairs is not None:
+            state = self.all_pairs.with_edges(state)
+        # a step scales the spring forces by friction before adding gravity, so at rest the
+        # springs hold up mass * gravity / friction rather than mass * gravity
+        result = equilibrium.solve(state, self.spring_constant, self.gravity / self.friction,
+                                   self.size, tolerance, max_iterations)
+
+        if self._store is not None:
+            store = self._store
+            store.x[:] = result.x
+            store.y[:] = result.y
+            store.vx[:] = 0.0
+            store.vy[:] = 0.0
+        else:
+            for v, x, y in zip(self.vertices, result.x.tolist(), result.y.tolist()):
+                v.x, v.y, v.vx, v.vy = x, y, 0.0, 0.0
+
+        self.metrics = Metrics(result.elastic_potential_energy, 0.0)
+        self._spatial_index = None
+        self._sleep = None
+        return result
+
     def update_width_and_height(self, width: int, height: int) -> None:
         """Updates graph width and height"""
         self.size = (width, height)
 
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draw graph on pygame screen."""
-        screen.fill(self.WHITE)
-        mouse = pygame.mouse.get_pos()
-
-        is_near_vertex = any(
-            ((vertex.x - mouse[0]) ** 2 + (vertex.y - mouse[1]) ** 2)
-            < self.DRAG_RADIUS ** 2
-            for vertex in self.vertices
-        )
-        if is_near_vertex:
-            pygame.draw.circle(screen, self.LIGHT_GREEN,
-                               mouse, self.DRAG_RADIUS)
-        else:
-            pygame.draw.circle(screen, self.LIGHT_GREEN, mouse,
-                               self.EDGE_CREATION_RADIUS)
+    def draw(self, screen: "pygame.Surface") -> None:
+        """Draw graph on pygame screen.
 
-        self._draw_edges(screen)
-        self._draw_vertices(screen)
+        The drawing code lives in graph_drawing.py and is imported here, on first use, so that
+        using a graph without drawing it never imports pygame.
+        """
+        import graph_drawing  # pylint: disable=import-outside-toplevel
+        graph_drawing.draw_graph(self, screen)
 
     def add_new_vertex(self, x: float, y: float) -> None:
         """Add to vertex to graph as position (x, y)."""
         new_vertex = Vertex(x, y, randomize=True)
 
-        # add edges within edge creation radius
-        for v in self.vertices:
-            distance = (v.x - new_vertex.x) ** 2 + (v.y - new_vertex.y) ** 2
-            if distance < self.EDGE_CREATION_RADIUS ** 2:
-                new_edge = Edge(v, new_vertex)
-                self.edges.append(new_edge)
+        # find vertices within edge creation radius
+        neighbours = self.vertices_near(new_vertex.x, new_vertex.y, self.EDGE_CREATION_RADIUS)
 
+        # the stored copy of the vertex, which differs from new_vertex with the numpy backend
         self.vertices.append(new_vertex)
+        new_vertex = self.vertices[-1]
+        self._spatial_index = None
+
+        for v in neighbours:
+            self.edges.append(Edge(v, new_vertex))
+
+    def extend(self, x: np.ndarray, y: np.ndarray, start: np.ndarray, end: np.ndarray,
+               pinned: np.ndarray | None = None) -> None:
+        """Add a vertex at each (x[i], y[i]), pinned if pinned[i] is True, and then an edge from
+        vertex start[e] to vertex end[e] for each e, with the rest lengths Edge would give them.
+
+        start and end index all of self's vertices, including the new ones. With the numpy
+        backend everything is written straight into self.store as whole arrays, without making
+        any Vertex or Edge objects.
+        """
+        self._spatial_index = None
+        if pinned is None:
+            pinned = np.zeros(len(x), dtype=np.bool_)
+        if self._store is not None:
+            store = self._store
+            store.extend_vertices(x, y, pinned)
+            store.extend_edges(start, end, array_physics.rest_lengths(store.x, store.y,
+                                                                      start, end))
+            return
+
+        for vertex_x, vertex_y, vertex_pinned in zip(x.tolist(), y.tolist(), pinned.tolist()):
+            vertex = Vertex(vertex_x, vertex_y)
+            vertex.pinned = vertex_pinned
+            self.vertices.append(vertex)
+        vertices = self.vertices
+        self.edges.extend(Edge(vertices[i], vertices[j])
+                          for i, j in zip(start.tolist(), end.tolist()))
+
+    def vertices_near(self, x: float, y: float, radius: float) -> list[Vertex]:
+        """Return the vertices strictly within radius of (x, y), in the order of self.vertices."""
+        return [self.vertices[i] for i in self._vertex_indices_near(x, y, radius).tolist()]
+
+    def _vertex_indices_near(self, x: float, y: float, radius: float) -> np.ndarray:
+        """Return the indices of the vertices strictly within radius of (x, y).
+
+        The spatial index is rebuilt at most once after each change to the graph, so every
+        query in a frame after the first only costs time proportional to the vertices found.
+        """
+        if self._spatial_index is None or len(self._spatial_index) != len(self.vertices):
+            self._spatial_index = SpatialHash(*self._vertex_positions(), self.SPATIAL_CELL_SIZE)
+        return self._spatial_index.query(x, y, radius)
+
+    def _vertex_positions(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return arrays of the x and y coordinates of self.vertices."""
+        if self._store is not None:
+            return self._store.x, self._store.y
+
+        n = len(self.vertices)
+        return (np.fromiter((v.x for v in self.vertices), np.float64, count=n),
+                np.fromiter((v.y for v in self.vertices), np.float64, count=n))
+
+    def wake(self, vertex: Vertex) -> None:
+        """Wake the island of vertex, and the islands next to it if it is pinned.
+
+        Call this after moving, pinning or unpinning vertex from outside of the physics. Does
+        nothing if vertex is no longer in self.
+        """
+        if self._sleep is None:
+            return
+        if self._store is not None:
+            index = vertex.index
+            if index >= len(self.vertices):
+                return
+        else:
+            self._sync_incidence()
+            index = self._vertex_slots.get(vertex)
+            if index is None:
+                return
+        self._sleep.wake(np.array([index]))
+
+    def vertices_moved(self) -> None:
+        """Forget everything cached about the positions of the vertices and wake every island.
+
+        Call this after stepping self's vertices with something other than its own methods,
+        such as a DomainDecomposition (see domains.py).
+        """
+        self._spatial_index = None
+        self._sleep = None
 
     def remove_last_vertex(self) -> None:
         """Remove the last vertex added to the graph."""
         if len(self.vertices) > 0:
-            v = self.vertices.pop()
-            self.edges = [e for e in self.edges if v not in {e.start, e.end}]
+            self.remove_vertex(self.vertices[-1])
+
+    def remove_vertex(self, vertex: Vertex) -> None:
+        """Remove vertex and its edges from self in O(degree) time.
+
+        The last vertex (and the last edges) are moved into the freed slots, so self.vertices
+        and self.edges stay dense but their order changes.
+        """
+        incidence = self._sync_incidence()
+        v = self._vertex_slots[vertex] if self._store is None else vertex.index
+        if self.all_pairs is not None and v < self.all_pairs.n:
+            # the springs of v have to be edges to be removed with it
+            self.materialize_all_pairs()
+            incidence = self._sync_incidence()
+        if self._coloring is not None:
+            self._sync_coloring()
+
+        edges_of_v = incidence.edges_of[v]
+        while edges_of_v:
+            e = next(iter(edges_of_v))
+            self._swap_remove_edge(e, incidence.remove_edge(e))
+
+        last = incidence.remove_vertex(v)
+        if self._store is not None:
+            self._store.swap_remove_vertex(v, incidence.edges_of[v] if v != last else set())
+        else:
+            del self._vertex_slots[vertex]
+            moved = self.vertices.pop()
+            if v != last:
+                self.vertices[v] = moved
+                self._vertex_slots[moved] = v
+        self._spatial_index = None
+        self._sleep = None
+
+    def remove_edge(self, edge: Edge) -> None:
+        """Remove edge from self in O(degree) time. The last edge is moved into its slot."""
+        incidence = self._sync_incidence()
+        if self._coloring is not None:
+            self._sync_coloring()
+        e = self._edge_slots[edge] if self._store is None else edge.index
+        self._swap_remove_edge(e, incidence.remove_edge(e))
+        self._sleep = None
+
+    def materialize_all_pairs(self) -> None:
+        """Turn the springs of self.all_pairs into ordinary edges, added after self's edges,
+        and set self.all_pairs to None. This takes memory proportional to the number of pairs.
+        """
+        all_pairs = self.all_pairs
+        if all_pairs is None:
+            return
+        self.all_pairs = None
+        self._sleep = None
+        for start, end, rest in all_pairs.edge_blocks():
+            if self._store is not None:
+                self._store.extend_edges(start, end, rest)
+                continue
+            vertices = self.vertices
+            for i, j, rest_length in zip(start.tolist(), end.tolist(), rest.tolist()):
+                edge = Edge(vertices[i], vertices[j])
+                edge.initial_distance = rest_length
+                self.edges.append(edge)
+
+    def _swap_remove_edge(self, e: int, last: int) -> None:
+        """Remove edge e from storage, moving edge last into its slot."""
+        if self._coloring is not None:
+            self._coloring.remove_edge(e)
+        if self._store is not None:
+            self._store.swap_remove_edge(e)
+            return
+
+        del self._edge_slots[self.edges[e]]
+        moved = self.edges.pop()
+        if e != last:
+            self.edges[e] = moved
+            self._edge_slots[moved] = e
+
+    def _sync_incidence(self) -> Incidence:
+        """Return the incidence of self, bringing it up to date first.
+
+        Vertices and edges are only ever appended outside of remove_vertex and remove_edge, so
+        only the new items at the end need to be added. This makes the first call O(V + E)
+        and later calls proportional to what was added since.
+        """
+        incidence = self._incidence
+        if incidence is None or incidence.n_vertices > len(self.vertices) \
+                or incidence.n_edges > len(self.edges):
+            incidence = self._incidence = Incidence()
+            self._vertex_slots = {}
+            self._edge_slots = {}
+
+        old_n, old_k = incidence.n_vertices, incidence.n_edges
+        for _i in range(old_n, len(self.vertices)):
+            incidence.add_vertex()
+
+        if self._store is not None:
+            store = self._store
+            for i, j in zip(store.start[old_k:].tolist(), store.end[old_k:].tolist()):
+                incidence.add_edge(i, j)
+            return incidence
+
+        for i in range(old_n, len(self.vertices)):
+            self._vertex_slots[self.vertices[i]] = i
+        for e in range(old_k, len(self.edges)):
+            edge = self.edges[e]
+            incidence.add_edge(self._vertex_slots[edge.start], self._vertex_slots[edge.end])
+            self._edge_slots[edge] = e
+        return incidence
+
+    def _sync_coloring(self) -> EdgeColoring:
+        """Return the edge coloring of self, coloring the edges added since the last call."""
+        incidence = self._sync_incidence()
+        coloring = self._coloring
+        if coloring is None or coloring.n_edges > incidence.n_edges:
+            coloring = self._coloring = EdgeColoring()
+        for _e in range(coloring.n_edges, incidence.n_edges):
+            coloring.add_edge(incidence)
+        return coloring
+
+    def _parallel_edges(self) -> ParallelEdges | None:
+        """Return the ParallelEdges to apply the spring forces of self._store with, or None if
+        self is too small, or needs too many colors, to be worth it, or edge_threads is 1."""
+        if self.edge_threads < 2 or len(self.edges) < edge_coloring.MIN_PARALLEL_EDGES:
+            return None
+        classes = self._sync_coloring().classes()
+        if len(self.edges) < edge_coloring.MIN_CLASS_EDGES * len(classes):
+            return None
+        parallel = self._parallel
+        if parallel is None or parallel.threads != self.edge_threads:
+            if parallel is not None:
+                parallel.shutdown()
+            parallel = self._parallel = ParallelEdges(self.edge_threads)
+        parallel.use_classes(classes)
+        return parallel
 
     def reset(self) -> None:
         """Remove all vertices and edges from self."""
+        self._spatial_index = None
+        self._incidence = None
+        self._coloring = None
+        self._sleep = None
+        self.all_pairs = None
+        if self._store is not None:
+            self._store.clear()
+            return
+
         self.vertices = []
         self.edges = []
 
     def run_substeps(self) -> None:
-        """Run self.step self.SUBSTEPS times."""
-        for _i in range(self.SUBSTEPS):
-            self.step()
-
-    def _draw_vertices(self, screen: pygame.Surface) -> None:
-        """Draw self.vertices on pygame screen."""
-        for v in self.vertices:
-            pygame.draw.circle(screen, self.BLACK, (v.x, v.y), v.mass)
-
-    def _draw_edges(self, screen: pygame.Surface) -> None:
-        """Draw self.edges on pygame screen."""
-        for edge in self.edges:
-            dx = edge.start.x - edge.end.x
-            dy = edge.start.y - edge.end.y
-            distance = (dx ** 2 + dy ** 2) ** 0.5
-            delta_len = min(abs(distance - edge.initial_distance), 10)
-            gray_color = delta_len * 255 // 10
-            color = (gray_color, (255 - gray_color), 0)
-            pygame.draw.line(
-                screen, color,
-                (edge.start.x, edge.start.y),
-                (edge.end.x, edge.end.y)
-            )
-
-    def step(self) -> None:
-        """Execute a physics logic step for the simulation, updating all vertices and edges."""
-        self.metrics.elastic_potential_energy = 0.0
-        self._update_edges()
-        self._update_vertices()
-        self._clamp_vertices()
+        """Advance self by one frame of self.SUBSTEPS steps of simulated time, split into as
+        many substeps as self.substepping allows for the current state (see substepping.py).
+        The number of substeps is recorded in self.metrics.substeps.
+
+        While self.sleeping, sleeping islands are skipped and islands that have come to rest
+        are put to sleep (see sleeping.py).
+        """
+        self._spatial_index = None
+        sample = self.energy.next_frame()
+        constants = (self.spring_constant, self.friction, self.gravity)
+        tracker = self._track_sleep(constants)
+        settings = self.substepping
+        motion = None
+        if tracker is not None or settings.min_substeps != settings.max_substeps:
+            state = self._awake_state(tracker)
+            motion = substepping.motion(state, constants, self.size, self.all_pairs)
+
+        if settings.min_substeps == settings.max_substeps:
+            substeps = settings.min_substeps
+        else:
+            substeps = substepping.choose_substeps(motion, self.SUBSTEPS, settings)
+        dt = self.SUBSTEPS / substeps
+
+        if self._store is None:
+            vertices, edges = self._awake_objects if tracker is not None \
+                else (self.vertices, self.edges)
+            for i in range(substeps):
+                self._step_objects(dt, vertices, edges, sample and i == substeps - 1)
+        elif tracker is None or tracker.all_awake:
+            self._step_arrays(self._store, substeps, dt, sample)
+        else:
+            self._step_arrays(state, substeps, dt, sample)
+            store, awake_vertices = self._store, tracker.awake_vertices
+            for name in ("x", "y", "vx", "vy"):
+                getattr(store, name)[awake_vertices] = getattr(state, name)
+
+        if tracker is not None:
+            if sample:
+                self.metrics.elastic_potential_energy += tracker.sleeping_energy
+            self._stop_vertices(tracker.record(sleeping.is_still(motion)))
+        self.metrics.substeps = substeps
+        if sample:
+            self.energy.record(self.metrics.elastic_potential_energy, self.metrics.kinetic_energy)
+
+    def _track_sleep(self, constants: tuple) -> SleepTracker | None:
+        """Return the sleep tracker of self, up to date with the vertices and edges added since
+        the last frame, or None if self.sleeping is False or self has all-pairs springs, which
+        join every vertex they touch into one island that hardly ever sleeps."""
+        if not self.sleeping or self.all_pairs is not None:
+            self._sleep = None
+            return None
+
+        key = (*constants, self.size)
+        n, k = len(self.vertices), len(self.edges)
+        tracker = self._sleep
+        if tracker is None or tracker.constants != key or not tracker.can_track(n, k):
+            tracker = self._sleep = SleepTracker(key)
+        if tracker.needs_refresh(n, k):
+            if self._store is not None:
+                tracker.refresh(self._store, self.spring_constant)
+            else:
+                tracker.refresh(array_physics.gather(self.vertices, self.edges),
+                                self.spring_constant)
+                self._awake_objects = (
+                    [self.vertices[i] for i in tracker.awake_vertices.tolist()],
+                    [self.edges[e] for e in tracker.awake_edges.tolist()],
+                )
+        return tracker
+
+    def _awake_state(self, tracker: SleepTracker | None) -> array_physics.ArrayState:
+        """Return the awake vertices and edges of self, or all of them if tracker is None.
+
+        With the numpy backend this is self._store itself when every vertex is awake, and a
+        copy otherwise."""
+        if self._store is not None:
+            if tracker is None or tracker.all_awake:
+                return self._store
+            return array_physics.subset(self._store, tracker.awake_vertices, tracker.awake_edges)
+        if tracker is None:
+            return array_physics.gather(self.vertices, self.edges)
+        return array_physics.gather(*self._awake_objects)
+
+    def _stop_vertices(self, vertices: np.ndarray) -> None:
+        """Set the velocities of the vertices with the given indices to 0."""
+        if self._store is not None:
+            self._store.vx[vertices] = 0.0
+            self._store.vy[vertices] = 0.0
+            return
+        for i in vertices.tolist():
+            v = self.vertices[i]
+            v.vx, v.vy = 0.0, 0.0
+
+    def step(self, dt: float = 1.0) -> None:
+        """Execute a physics logic step of length dt for the simulation, updating all vertices
+        and edges. This is a frame of its own (see energy.py), and wakes every sleeping island."""
+        self._spatial_index = None
+        self._sleep = None
+        sample = self.energy.next_frame()
+        if self.backend == "numpy":
+            self._step_arrays(self._store, 1, dt, sample)
+        else:
+            self._step_objects(dt, self.vertices, self.edges, sample)
+        if sample:
+            self.energy.record(self.metrics.elastic_potential_energy, self.metrics.kinetic_energy)
+
+    def measure_energies(self) -> tuple[float, float]:
+        """Return the elastic potential energy and kinetic energy of self as it is now, whether
+        or not the last frame was sampled (see array_physics.energies)."""
+        state = self._store if self._store is not None \
+            else array_physics.gather(self.vertices, self.edges)
+        potential_energy, kinetic_energy = array_physics.energies(state, self.spring_constant,
+                                                                  self.size[1])
+        if self.all_pairs is not None:
+            potential_energy += self.all_pairs.potential_energy(state, self.spring_constant)
+        return potential_energy, kinetic_energy
+
+    def _step_objects(self, dt: float, vertices: list[Vertex], edges: list[Edge],
+                      energy: bool = True) -> None:
+        """Run a physics step of length dt with the python backend on the given vertices and
+        edges of self, summing the energies into self.metrics if energy is True."""
+        if energy:
+            self.metrics.elastic_potential_energy = 0.0
+        profiler = self.profiler
+        if profiler is None:
+            self._update_edges(dt, edges, energy)
+            if self.all_pairs is not None:
+                self._update_all_pairs(dt, energy)
+            self._update_vertices(dt, vertices, energy)
+            self._clamp_vertices(vertices)
+        else:
+            profiler.time("update_edges", self._update_edges, dt, edges, energy)
+            if self.all_pairs is not None:
+                profiler.time("update_all_pairs", self._update_all_pairs, dt, energy)
+            profiler.time("update_vertices", self._update_vertices, dt, vertices, energy)
+            profiler.time("clamp_vertices", self._clamp_vertices, vertices)
 
-    def _update_vertices(self) -> None:
+    def _update_vertices(self, dt: float, vertices: list[Vertex], energy: bool = True) -> None:
         """Update vertices for simulation step relative to change in time."""
+        friction, gravity = array_physics.per_substep(self.friction, self.gravity, dt)
+        if not energy:
+            for v in vertices:
+                v.update(friction, gravity, self.size, dt)
+            return
+
         self.metrics.kinetic_energy = 0.0
-        for v in self.vertices:
-            velocity = v.update(self.friction, self.gravity, self.size)
+        for v in vertices:
+            velocity = v.update(friction, gravity, self.size, dt)
             self.metrics.kinetic_energy += 0.5 * (velocity ** 2) * v.mass
 
-    def _update_edges(self) -> None:
+    def _update_edges(self, dt: float, edges: list[Edge], energy: bool = True) -> None:
         """Update edges for simulation step relative to change in time."""
-        for edge in self.edges:
+        for edge in edges:
             dx = edge.start.x - edge.end.x
             dy = edge.start.y - edge.end.y
             distance = (dx ** 2 + dy ** 2) ** 0.5
@@ -177,19 +696,51 @@ class SpringMassGraph:
             )
             if distance == 0:
                 distance += 0.0001
-            fx = dx * dlen / distance
-            fy = dy * dlen / distance
+            fx = dx * dlen / distance * dt
+            fy = dy * dlen / distance * dt
 
-            potential_energy = self.spring_constant * ((distance - edge.initial_distance) ** 2)
-            self.metrics.elastic_potential_energy += potential_energy
+            if energy:
+                potential_energy = self.spring_constant * ((distance - edge.initial_distance) ** 2)
+                self.metrics.elastic_potential_energy += potential_energy
 
             edge.update(fx, fy)
 
-    def _clamp_vertices(self) -> None:
+    def _update_all_pairs(self, dt: float, energy: bool = True) -> None:
+        """Apply the forces of self.all_pairs for a simulation step relative to change in time.
+
+        There are no Edge objects to update, so the vertices the springs join are copied into
+        arrays, updated all at once and copied back."""
+        vertices = self.vertices[:self.all_pairs.n]
+        state = array_physics.gather(vertices, [])
+        potential_energy = self.all_pairs.update(state, self.spring_constant, dt, energy)
+        if energy:
+            self.metrics.elastic_potential_energy += potential_energy
+        for v, vx, vy in zip(vertices, state.vx.tolist(), state.vy.tolist()):
+            v.vx, v.vy = vx, vy
+
+    def _clamp_vertices(self, vertices: list[Vertex]) -> None:
         """Clamp vertex coordinates."""
-        for v in self.vertices:
+        for v in vertices:
             v.clamp(self.size)
 
+    def _step_arrays(self, state: array_physics.ArrayState, steps: int, dt: float,
+                     energy: bool = True) -> None:
+        """Run steps physics steps of length dt with the numpy backend, in place on state,
+        which is self._store or part of it, summing the energies of the last step into
+        self.metrics if energy is True."""
+        constants = (self.spring_constant, self.friction, self.gravity)
+        # the coloring numbers the edges of self._store, not those of a part of it
+        parallel = self._parallel_edges() if state is self._store else None
+        for i in range(steps):
+            last = energy and i == steps - 1
+            potential_energy, kinetic_energy = array_physics.step(
+                state, constants, self.size, self.profiler, dt, parallel,
+                all_pairs=self.all_pairs, energy=last
+            )
+            if last:
+                self.metrics.elastic_potential_energy = float(potential_energy)
+                self.metrics.kinetic_energy = float(kinetic_energy)
+
 
 if __name__ == "__main__":
     import doctest
@@ -199,8 +750,25 @@ if __name__ == "__main__":
     python_ta.check_all(
         config={
             "extra-imports": [
+                "all_pairs",
+                "array_physics",
                 "csv",
+                "dataclasses",
                 "edge",
+                "edge_coloring",
+                "energy",
+                "equilibrium",
+                "graph_drawing",
+                "graph_store",
+                "incidence",
+                "itertools",
+                "numpy",
+                "os",
+                "profiler",
+                "sleeping",
+                "spatial_index",
+                "substepping",
+                "typing",
                 "os.path",
                 "pygame",
                 "vertex",
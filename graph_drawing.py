@@ -0,0 +1,299 @@
+"""CSC 111 Final Project: Graph Drawing
+
+Module Description
+==================
+This module draws a SpringMassGraph on a pygame surface. It is kept apart from graph.py and only
+imported by SpringMassGraph.draw, so the physics can be imported and run without pygame.
+
+Drawing one line and one circle per edge and vertex makes drawing the slowest part of a frame
+for large graphs, so everything is done in bulk instead:
+- every edge's strain color is computed at once with numpy, rounded to one of STRAIN_BUCKETS
+    colors, and the edges are rasterized straight into the surface's pixels
+- every vertex is a blit of a circle sprite drawn once per radius and kept in _SPRITES, or for
+    more than STAMP_THRESHOLD vertices of one radius, a mask of all their centers is widened into
+    circles at once, which costs the same however many vertices there are
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import numpy as np
+import pygame
+import array_physics
+from all_pairs import AllPairsSprings
+from array_physics import ArrayState
+from graph import SpringMassGraph
+
+# the number of different colors edges are drawn in, from green (unstretched) to red
+STRAIN_BUCKETS = 16
+# edges stretched or compressed by at least this many pixels are drawn fully red
+MAX_STRAIN = 10
+# lines are drawn with at most this many pixels
+MAX_LINE_PIXELS = 4096
+# vertices of one radius are stamped rather than blitted when there are more than this many
+STAMP_THRESHOLD = 2000
+
+# pre-rendered vertex circles, by (radius, color)
+_SPRITES: dict[tuple[int, tuple], pygame.Surface] = {}
+
+
+def draw_graph(graph: SpringMassGraph, screen: pygame.Surface) -> None:
+    """Draw graph on pygame screen."""
+    draw_state(_drawing_state(graph), screen, graph.all_pairs)
+
+
+def draw_state(state: ArrayState, screen: pygame.Surface,
+               all_pairs: AllPairsSprings | None = None) -> None:
+    """Draw a graph given as arrays on pygame screen, such as a copy made by another thread,
+    with the springs of all_pairs drawn as edges if given.
+
+    Only the positions, masses and edges of state are used.
+    """
+    screen.fill(SpringMassGraph.WHITE)
+    mouse = pygame.mouse.get_pos()
+
+    dx, dy = state.x - mouse[0], state.y - mouse[1]
+    is_near_vertex = bool(np.any(dx * dx + dy * dy < SpringMassGraph.DRAG_RADIUS ** 2))
+    if is_near_vertex:
+        pygame.draw.circle(screen, SpringMassGraph.LIGHT_GREEN,
+                           mouse, SpringMassGraph.DRAG_RADIUS)
+    else:
+        pygame.draw.circle(screen, SpringMassGraph.LIGHT_GREEN, mouse,
+                           SpringMassGraph.EDGE_CREATION_RADIUS)
+
+    _draw_edge_arrays(state, screen)
+    if all_pairs is not None:
+        _draw_all_pairs(state, all_pairs, screen)
+    _draw_vertex_arrays(state, screen, SpringMassGraph.BLACK)
+
+
+def draw_vertices(graph: SpringMassGraph, screen: pygame.Surface) -> None:
+    """Draw graph.vertices on pygame screen."""
+    _draw_vertex_arrays(_drawing_state(graph), screen, graph.BLACK)
+
+
+def draw_edges(graph: SpringMassGraph, screen: pygame.Surface) -> None:
+    """Draw graph.edges, and graph.all_pairs if it has any, on pygame screen."""
+    state = _drawing_state(graph)
+    _draw_edge_arrays(state, screen)
+    if graph.all_pairs is not None:
+        _draw_all_pairs(state, graph.all_pairs, screen)
+
+
+def _drawing_state(graph: SpringMassGraph) -> ArrayState:
+    """Return graph as arrays, without copying if it already is."""
+    if graph.store is not None:
+        return graph.store
+    return array_physics.gather(graph.vertices, graph.edges)
+
+
+def edge_vectors(state: ArrayState) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return the start x, start y, and x and y extent (end minus start) of each edge of state,
+    in single precision, which is plenty for pixels."""
+    x0, y0 = state.x[state.start].astype(np.float32), state.y[state.start].astype(np.float32)
+    dx = state.x[state.end].astype(np.float32) - x0
+    dy = state.y[state.end].astype(np.float32) - y0
+    return x0, y0, dx, dy
+
+
+def strain_buckets(dx: np.ndarray, dy: np.ndarray, rest: np.ndarray) -> np.ndarray:
+    """Return the color bucket, from 0 to STRAIN_BUCKETS - 1, of each edge with the given x and
+    y extents and rest lengths.
+
+    An edge's bucket grows with how far its length is from its rest length, up to MAX_STRAIN.
+
+    >>> strain_buckets(np.array([3.0, 30.0]), np.array([4.0, 0.0]), np.array([5.0, 5.0]))
+    array([ 0, 15])
+    """
+    strain = np.minimum(np.abs(np.sqrt(dx * dx + dy * dy) - rest), MAX_STRAIN)
+    return np.rint(strain * ((STRAIN_BUCKETS - 1) / MAX_STRAIN)).astype(np.intp)
+
+
+def bucket_colors() -> list[tuple[int, int, int]]:
+    """Return the color of each strain bucket.
+
+    >>> colors = bucket_colors()
+    >>> colors[0], colors[-1]
+    ((0, 255, 0), (255, 0, 0))
+    """
+    colors = []
+    for bucket in range(STRAIN_BUCKETS):
+        red = bucket * 255 // (STRAIN_BUCKETS - 1)
+        colors.append((red, 255 - red, 0))
+    return colors
+
+
+def _draw_edge_arrays(state: ArrayState, screen: pygame.Surface) -> None:
+    """Draw the edges of state on screen, colored by strain."""
+    if len(state.start) == 0:
+        return
+    x0, y0, dx, dy = edge_vectors(state)
+    buckets = strain_buckets(dx, dy, state.rest)
+
+    if screen.get_bytesize() != 4:
+        # pixels2d needs whole-word pixels, so fall back to one draw call per edge
+        colors = bucket_colors()
+        lines = zip(buckets.tolist(), x0.tolist(), y0.tolist(),
+                    (x0 + dx).tolist(), (y0 + dy).tolist())
+        for bucket, start_x, start_y, end_x, end_y in lines:
+            pygame.draw.line(screen, colors[bucket], (start_x, start_y), (end_x, end_y))
+        return
+
+    mapped = np.array([screen.map_rgb(color) for color in bucket_colors()], dtype=np.uint32)
+    pixels = pygame.surfarray.pixels2d(screen)
+    width, height = screen.get_size()
+    # the pixels in row-major order with a one pixel border, where off-screen pixels are sent
+    canvas = np.empty((height + 2, width + 2), dtype=np.uint32)
+    canvas[1:-1, 1:-1] = pixels.T
+    indices, colors = _line_pixels((x0, y0, dx, dy), mapped[buckets], (width, height))
+    canvas.ravel()[indices] = colors
+    pixels.T[...] = canvas[1:-1, 1:-1]
+    # the surface stays locked until the pixel array is released
+    del pixels
+
+
+def _draw_all_pairs(state: ArrayState, all_pairs: AllPairsSprings,
+                    screen: pygame.Surface) -> None:
+    """Draw the springs of all_pairs between the vertices of state on screen like edges, a
+    block of them at a time."""
+    for start, end, rest in all_pairs.edge_blocks():
+        _draw_edge_arrays(ArrayState(state.x, state.y, state.vx, state.vy, state.mass,
+                                     state.pinned, start, end, rest), screen)
+
+
+def _line_pixels(vectors: tuple, edge_colors: np.ndarray,
+                 size: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    """Return the index of every pixel on every edge given by edge_vectors in a canvas of the
+    screen's pixels in row-major order with a one pixel border, and the pixel's color.
+
+    Pixels off the screen are moved to the nearest border pixel. Each edge gets one pixel per
+    step along its longer axis, like pygame.draw.line. The edges are sorted from longest to
+    shortest, so step k of every edge with at least k steps is a single slice.
+    """
+    x0, y0, dx, dy = vectors
+    steps = np.minimum(np.ceil(np.maximum(np.abs(dx), np.abs(dy))), MAX_LINE_PIXELS - 1)
+
+    # numpy sorts 16 bit integers with a linear time radix sort
+    order = np.argsort(-steps.astype(np.int16), kind="stable")
+    steps = steps[order]
+    # + 0.5 so that truncating rounds to the nearest pixel, + 1 for the border
+    x0, y0 = x0[order] + np.float32(1.5), y0[order] + np.float32(1.5)
+    dx, dy = dx[order] / np.maximum(steps, 1), dy[order] / np.maximum(steps, 1)
+    edge_colors = edge_colors[order]
+
+    # counts[k] is the number of edges with at least k steps
+    counts = np.searchsorted(-steps, -np.arange(int(steps[0]) + 1, dtype=np.float32), "right")
+    px = np.empty(int(counts.sum()), dtype=np.float32)
+    py = np.empty_like(px)
+    colors = np.empty(len(px), dtype=np.uint32)
+    begin = 0
+    for k, count in enumerate(counts.tolist()):
+        end = begin + count
+        np.multiply(dx[:count], k, out=px[begin:end])
+        px[begin:end] += x0[:count]
+        np.multiply(dy[:count], k, out=py[begin:end])
+        py[begin:end] += y0[:count]
+        colors[begin:end] = edge_colors[:count]
+        begin = end
+
+    width, height = size
+    np.clip(px, 0, width + 1, out=px)
+    np.clip(py, 0, height + 1, out=py)
+    indices = py.astype(np.int32)
+    indices *= width + 2
+    indices += px.astype(np.int32)
+    return indices, colors
+
+
+def _draw_vertex_arrays(state: ArrayState, screen: pygame.Surface, color: tuple) -> None:
+    """Draw the vertices of state on screen as circles with radius their mass."""
+    if len(state.mass) == 0:
+        return
+    radii = np.asarray(state.mass).astype(np.intp)
+    # usually every vertex has the default mass, which needs no sorting out
+    single = radii.min() == radii.max()
+    for radius in (radii[:1] if single else np.unique(radii)).tolist():
+        chosen = slice(None) if single else radii == radius
+        centers_x = np.rint(state.x[chosen]).astype(np.intp)
+        centers_y = np.rint(state.y[chosen]).astype(np.intp)
+        if len(centers_x) > STAMP_THRESHOLD and screen.get_bytesize() == 4:
+            _stamp_circles(screen, centers_x, centers_y, radius, color)
+        else:
+            sprite = _sprite(radius, color)
+            corners = np.column_stack((centers_x - radius, centers_y - radius))
+            screen.blits([(sprite, corner) for corner in corners.tolist()], doreturn=False)
+
+
+def _stamp_circles(screen: pygame.Surface, centers_x: np.ndarray, centers_y: np.ndarray,
+                   radius: int, color: tuple) -> None:
+    """Draw filled circles of radius and color at the given centers on screen.
+
+    Every center is marked in a mask, which is widened sideways to each row of the circle sprite,
+    then the widened masks are shifted up and down into place. This draws the same pixels as
+    blitting the sprite at every center, in about 4 * radius whole-screen operations whatever
+    the number of circles.
+    """
+    width, height = screen.get_size()
+    # everything is in row-major order, like the rows of pixels in memory
+    centers = np.zeros((height + 2 * radius, width + 2 * radius), dtype=np.bool_)
+    on_screen = (centers_x >= -radius) & (centers_x < width + radius) \
+        & (centers_y >= -radius) & (centers_y < height + radius)
+    centers[centers_y[on_screen] + radius, centers_x[on_screen] + radius] = True
+
+    # the (row offset, first column offset, last column offset) of each row of the sprite
+    sprite_mask = pygame.mask.from_surface(_sprite(radius, color))
+    runs = []
+    for sprite_y in range(2 * radius + 1):
+        columns = [sprite_x for sprite_x in range(2 * radius + 1)
+                   if sprite_mask.get_at((sprite_x, sprite_y))]
+        if columns:
+            runs.append((sprite_y - radius, columns[0] - radius, columns[-1] - radius))
+
+    # the rows of a circle are nested, so each widening continues from the last
+    widened = {}
+    row = centers[:, radius:radius + width].copy()
+    low = high = 0
+    for first, last in sorted({run[1:] for run in runs}, key=lambda run: run[1] - run[0]):
+        while low > first:
+            low -= 1
+            row |= centers[:, radius - low:radius - low + width]
+        while high < last:
+            high += 1
+            row |= centers[:, radius - high:radius - high + width]
+        widened[(first, last)] = row.copy()
+
+    covered = np.zeros((height, width), dtype=np.bool_)
+    for offset, first, last in runs:
+        covered |= widened[(first, last)][radius - offset:radius - offset + height]
+
+    pixels = pygame.surfarray.pixels2d(screen).T
+    # subtracting (pixel - color) where covered and 0 elsewhere is much faster than assigning
+    # through a mask; unsigned wraparound makes it exact
+    pixels -= (pixels - np.uint32(screen.map_rgb(color))) * covered
+    del pixels
+
+
+def _sprite(radius: int, color: tuple) -> pygame.Surface:
+    """Return a transparent surface with a filled circle of radius and color at its center."""
+    key = (radius, color)
+    if key not in _SPRITES:
+        sprite = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+        pygame.draw.circle(sprite, color, (radius, radius), radius)
+        _SPRITES[key] = sprite
+    return _SPRITES[key]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["numpy", "pygame", "all_pairs", "array_physics", "graph"],
+            "allowed-io": [],
+            "max-line-length": 100,
+            # get rid of incorrect "pygame has no" error
+            "disable": ['E1101'],
+        }
+    )
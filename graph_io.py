@@ -4,18 +4,53 @@ Module Description
 ==================
 We pulled out the graph IO methods to keep the graph file entirely about updating and drawing
 
+Besides CSV, graphs can be stored in a binary format (BINARY_EXTENSION): a small header
+followed by the raw arrays of a GraphStore. It keeps velocities and masses, which the CSV
+format drops, and loads by memory-mapping the file instead of parsing it.
+
+A graph's all-pairs springs (see all_pairs.py) are kept implicit in the binary format, which
+stores only their rest positions. The CSV format has no way to say that every pair of vertices is
+joined, so they are written out as ordinary edge rows, and load back as ordinary edges.
+
 Copyright Information
 =====================
 This file is licensed under the MIT License
 """
 import csv
+import gzip
+import itertools
 import os.path
+import struct
+from typing import BinaryIO, Callable, Iterator, TextIO
+import numpy as np
+import array_physics
+from all_pairs import AllPairsSprings
 from graph import SpringMassGraph
-from vertex import Vertex
-from edge import Edge
+from graph_store import GraphStore, VERTEX_FIELDS, EDGE_FIELDS
+
+# the size in bytes of the write buffer used when saving
+WRITE_BUFFER_SIZE = 1 << 20
+# the number of rows parsed or written at a time
+ROW_CHUNK_SIZE = 1 << 16
+# the first bytes of every gzip file
+GZIP_MAGIC = b"\x1f\x8b"
+
+BINARY_EXTENSION = ".smg"
+# magic bytes, format version, number of vertices m joined by all-pairs springs, vertex count n
+# and edge count k (version 1 files have 0 padding bytes where m is)
+BINARY_HEADER = struct.Struct("<8sIIqq")
+BINARY_MAGIC = b"SPRMASS\0"
+BINARY_VERSION = 1
+# the version of files with all-pairs springs, which older versions of this module can't read
+BINARY_ALL_PAIRS_VERSION = 2
+# the arrays saved for the all-pairs springs, like VERTEX_FIELDS and EDGE_FIELDS
+ALL_PAIRS_FIELDS = (("rest_x", np.float64), ("rest_y", np.float64))
+# every array in a binary file starts at a multiple of this many bytes
+BINARY_ALIGNMENT = 8
 
 
-def load_from_csv(graph: SpringMassGraph, filename: str) -> None:
+def load_from_csv(graph: SpringMassGraph, filename: str,
+                  progress: Callable[[int, int], None] | None = None) -> None:
     """Load a graph from a csv file with the following format:
 
     - The first line of the file consists of two integers (n, k), where n is the number of vertices
@@ -28,37 +63,51 @@ def load_from_csv(graph: SpringMassGraph, filename: str) -> None:
         edge's start node, j is the list index of the edge's end node, and d is the
         initial distance between nodes
 
-    Do nothing if the file is empty or doesn't exist.
+    The file may be gzip compressed. It is read in chunks of ROW_CHUNK_SIZE rows straight into
+    preallocated arrays, so the whole file is never held in memory as strings. If progress is
+    given, it is called with (rows read, total rows) after each chunk.
 
-    Preconditions:
-    - The file is properly formatted
+    Do nothing if the file is empty or doesn't exist. Raise ValueError, leaving graph unchanged,
+    if the number of rows doesn't match (n, k) or an edge refers to a missing vertex.
     """
     if not os.path.isfile(filename):
         return
 
-    with open(filename, "r") as csvfile:
-        lines = list(csv.reader(csvfile))
+    with _open_text(filename) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return
 
-    if len(lines) == 0:
-        return
+        n, k = int(header[0]), int(header[1])
+        if n < 0 or k < 0:
+            raise ValueError(f"{filename} has a negative vertex or edge count")
+        store = GraphStore(n, k)
 
-    graph.reset()
-    n, k = int(lines[0][0]), int(lines[0][1])
+        # Add the vertices
+        for rows in _row_chunks(reader, n):
+            store.extend_vertices(_column(rows, 0, np.float64), _column(rows, 1, np.float64),
+                                  np.array([row[2] == "True" for row in rows], dtype=np.bool_))
+            if progress is not None:
+                progress(store.n_vertices, n + k)
+        _check_count(filename, "vertex", n, store.n_vertices)
+
+        # Add the edges
+        for rows in _row_chunks(reader, k):
+            store.extend_edges(_column(rows, 0, np.int32), _column(rows, 1, np.int32),
+                               _column(rows, 2, np.float64))
+            if progress is not None:
+                progress(n + store.n_edges, n + k)
+        _check_count(filename, "edge", k, store.n_edges)
+
+        extra_rows = sum(1 for row in reader if row)
+        _check_count(filename, "vertex and edge", n + k, n + k + extra_rows)
 
-    # Add the vertices
-    for i in range(1, n + 1):
-        x, y, pinned = float(lines[i][0]), float(lines[i][1]), lines[i][2]
-        vertex = Vertex(x, y)
-        if pinned == 'True':
-            vertex.pinned = True
-        graph.vertices.append(vertex)
+    if k > 0 and (min(store.start.min(), store.end.min()) < 0
+                  or max(store.start.max(), store.end.max()) >= n):
+        raise ValueError(f"{filename} has an edge to a vertex that doesn't exist")
 
-    # Add the edges
-    for i in range(n + 1, n + k + 1):
-        i, j, d = int(lines[i][0]), int(lines[i][1]), float(lines[i][2])
-        edge = Edge(graph.vertices[i], graph.vertices[j])
-        edge.initial_distance = d
-        graph.edges.append(edge)
+    _replace_graph(graph, store)
 
 
 def save_to_csv(graph: SpringMassGraph, filename: str) -> None:
@@ -75,19 +124,228 @@ def save_to_csv(graph: SpringMassGraph, filename: str) -> None:
         initial distance between nodes
 
     Do nothing if the file write fails.
+
+    Vertex indices come from a dictionary built once (or straight from the graph's GraphStore),
+    and rows are written in large buffered batches, so saving takes O(n + k) time.
+
+    The springs of graph.all_pairs are counted in k and written after the edges, a block at a
+    time, exactly as if they were edges.
     """
-    with open(filename, "w", newline="") as csvfile:
+    with open(filename, "w", newline="", buffering=WRITE_BUFFER_SIZE) as csvfile:
         writer = csv.writer(csvfile)
         n, k = len(graph.vertices), len(graph.edges)
+        all_pairs = graph.all_pairs
+
+        writer.writerow([n, k if all_pairs is None else k + all_pairs.n_edges])
+        if graph.store is not None:
+            store = graph.store
+            writer.writerows(_array_rows(store.x, store.y, store.pinned))
+            writer.writerows(_array_rows(store.start, store.end, store.rest))
+        else:
+            writer.writerows((vertex.x, vertex.y, vertex.pinned) for vertex in graph.vertices)
+
+            index = {vertex: i for i, vertex in enumerate(graph.vertices)}
+            writer.writerows(
+                (index[edge.start], index[edge.end], edge.initial_distance)
+                for edge in graph.edges
+            )
+
+        if all_pairs is not None:
+            for start, end, rest in all_pairs.edge_blocks():
+                writer.writerows(_array_rows(start, end, rest))
+
+
+def _array_rows(*columns: np.ndarray) -> Iterator[tuple]:
+    """Yield the rows of columns as python values, converting ROW_CHUNK_SIZE rows at a time
+    so the whole table is never held as python objects at once."""
+    for begin in range(0, len(columns[0]), ROW_CHUNK_SIZE):
+        yield from zip(*(column[begin:begin + ROW_CHUNK_SIZE].tolist() for column in columns))
+
+
+def save_to_binary(graph: SpringMassGraph, filename: str) -> None:
+    """Save a graph to a binary file with the following format:
+
+    - A BINARY_HEADER with BINARY_MAGIC, the version, m (see below), the number of vertices
+        n and the number of edges k
+    - The vertex arrays x, y, vx, vy, mass (little-endian float64) and pinned (one byte each),
+        n entries each, in that order
+    - The edge arrays start, end (little-endian int32) and rest (little-endian float64),
+        k entries each, in that order
+    - If graph has all-pairs springs between its first m vertices, the arrays rest_x and
+        rest_y of graph.all_pairs (little-endian float64), m entries each. The file is then
+        BINARY_ALL_PAIRS_VERSION rather than BINARY_VERSION, and m is 0 otherwise.
+
+    Each array starts at a multiple of BINARY_ALIGNMENT bytes, padded with zeros.
+    """
+    with open(filename, "wb") as file:
+        write_binary(graph, file)
+
+
+def write_binary(graph: SpringMassGraph, file: BinaryIO) -> None:
+    """Write graph to file in the format of save_to_binary, with the array offsets counted
+    from where file is now, so the graph can be part of a larger file."""
+    state = graph.store if graph.store is not None \
+        else array_physics.gather(graph.vertices, graph.edges)
+    n, k = len(graph.vertices), len(graph.edges)
+    all_pairs = graph.all_pairs
+    m = 0 if all_pairs is None else all_pairs.n
+    version = BINARY_VERSION if all_pairs is None else BINARY_ALL_PAIRS_VERSION
+
+    start = file.tell()
+    file.write(BINARY_HEADER.pack(BINARY_MAGIC, version, m, n, k))
+    for name, dtype, offset, _ in _binary_layout(n, k, m):
+        file.write(b"\0" * (start + offset - file.tell()))
+        source = all_pairs if name in dict(ALL_PAIRS_FIELDS) else state
+        file.write(np.ascontiguousarray(getattr(source, name), dtype).tobytes())
+
+
+def _open_text(filename: str) -> TextIO:
+    """Open filename for reading as text, decompressing it if it is gzip compressed."""
+    with open(filename, "rb") as file:
+        is_gzip = file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    if is_gzip:
+        return gzip.open(filename, "rt", newline="")
+    return open(filename, "r", newline="")
+
+
+def _row_chunks(reader: Iterator[list[str]], count: int) -> Iterator[list[list[str]]]:
+    """Yield the next count rows of reader in lists of at most ROW_CHUNK_SIZE rows,
+    stopping early if reader runs out."""
+    while count > 0:
+        rows = list(itertools.islice(reader, min(count, ROW_CHUNK_SIZE)))
+        if not rows:
+            return
+        count -= len(rows)
+        yield rows
+
+
+def _column(rows: list[list[str]], i: int, dtype: type) -> np.ndarray:
+    """Parse column i of rows into an array of dtype."""
+    return np.array([row[i] for row in rows], dtype=dtype)
+
+
+def _check_count(filename: str, kind: str, expected: int, found: int) -> None:
+    """Raise ValueError if the header of filename promised expected items of kind but the
+    file held found."""
+    if expected != found:
+        raise ValueError(f"{filename} should have {expected} {kind} rows but has {found}")
+
+
+def _replace_graph(graph: SpringMassGraph, store: GraphStore) -> None:
+    """Replace the vertices and edges of graph with the contents of store."""
+    graph.reset()
+    if graph.store is not None:
+        graph.store.use_arrays(store.arrays())
+        return
+
+    vertices, edges = store.to_objects()
+    graph.vertices.extend(vertices)
+    graph.edges.extend(edges)
+
+
+def load_from_binary(graph: SpringMassGraph, filename: str) -> None:
+    """Load a graph saved by save_to_binary.
+
+    With the numpy backend the file is memory-mapped copy-on-write, so nothing is parsed or
+    copied up front and the simulation never writes back to the file. With the python backend
+    Vertex and Edge objects are created from the mapped arrays.
+
+    Do nothing if the file doesn't exist. Raise ValueError if it is not a graph binary file.
+    """
+    if not os.path.isfile(filename):
+        return
+
+    with open(filename, "rb") as file:
+        header = file.read(BINARY_HEADER.size)
+    arrays = {}
+    for name, dtype, offset, count in _read_binary_header(header, filename):
+        arrays[name] = np.memmap(filename, dtype, "c", offset, (count,)) if count > 0 \
+            else np.zeros(0, dtype)
+    _use_binary_arrays(graph, arrays)
+
+
+def read_binary(graph: SpringMassGraph, data: bytes) -> None:
+    """Load a graph from data, the contents of a file saved by save_to_binary, copying its
+    arrays out of data.
+
+    Raise ValueError if data is not a graph binary file.
+    """
+    arrays = {}
+    for name, dtype, offset, count in _read_binary_header(data[:BINARY_HEADER.size], "data"):
+        arrays[name] = np.frombuffer(data, dtype, count, offset).copy()
+    _use_binary_arrays(graph, arrays)
+
+
+def _read_binary_header(header: bytes, source: str) -> list[tuple[str, np.dtype, int, int]]:
+    """Return the _binary_layout of the graph binary file starting with header, read from
+    source. Raise ValueError if it is not a graph binary file."""
+    if len(header) < BINARY_HEADER.size:
+        raise ValueError(f"{source} is not a graph binary file")
+    magic, version, m, n, k = BINARY_HEADER.unpack(header)
+    if magic != BINARY_MAGIC or version not in (BINARY_VERSION, BINARY_ALL_PAIRS_VERSION):
+        raise ValueError(f"{source} is not a version {BINARY_VERSION} or "
+                         f"{BINARY_ALL_PAIRS_VERSION} graph binary file")
+    if version == BINARY_VERSION:
+        m = 0
+    return _binary_layout(n, k, m)
+
+
+def _use_binary_arrays(graph: SpringMassGraph, arrays: dict[str, np.ndarray]) -> None:
+    """Replace the vertices, edges and all-pairs springs of graph with the arrays read from a
+    graph binary file."""
+    all_pairs = AllPairsSprings(arrays.pop("rest_x"), arrays.pop("rest_y")) \
+        if "rest_x" in arrays else None
+    store = GraphStore()
+    store.use_arrays(arrays)
+    _replace_graph(graph, store)
+    graph.all_pairs = all_pairs
+
+
+def load_graph(graph: SpringMassGraph, filename: str) -> None:
+    """Load graph from filename, in the binary format if it ends with BINARY_EXTENSION and as
+    (possibly gzip compressed) csv otherwise."""
+    if filename.endswith(BINARY_EXTENSION):
+        load_from_binary(graph, filename)
+    else:
+        load_from_csv(graph, filename)
+
+
+def save_graph(graph: SpringMassGraph, filename: str) -> None:
+    """Save graph to filename, in the binary format if it ends with BINARY_EXTENSION and as
+    csv otherwise."""
+    if filename.endswith(BINARY_EXTENSION):
+        save_to_binary(graph, filename)
+    else:
+        save_to_csv(graph, filename)
+
+
+def csv_to_binary(csv_filename: str, binary_filename: str) -> None:
+    """Convert a graph csv file to the binary format."""
+    graph = SpringMassGraph(backend="numpy")
+    load_from_csv(graph, csv_filename)
+    save_to_binary(graph, binary_filename)
+
+
+def binary_to_csv(binary_filename: str, csv_filename: str) -> None:
+    """Convert a graph binary file to the csv format, dropping velocities and masses."""
+    graph = SpringMassGraph(backend="numpy")
+    load_from_binary(graph, binary_filename)
+    save_to_csv(graph, csv_filename)
 
-        writer.writerow([n, k])
-        for vertex in graph.vertices:
-            writer.writerow([vertex.x, vertex.y, vertex.pinned])
 
-        for edge in graph.edges:
-            i = graph.vertices.index(edge.start)
-            j = graph.vertices.index(edge.end)
-            writer.writerow([i, j, edge.initial_distance])
+def _binary_layout(n: int, k: int, m: int = 0) -> list[tuple[str, np.dtype, int, int]]:
+    """Return the (name, dtype, byte offset, length) of each array in a binary file with n
+    vertices, k edges and all-pairs springs between m vertices, if m > 0."""
+    layout = []
+    offset = BINARY_HEADER.size
+    all_pairs_fields = ALL_PAIRS_FIELDS if m > 0 else ()
+    for fields, count in ((VERTEX_FIELDS, n), (EDGE_FIELDS, k), (all_pairs_fields, m)):
+        for name, dtype in fields:
+            dtype = np.dtype(dtype).newbyteorder("<")
+            offset = -(-offset // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+            layout.append((name, dtype, offset, count))
+            offset += dtype.itemsize * count
+    return layout
 
 
 if __name__ == "__main__":
@@ -97,8 +355,11 @@ if __name__ == "__main__":
     import python_ta
     python_ta.check_all(
         config={
-            "extra-imports": ["csv", "os.path", "graph", "edge", "vertex"],
-            "allowed-io": ["load_from_csv", "save_to_csv"],
+            "extra-imports": ["csv", "gzip", "itertools", "os.path", "struct", "typing", "numpy",
+                              "all_pairs", "array_physics", "graph", "graph_store"],
+            "allowed-io": [
+                "load_from_csv", "save_to_csv", "save_to_binary", "load_from_binary", "_open_text"
+            ],
             "max-line-length": 100
         }
     )
@@ -0,0 +1,474 @@
+"""CSC 111 Final Project: Compact Graph Storage
+
+Module Description
+==================
+Every Vertex and Edge object carries a full __dict__, and every Edge keeps references to its
+endpoint objects. For big cloths that is hundreds of bytes per vertex, scattered all over memory.
+
+GraphStore keeps the same data as structure-of-arrays: one contiguous numpy array per field,
+with edges referring to their endpoints by index. VertexView and EdgeView are small objects that
+point at one slot of a store and behave like Vertex and Edge, and VertexList/EdgeList wrap a store
+so it can stand in for the graph's vertices and edges lists.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from typing import Iterator
+import numpy as np
+import array_physics
+from edge import Edge
+from vertex import Vertex, DEFAULT_MASS
+
+# (name, dtype) of each per-vertex and per-edge array
+VERTEX_FIELDS = (
+    ("x", np.float64), ("y", np.float64), ("vx", np.float64), ("vy", np.float64),
+    ("mass", np.float64), ("pinned", np.bool_)
+)
+EDGE_FIELDS = (("start", np.int32), ("end", np.int32), ("rest", np.float64))
+
+MIN_CAPACITY = 16
+
+
+class GraphStore:
+    """Vertices and edges of a spring mass graph stored as contiguous arrays.
+
+    Each array has room for more items than are in use, like a python list, so appending is
+    amortized O(1). The properties (x, y, vx, ..., rest) return views of the slots in use, so
+    a GraphStore can be passed anywhere an array_physics.ArrayState is expected.
+
+    Instance Attributes:
+    - n_vertices: the number of vertices in use
+    - n_edges: the number of edges in use
+
+    Representation Invariants:
+    - 0 <= self.n_vertices <= len(self._vertex_arrays["x"])
+    - 0 <= self.n_edges <= len(self._edge_arrays["start"])
+    - every start and end index is in range(self.n_vertices)
+    """
+    n_vertices: int
+    n_edges: int
+    _vertex_arrays: dict[str, np.ndarray]
+    _edge_arrays: dict[str, np.ndarray]
+
+    def __init__(self, vertex_capacity: int = 0, edge_capacity: int = 0) -> None:
+        self.n_vertices = 0
+        self.n_edges = 0
+        self._vertex_arrays = {
+            name: np.zeros(vertex_capacity, dtype) for name, dtype in VERTEX_FIELDS
+        }
+        self._edge_arrays = {
+            name: np.zeros(edge_capacity, dtype) for name, dtype in EDGE_FIELDS
+        }
+
+    @classmethod
+    def from_objects(cls, vertices: list[Vertex], edges: list[Edge]) -> "GraphStore":
+        """Create a store holding copies of vertices and edges."""
+        state = array_physics.gather(vertices, edges)
+        store = cls(len(vertices), len(edges))
+        store.extend_vertices(state.x, state.y, state.pinned,
+                              vx=state.vx, vy=state.vy, mass=state.mass)
+        store.extend_edges(state.start, state.end, state.rest)
+        return store
+
+    def to_objects(self) -> tuple[list[Vertex], list[Edge]]:
+        """Return new Vertex and Edge objects with the contents of self."""
+        vertices = []
+        columns = (self.x, self.y, self.vx, self.vy, self.mass, self.pinned)
+        for x, y, vx, vy, mass, pinned in zip(*(column.tolist() for column in columns)):
+            vertex = Vertex(x, y)
+            vertex.vx, vertex.vy, vertex.mass, vertex.pinned = vx, vy, mass, pinned
+            vertices.append(vertex)
+
+        edges = []
+        for i, j, rest in zip(self.start.tolist(), self.end.tolist(), self.rest.tolist()):
+            edge = Edge(vertices[i], vertices[j])
+            edge.initial_distance = rest
+            edges.append(edge)
+        return vertices, edges
+
+    def use_arrays(self, arrays: dict[str, np.ndarray]) -> None:
+        """Replace the contents of self with the given arrays, without copying them.
+
+        The arrays may be memory-mapped; they are only copied if self later needs to grow.
+
+        Preconditions:
+        - arrays has one array per name in VERTEX_FIELDS and EDGE_FIELDS
+        - the vertex arrays all have the same length, and so do the edge arrays
+        """
+        self._vertex_arrays = {name: arrays[name] for name, _ in VERTEX_FIELDS}
+        self._edge_arrays = {name: arrays[name] for name, _ in EDGE_FIELDS}
+        self.n_vertices = len(self._vertex_arrays["x"])
+        self.n_edges = len(self._edge_arrays["start"])
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """Return the arrays of the slots in use, by field name."""
+        arrays = {name: self._vertex_arrays[name][:self.n_vertices] for name, _ in VERTEX_FIELDS}
+        arrays.update({name: self._edge_arrays[name][:self.n_edges] for name, _ in EDGE_FIELDS})
+        return arrays
+
+    # arrays of the slots in use
+    @property
+    def x(self) -> np.ndarray:
+        """Vertex x positions."""
+        return self._vertex_arrays["x"][:self.n_vertices]
+
+    @property
+    def y(self) -> np.ndarray:
+        """Vertex y positions."""
+        return self._vertex_arrays["y"][:self.n_vertices]
+
+    @property
+    def vx(self) -> np.ndarray:
+        """Vertex x velocities."""
+        return self._vertex_arrays["vx"][:self.n_vertices]
+
+    @property
+    def vy(self) -> np.ndarray:
+        """Vertex y velocities."""
+        return self._vertex_arrays["vy"][:self.n_vertices]
+
+    @property
+    def mass(self) -> np.ndarray:
+        """Vertex masses."""
+        return self._vertex_arrays["mass"][:self.n_vertices]
+
+    @property
+    def pinned(self) -> np.ndarray:
+        """Whether each vertex is pinned."""
+        return self._vertex_arrays["pinned"][:self.n_vertices]
+
+    @property
+    def start(self) -> np.ndarray:
+        """Index of each edge's start vertex."""
+        return self._edge_arrays["start"][:self.n_edges]
+
+    @property
+    def end(self) -> np.ndarray:
+        """Index of each edge's end vertex."""
+        return self._edge_arrays["end"][:self.n_edges]
+
+    @property
+    def rest(self) -> np.ndarray:
+        """Initial (rest) length of each edge."""
+        return self._edge_arrays["rest"][:self.n_edges]
+
+    def vertex_field(self, name: str, i: int) -> float | bool:
+        """Return field name of vertex i. Raise IndexError if there is no vertex i."""
+        self._check_vertex(i)
+        return self._vertex_arrays[name][i].item()
+
+    def set_vertex_field(self, name: str, i: int, value: float | bool) -> None:
+        """Set field name of vertex i to value. Raise IndexError if there is no vertex i."""
+        self._check_vertex(i)
+        self._vertex_arrays[name][i] = value
+
+    def edge_field(self, name: str, i: int) -> float | int:
+        """Return field name of edge i. Raise IndexError if there is no edge i."""
+        self._check_edge(i)
+        return self._edge_arrays[name][i].item()
+
+    def set_edge_field(self, name: str, i: int, value: float | int) -> None:
+        """Set field name of edge i to value. Raise IndexError if there is no edge i."""
+        self._check_edge(i)
+        self._edge_arrays[name][i] = value
+
+    def append_vertex(self, vertex: Vertex) -> int:
+        """Copy vertex into self and return its index."""
+        self._reserve_vertices(self.n_vertices + 1)
+        i = self.n_vertices
+        for name, _ in VERTEX_FIELDS:
+            self._vertex_arrays[name][i] = getattr(vertex, name)
+        self.n_vertices += 1
+        return i
+
+    def append_edge(self, i: int, j: int, rest: float) -> int:
+        """Add an edge between vertices i and j with rest length rest and return its index."""
+        self._reserve_edges(self.n_edges + 1)
+        e = self.n_edges
+        self._edge_arrays["start"][e] = i
+        self._edge_arrays["end"][e] = j
+        self._edge_arrays["rest"][e] = rest
+        self.n_edges += 1
+        return e
+
+    def extend_vertices(self, x: np.ndarray, y: np.ndarray, pinned: np.ndarray | None = None,
+                        **fields: np.ndarray) -> None:
+        """Append a vertex for each entry of x and y.
+
+        Fields that are not given take the same defaults as Vertex(x, y), and other fields
+        (vx, vy, mass) may be passed as keyword arrays.
+        """
+        n = len(x)
+        self._reserve_vertices(self.n_vertices + n)
+        new = slice(self.n_vertices, self.n_vertices + n)
+        arrays = self._vertex_arrays
+        arrays["x"][new] = x
+        arrays["y"][new] = y
+        arrays["vx"][new] = fields.get("vx", 0.0)
+        arrays["vy"][new] = fields.get("vy", 0.0)
+        arrays["mass"][new] = fields.get("mass", DEFAULT_MASS)
+        arrays["pinned"][new] = False if pinned is None else pinned
+        self.n_vertices += n
+
+    def extend_edges(self, start: np.ndarray, end: np.ndarray, rest: np.ndarray) -> None:
+        """Append an edge for each entry of start, end and rest."""
+        k = len(start)
+        self._reserve_edges(self.n_edges + k)
+        new = slice(self.n_edges, self.n_edges + k)
+        self._edge_arrays["start"][new] = start
+        self._edge_arrays["end"][new] = end
+        self._edge_arrays["rest"][new] = rest
+        self.n_edges += k
+
+    def swap_remove_edge(self, e: int) -> None:
+        """Remove edge e by moving the last edge into its slot."""
+        self.n_edges -= 1
+        last = self.n_edges
+        for array in self._edge_arrays.values():
+            array[e] = array[last]
+
+    def swap_remove_vertex(self, v: int, moved_edges: set[int]) -> None:
+        """Remove vertex v by moving the last vertex into its slot.
+
+        moved_edges must be the edges touching the last vertex; their endpoints are renumbered.
+
+        Preconditions:
+        - no edge touches vertex v
+        """
+        self.n_vertices -= 1
+        last = self.n_vertices
+        for array in self._vertex_arrays.values():
+            array[v] = array[last]
+
+        start, end = self._edge_arrays["start"], self._edge_arrays["end"]
+        for e in moved_edges:
+            if start[e] == last:
+                start[e] = v
+            if end[e] == last:
+                end[e] = v
+
+    def clear(self) -> None:
+        """Remove all vertices and edges, keeping the allocated arrays."""
+        self.n_vertices = 0
+        self.n_edges = 0
+
+    def nbytes(self) -> int:
+        """Return the number of bytes used by the arrays of self, including spare capacity."""
+        return sum(a.nbytes for a in self._vertex_arrays.values()) + \
+            sum(a.nbytes for a in self._edge_arrays.values())
+
+    def _check_vertex(self, i: int) -> None:
+        """Raise IndexError if there is no vertex i, as for the view of a removed vertex whose
+        slot is now past the end."""
+        if not 0 <= i < self.n_vertices:
+            raise IndexError(f"vertex {i} is not in the store of {self.n_vertices} vertices")
+
+    def _check_edge(self, i: int) -> None:
+        """Raise IndexError if there is no edge i."""
+        if not 0 <= i < self.n_edges:
+            raise IndexError(f"edge {i} is not in the store of {self.n_edges} edges")
+
+    def _reserve_vertices(self, capacity: int) -> None:
+        """Make sure there is room for capacity vertices."""
+        self._vertex_arrays = _reserve(self._vertex_arrays, capacity, self.n_vertices)
+
+    def _reserve_edges(self, capacity: int) -> None:
+        """Make sure there is room for capacity edges."""
+        self._edge_arrays = _reserve(self._edge_arrays, capacity, self.n_edges)
+
+
+def _reserve(arrays: dict[str, np.ndarray], capacity: int, used: int) -> dict[str, np.ndarray]:
+    """Return arrays, or copies of arrays with room for at least capacity items.
+    Growth is geometric so repeated appends stay amortized O(1)."""
+    current = len(next(iter(arrays.values())))
+    if capacity <= current:
+        return arrays
+
+    new_capacity = max(capacity, 2 * current, MIN_CAPACITY)
+    grown = {}
+    for name, array in arrays.items():
+        grown[name] = np.zeros(new_capacity, array.dtype)
+        grown[name][:used] = array[:used]
+    return grown
+
+
+def _vertex_property(name: str) -> property:
+    """Return a property that reads and writes field name of a VertexView's slot."""
+    return property(
+        lambda self: self.store.vertex_field(name, self.index),
+        lambda self, value: self.store.set_vertex_field(name, self.index, value),
+        doc=f"The {name} field of this vertex."
+    )
+
+
+class VertexView(Vertex):
+    """A Vertex whose data lives in slot index of a GraphStore.
+
+    Reading and writing x, y, vx, vy, mass and pinned goes straight to the store, so update and
+    clamp behave exactly as they do on a Vertex.
+
+    Instance Attributes:
+    - store: the store holding this vertex
+    - index: the slot of this vertex in store
+    """
+    store: GraphStore
+    index: int
+
+    def __init__(self, store: GraphStore, index: int) -> None:
+        # pylint: disable=super-init-not-called
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, VertexView) and other.store is self.store \
+            and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.index))
+
+    def __repr__(self) -> str:
+        return f"VertexView({self.index}, x={self.x}, y={self.y})"
+
+    x = _vertex_property("x")
+    y = _vertex_property("y")
+    vx = _vertex_property("vx")
+    vy = _vertex_property("vy")
+    mass = _vertex_property("mass")
+    pinned = _vertex_property("pinned")
+
+
+class EdgeView(Edge):
+    """An Edge whose data lives in slot index of a GraphStore.
+
+    Instance Attributes:
+    - store: the store holding this edge
+    - index: the slot of this edge in store
+    """
+    store: GraphStore
+    index: int
+
+    def __init__(self, store: GraphStore, index: int) -> None:
+        # pylint: disable=super-init-not-called
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, EdgeView) and other.store is self.store \
+            and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.index))
+
+    def __repr__(self) -> str:
+        return f"EdgeView({self.index}, start={self.start.index}, end={self.end.index})"
+
+    @property
+    def start(self) -> VertexView:
+        """The start vertex of this edge."""
+        return VertexView(self.store, self.store.edge_field("start", self.index))
+
+    @property
+    def end(self) -> VertexView:
+        """The end vertex of this edge."""
+        return VertexView(self.store, self.store.edge_field("end", self.index))
+
+    @property
+    def initial_distance(self) -> float:
+        """The rest length of this edge."""
+        return self.store.edge_field("rest", self.index)
+
+    @initial_distance.setter
+    def initial_distance(self, value: float) -> None:
+        self.store.set_edge_field("rest", self.index, value)
+
+
+class VertexList:
+    """The vertices of a GraphStore, usable in place of a list[Vertex].
+
+    Indexing and iterating give VertexView objects. Appending a Vertex copies it into the store;
+    to keep working with the stored vertex, use self[-1] afterwards.
+
+    Instance Attributes:
+    - store: the underlying store
+    """
+    store: GraphStore
+
+    def __init__(self, store: GraphStore) -> None:
+        self.store = store
+
+    def __len__(self) -> int:
+        return self.store.n_vertices
+
+    def __getitem__(self, i: int) -> VertexView:
+        return VertexView(self.store, _check_index(i, self.store.n_vertices))
+
+    def __iter__(self) -> Iterator[VertexView]:
+        return (VertexView(self.store, i) for i in range(self.store.n_vertices))
+
+    def __contains__(self, vertex: object) -> bool:
+        return isinstance(vertex, VertexView) and vertex.store is self.store \
+            and vertex.index < self.store.n_vertices
+
+    def append(self, vertex: Vertex) -> None:
+        """Copy vertex into the store."""
+        self.store.append_vertex(vertex)
+
+    def index(self, vertex: Vertex) -> int:
+        """Return the index of vertex. Raise ValueError if it is not stored here."""
+        if vertex not in self:
+            raise ValueError(f"{vertex!r} is not in this graph")
+        return vertex.index
+
+
+class EdgeList:
+    """The edges of a GraphStore, usable in place of a list[Edge].
+
+    Indexing and iterating give EdgeView objects. Appending an Edge copies it into the store, so
+    its endpoints must already be vertices of the same store.
+
+    Instance Attributes:
+    - store: the underlying store
+    """
+    store: GraphStore
+
+    def __init__(self, store: GraphStore) -> None:
+        self.store = store
+
+    def __len__(self) -> int:
+        return self.store.n_edges
+
+    def __getitem__(self, i: int) -> EdgeView:
+        return EdgeView(self.store, _check_index(i, self.store.n_edges))
+
+    def __iter__(self) -> Iterator[EdgeView]:
+        return (EdgeView(self.store, i) for i in range(self.store.n_edges))
+
+    def append(self, edge: Edge) -> None:
+        """Copy edge into the store."""
+        vertices = VertexList(self.store)
+        self.store.append_edge(vertices.index(edge.start), vertices.index(edge.end),
+                               edge.initial_distance)
+
+
+def _check_index(i: int, length: int) -> int:
+    """Return i as a non-negative index into a sequence of length, like list indexing does."""
+    if i < 0:
+        i += length
+    if not 0 <= i < length:
+        raise IndexError("graph index out of range")
+    return i
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["typing", "numpy", "array_physics", "edge", "vertex"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -4,14 +4,19 @@ Module Description
 ==================
 This is how we generate our various datasets, by constructing various graphs through inheritance
 
+Each generator works out all of its vertex positions and edges as whole numpy arrays, in the
+same order the vertices and edges were once added one at a time, and hands them to
+SpringMassGraph.extend. With backend="numpy" no Vertex or Edge objects are made at all, so even
+million vertex cloths are built in seconds.
+
 Copyright Information
 =====================
 This file is licensed under the MIT License
 """
 import math
+import numpy as np
+from all_pairs import AllPairsSprings
 from graph import SpringMassGraph
-from edge import Edge
-from vertex import Vertex
 
 
 class WheelGraph(SpringMassGraph):
@@ -19,113 +24,127 @@ class WheelGraph(SpringMassGraph):
     Create a wheel graph with n edges
     """
     def __init__(self, n: int, radius: float,
-                 screen_width: int = 800, screen_height: int = 600) -> None:
-        super().__init__()
+                 screen_width: int = 800, screen_height: int = 600,
+                 backend: str = "python") -> None:
+        super().__init__(backend=backend)
 
         center_x, center_y = (screen_width / 2, screen_height / 2)
-        center = Vertex(center_x, center_y)
-        self.vertices.append(center)
-
-        old_vertex = None
-        first_vertex = None
-        for i in range(0, n):
-            theta = (math.pi * 2) * (i / n)
-            new_vertex = Vertex(
-                center_x + radius * math.cos(theta),
-                center_y + radius * math.sin(theta)
-            )
-            if i == 0:
-                first_vertex = new_vertex
-            self.vertices.append(new_vertex)
-            self.edges.append(Edge(center, new_vertex))
-            if old_vertex is not None:
-                self.edges.append(Edge(old_vertex, new_vertex))
-            old_vertex = new_vertex
-
-        self.edges.append(Edge(old_vertex, first_vertex))
+        x, y = _circle(n, radius, center_x, center_y)
+
+        # the center is vertex 0, and every rim vertex gets a spoke, then an edge from the
+        # rim vertex before it
+        rim = np.arange(1, n + 1)
+        start, end = _in_order(
+            (0, rim, True),
+            (rim - 1, rim, rim > 1),
+        )
+        self.extend(np.concatenate([[center_x], x]), np.concatenate([[center_y], y]),
+                    np.append(start, n), np.append(end, 1))
 
 
 class CompleteGraph(SpringMassGraph):
     """
     Create a fully connected graph with vertices in a circle
+
+    With implicit=True, the edges are all-pairs springs (see all_pairs.py) instead of Edge
+    objects or rows of the store, so large complete graphs fit in memory.
     """
     def __init__(self, n: int, radius: float,
-                 screen_width: int = 800, screen_height: int = 600) -> None:
-        super().__init__()
+                 screen_width: int = 800, screen_height: int = 600,
+                 backend: str = "python", implicit: bool = False) -> None:
+        super().__init__(backend=backend)
 
         center_x, center_y = (screen_width / 2, screen_height / 2)
-        for i in range(0, n):
-            theta = (math.pi * 2) * (i / n)
-            new_vertex = Vertex(
-                center_x + radius * math.cos(theta),
-                center_y + radius * math.sin(theta)
-            )
-            self.vertices.append(new_vertex)
-
-        for i in range(0, n):
-            for j in range(i + 1, n):
-                self.edges.append(Edge(self.vertices[i], self.vertices[j]))
+        x, y = _circle(n, radius, center_x, center_y)
+        if implicit:
+            no_edges = np.zeros(0, dtype=np.intp)
+            self.extend(x, y, no_edges, no_edges)
+            self.all_pairs = AllPairsSprings(x, y)
+            return
+        start, end = np.triu_indices(n, 1)
+        self.extend(x, y, start, end)
 
 
 class ClothGraph(SpringMassGraph):
     """
     Create a cloth like graph.
     """
-    def __init__(self, x_num: int, y_num: int, separation: float, screen_width: int = 800) -> None:
-        super().__init__(gravity=0.01, friction=0.99, spring_constant=0.5)
+    def __init__(self, x_num: int, y_num: int, separation: float, screen_width: int = 800,
+                 backend: str = "python") -> None:
+        super().__init__(gravity=0.01, friction=0.99, spring_constant=0.5, backend=backend)
 
         start_x = screen_width / 2 - ((x_num * separation) / 2)
 
-        grid = []
-        for i in range(0, y_num):
-            row = []
-            for j in range(0, x_num):
-                vertex = Vertex(start_x + j * separation, i * separation)
-                row.append(vertex)
-                self.vertices.append(vertex)
-            grid.append(row)
+        # vertices go row by row
+        index = np.arange(x_num * y_num)
+        rows, columns = np.divmod(index, x_num)
+        x = start_x + columns * separation
+        y = rows * separation
 
         # pin certain nodes
-        grid[0][0].pinned = True
-        grid[0][x_num - 1].pinned = True
-        grid[0][int(x_num / 3)].pinned = True
-        grid[0][int(2 * x_num / 3)].pinned = True
+        pinned = np.zeros(len(index), dtype=np.bool_)
+        pinned[[0, x_num - 1, int(x_num / 3), int(2 * x_num / 3)]] = True
 
-        for i in range(0, y_num):
-            for j in range(0, x_num):
-                if i > 0:
-                    self.edges.append(Edge(grid[i][j], grid[i - 1][j]))
-                if j > 0:
-                    self.edges.append(Edge(grid[i][j], grid[i][j - 1]))
+        start, end = _in_order(
+            (index, index - x_num, rows > 0),
+            (index, index - 1, columns > 0),
+        )
+        self.extend(x, y, start, end, pinned)
 
 
 class PyramidGraph(SpringMassGraph):
     """
     A graph made out of a triangular grid to make tall structures efficiently
     """
-    def __init__(self, count: int, separation: float, screen_width: int = 800) -> None:
-        super().__init__()
+    def __init__(self, count: int, separation: float, screen_width: int = 800,
+                 backend: str = "python") -> None:
+        super().__init__(backend=backend)
 
         start_x = screen_width / 2
 
         y_height = math.sqrt(3) * separation / 2
-        grid = []
-        for i in range(count):
-            row = []
-            for j in range(i + 1):
-                vertex = Vertex(start_x + (j - i / 2) * separation, i * y_height)
-                row.append(vertex)
-                self.vertices.append(vertex)
-            grid.append(row)
-
-        for i in range(count):
-            for j in range(i + 1):
-                if i > 0 and j < i:
-                    self.edges.append(Edge(grid[i][j], grid[i - 1][j]))
-                if i > 0 and j > 0:
-                    self.edges.append(Edge(grid[i][j], grid[i - 1][j - 1]))
-                if j > 0:
-                    self.edges.append(Edge(grid[i][j], grid[i][j - 1]))
+        # row i has i + 1 vertices, and the rows go one after another
+        rows = np.repeat(np.arange(count), np.arange(1, count + 1))
+        index = np.arange(len(rows))
+        columns = index - rows * (rows + 1) // 2
+        x = start_x + (columns - rows / 2) * separation
+        y = rows * y_height
+
+        # the vertex above and to the right, the one above and to the left, and the one to
+        # the left of each vertex
+        start, end = _in_order(
+            (index, index - rows, (rows > 0) & (columns < rows)),
+            (index, index - rows - 1, (rows > 0) & (columns > 0)),
+            (index, index - 1, columns > 0),
+        )
+        self.extend(x, y, start, end)
+
+
+def _circle(n: int, radius: float, center_x: float,
+            center_y: float) -> tuple[np.ndarray, np.ndarray]:
+    """Return the x and y positions of n vertices spaced evenly on a circle."""
+    theta = (math.pi * 2) * (np.arange(n) / n)
+    # math rounds cos and sin the same way on every machine, unlike numpy
+    cos = np.array([math.cos(angle) for angle in theta.tolist()])
+    sin = np.array([math.sin(angle) for angle in theta.tolist()])
+    return center_x + radius * cos, center_y + radius * sin
+
+
+def _in_order(*candidates: tuple) -> tuple[np.ndarray, np.ndarray]:
+    """Return the start and end indices of the edges in candidates, in order.
+
+    Each candidate is (start, end, valid), arrays (or single values) with one entry per
+    vertex position, and only the valid edges are kept. The edges are ordered by position
+    first and candidate second, the order nested loops over the positions would add them in.
+
+    >>> _in_order((np.arange(3), np.arange(3) - 1, np.arange(3) > 0), (0, np.arange(3), True))
+    (array([0, 1, 0, 2, 0]), array([0, 0, 1, 1, 2]))
+    """
+    columns = [np.broadcast_arrays(*candidate) for candidate in candidates]
+    start = np.stack([column[0] for column in columns], axis=-1)
+    end = np.stack([column[1] for column in columns], axis=-1)
+    valid = np.stack([column[2] for column in columns], axis=-1)
+    return start[valid], end[valid]
 
 
 if __name__ == "__main__":
@@ -135,7 +154,7 @@ if __name__ == "__main__":
     import python_ta
     python_ta.check_all(
         config={
-            "extra-imports": ["math", "graph", "edge", "vertex"],
+            "extra-imports": ["math", "numpy", "all_pairs", "graph"],
             "allowed-io": [],
             "max-line-length": 100,
         }
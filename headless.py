@@ -0,0 +1,165 @@
+"""CSC 111 Final Project: Headless Simulation
+
+Module Description
+==================
+Run a saved graph for a number of steps without opening a window. Nothing here imports pygame
+or tkinter, so this works on machines without a display and starts quickly.
+
+Example:
+    python headless.py data/cloth1.csv --steps 1000 --gravity 0.02 \
+        --output cloth1_final.csv --energy cloth1_energy.csv
+
+With --domains N the graph is split into N domains, each stepped by a worker process of its own
+(see domains.py), and the load of each domain is printed at the end.
+
+With --record FILE every step is recorded to a trajectory file, which replay.py plays back.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import time
+
+START_TIME = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import argparse
+import csv
+import sys
+from domains import DomainDecomposition, METHODS
+from graph import SpringMassGraph
+from graph_io import load_graph, save_graph
+from profiler import Profiler
+from trajectory import TrajectoryRecorder
+
+IMPORT_TIME = time.perf_counter() - START_TIME
+
+
+def run(graph: SpringMassGraph, steps: int, energy_every: int | None = 1,
+        domains: DomainDecomposition | None = None,
+        recorder: TrajectoryRecorder | None = None) -> list[tuple[int, float, float]]:
+    """Run graph for steps steps and return the (step, elastic potential energy, kinetic energy)
+    after every energy_every-th step, or nothing if energy_every is None, in which case no
+    energies are summed at all. If graph is being profiled, each step is a frame.
+
+    If domains is given, the steps are run by its worker processes. If recorder is given, the
+    graph is recorded to it after every step."""
+    series = None
+    if energy_every is not None:
+        series = graph.energy.subscribe(energy_every, max(steps // energy_every, 1))
+    first_frame = graph.energy.frame
+    step = graph.step if domains is None else domains.step
+    try:
+        for _i in range(steps):
+            step()
+            if recorder is not None:
+                recorder.record(graph)
+            if graph.profiler is not None:
+                graph.profiler.end_frame()
+    finally:
+        if series is not None:
+            graph.energy.unsubscribe(series)
+
+    if series is None:
+        return []
+    frames, potential_energies, kinetic_energies = series.samples()
+    return list(zip((frames - first_frame).tolist(), potential_energies.tolist(),
+                    kinetic_energies.tolist()))
+
+
+def save_energies(energies: list[tuple[int, float, float]], filename: str) -> None:
+    """Save the energy time series returned by run to a csv file with a header row."""
+    with open(filename, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["step", "elastic_potential_energy", "kinetic_energy"])
+        writer.writerows(energies)
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line arguments in argv."""
+    defaults = SpringMassGraph()
+    parser = argparse.ArgumentParser(description="Run a spring mass graph without a window.")
+    parser.add_argument("graph", help="graph file to load (.csv, .csv.gz or .smg)")
+    parser.add_argument("--steps", type=int, default=1000, help="number of physics steps")
+    parser.add_argument("--spring-constant", type=float, default=defaults.spring_constant)
+    parser.add_argument("--friction", type=float, default=defaults.friction)
+    parser.add_argument("--gravity", type=float, default=defaults.gravity)
+    parser.add_argument("--backend", choices=SpringMassGraph.BACKENDS, default="numpy")
+    parser.add_argument("--output", help="file to save the final graph to (.csv or .smg)")
+    parser.add_argument("--energy", help="csv file to save the energy time series to")
+    parser.add_argument("--energy-every", type=int, default=1,
+                        help="record the energies every this many steps")
+    parser.add_argument("--record", help="trajectory file to record every step to (.smt)")
+    parser.add_argument("--record-velocities", action="store_true",
+                        help="record the velocities as well as the positions")
+    parser.add_argument("--profile", action="store_true",
+                        help="print percentile times of each phase of the recent steps")
+    parser.add_argument("--domains", type=int,
+                        help="step the graph in this many worker processes")
+    parser.add_argument("--partition", choices=METHODS, default="spatial",
+                        help="how to split the graph into domains")
+    args = parser.parse_args(argv)
+    if args.domains is not None and args.backend != "numpy":
+        parser.error("--domains needs the numpy backend")
+    if args.domains is not None and args.profile:
+        # the phases are timed in the worker processes, out of reach of the profiler
+        parser.error("--profile can't be used with --domains")
+    return args
+
+
+def main(argv: list[str]) -> None:
+    """Load a graph, run it and save the results, as described by the arguments in argv."""
+    args = parse_args(argv)
+
+    graph = SpringMassGraph(args.spring_constant, args.friction, args.gravity, args.backend)
+    load_graph(graph, args.graph)
+    if args.profile:
+        graph.profiler = Profiler()
+    ready_time = time.perf_counter() - START_TIME
+
+    domains = None
+    if args.domains is not None:
+        domains = DomainDecomposition(graph, args.domains, args.partition)
+    recorder = None
+    if args.record is not None:
+        recorder = TrajectoryRecorder(args.record, args.record_velocities)
+    start = time.perf_counter()
+    try:
+        energies = run(graph, args.steps,
+                       args.energy_every if args.energy is not None else None, domains,
+                       recorder)
+    finally:
+        if domains is not None:
+            domains.close()
+        if recorder is not None:
+            recorder.close()
+    run_time = time.perf_counter() - start
+
+    if args.output is not None:
+        save_graph(graph, args.output)
+    if args.energy is not None:
+        save_energies(energies, args.energy)
+
+    print(f"{len(graph.vertices)} vertices, {len(graph.edges)} edges, {args.steps} steps")
+    print(f"cold start {ready_time * 1000:.1f} ms (imports {IMPORT_TIME * 1000:.1f} ms, "
+          f"load {(ready_time - IMPORT_TIME) * 1000:.1f} ms) before the first step")
+    print(f"{args.steps / max(run_time, 1e-9):,.0f} steps/s")
+    potential_energy, kinetic_energy = graph.measure_energies()
+    print(f"final elastic potential energy {potential_energy:.4f}, "
+          f"kinetic energy {kinetic_energy:.4f}")
+    if graph.profiler is not None:
+        for phase, percentiles in graph.profiler.summary().items():
+            print(f"{phase}: " + ", ".join(f"p{percentile} {milliseconds:.4f}"
+                                           for percentile, milliseconds in percentiles.items())
+                  + " ms")
+    if domains is not None:
+        for i, load in enumerate(domains.loads):
+            print(f"domain {i}: {load.vertices} vertices, {load.edges} edges, "
+                  f"{load.halo} halo vertices, compute {load.compute_seconds:.3f} s, "
+                  f"communication {load.communication_seconds:.3f} s")
+
+
+if __name__ == "__main__":
+    # this is a command line tool for batch jobs, so unlike our other modules it doesn't run
+    # doctest and python_ta after main
+    main(sys.argv[1:])
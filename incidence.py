@@ -0,0 +1,105 @@
+"""CSC 111 Final Project: Vertex-Edge Incidence
+
+Module Description
+==================
+To remove a vertex we need to know which edges touch it, and to keep the vertex and edge
+storage dense we fill the hole left by a removed item with the last item ("swap-remove").
+This module keeps track of both, in terms of vertex and edge indices, so that removing any
+vertex or edge only costs time proportional to the degrees involved.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+
+
+class Incidence:
+    """The edges touching each vertex of a graph, by index.
+
+    Instance Attributes:
+    - edges_of: edges_of[i] is the set of indices of the edges touching vertex i
+    - endpoints: endpoints[e] is the (start, end) vertex indices of edge e
+
+    Representation Invariants:
+    - e in self.edges_of[i] if and only if i in self.endpoints[e]
+    """
+    edges_of: list[set[int]]
+    endpoints: list[tuple[int, int]]
+
+    def __init__(self) -> None:
+        self.edges_of = []
+        self.endpoints = []
+
+    @property
+    def n_vertices(self) -> int:
+        """The number of vertices tracked."""
+        return len(self.edges_of)
+
+    @property
+    def n_edges(self) -> int:
+        """The number of edges tracked."""
+        return len(self.endpoints)
+
+    def add_vertex(self) -> None:
+        """Track a new vertex with index self.n_vertices."""
+        self.edges_of.append(set())
+
+    def add_edge(self, i: int, j: int) -> None:
+        """Track a new edge between vertices i and j with index self.n_edges."""
+        e = len(self.endpoints)
+        self.endpoints.append((i, j))
+        self.edges_of[i].add(e)
+        self.edges_of[j].add(e)
+
+    def remove_edge(self, e: int) -> int:
+        """Swap-remove edge e: forget it, then renumber the last edge to e.
+
+        Return the old index of the edge that now has index e, which is e itself if e was
+        the last edge. Storage should be updated the same way.
+        """
+        i, j = self.endpoints[e]
+        self.edges_of[i].discard(e)
+        self.edges_of[j].discard(e)
+
+        last = len(self.endpoints) - 1
+        if e != last:
+            a, b = self.endpoints[last]
+            self.endpoints[e] = (a, b)
+            for k in (a, b):
+                self.edges_of[k].discard(last)
+                self.edges_of[k].add(e)
+        self.endpoints.pop()
+        return last
+
+    def remove_vertex(self, v: int) -> int:
+        """Swap-remove vertex v, which must have no edges left: forget it, then renumber the
+        last vertex to v.
+
+        Return the old index of the vertex that now has index v. Its edges are self.edges_of[v].
+
+        Preconditions:
+        - self.edges_of[v] == set()
+        """
+        last = len(self.edges_of) - 1
+        if v != last:
+            moved = self.edges_of[last]
+            self.edges_of[v] = moved
+            for e in moved:
+                a, b = self.endpoints[e]
+                self.endpoints[e] = (v if a == last else a, v if b == last else b)
+        self.edges_of.pop()
+        return last
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": [],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
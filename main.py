@@ -9,12 +9,16 @@ Copyright Information
 This file is licensed under the MIT License
 """
 import pygame
+import graph_drawing
 from graph import SpringMassGraph
-from graph_io import load_from_csv, save_to_csv
+from graph_io import load_graph, save_graph
 from graph_types import PyramidGraph
-from sliders import load_sliders, load_slider_textboxes, update_sliders, draw_slider_text
+from sliders import load_sliders, load_slider_textboxes, update_sliders, draw_slider_text, \
+    set_constants
 from file_dialog import FileDialog
 from metrics import Metrics
+from profiler import Profiler, timed
+from simulation_thread import SimulationThread
 
 
 class GraphEventHandler:
@@ -25,58 +29,72 @@ class GraphEventHandler:
     1. Clicking in an empty area will create a new mass, and springs will be added between this
        masses and other masses within the green radius.
     2. Clicking and dragging a vertex will move it (and all associated springs).
-    3. Pressing "z" removes the most recently created vertex and its associated springs.
+    3. Pressing "z" removes the most recently created vertex and its associated springs,
+       and pressing "x" removes the vertices under the mouse and their springs.
     4. Pressing "l" loads a stored graph from the specified file.
-    5. Pressing "s" saves the current graph to the specified file.
-    6. There are three sliders:
+    5. Pressing "s" saves the current graph to the specified file. Files ending in
+       graph_io.BINARY_EXTENSION use the binary format, anything else is saved as csv.
+    6. Pressing "p" turns profiling on or off. While it is on, the recent time taken by each
+       phase of a frame is shown below the energies.
+    7. Pressing "t" starts recording every physics frame to the specified trajectory file, and
+       pressing it again stops. Play the file back with replay.py.
+    8. There are three sliders:
         (a) The gravity slider affects the downward force applied to the vertex each tick
         (b) The spring constant slider affects the global spring constant, which scales the
             restoring force for each spring
         (c) The friction slider affects the global friction constant, which scales the vertices'
             velocity by that amount each tick
 
+    The graph is simulated by a SimulationThread, so every change to it is submitted as a
+    command (a method taking the graph first) that runs on the physics thread between frames.
+    File dialogs are opened on the window's thread, so the physics keeps running behind them.
+
     Instance Attributes:
     - dragging: a list of vertices we are currently dragging or None if we aren't dragging
     - lastmouse: the mouse position on the last frame, used to calculate how much we
         should move vertices
     - file_dialog: an instance of the FileDialog class that we use to pick file names
+    - recording: whether a trajectory is being recorded
     """
     dragging: list | None
     lastmouse: tuple
     file_dialog: FileDialog
+    recording: bool
 
     def __init__(self) -> None:
         self.file_dialog = FileDialog()
         self.dragging = None
         self.lastmouse = (0, 0)
+        self.recording = False
 
     def check_drag_on_mousedown(self, graph: SpringMassGraph, pos: tuple) -> None:
         """Check if vertex is being dragged on mouse down."""
         posx, posy = pos
-        for v in graph.vertices:
-            if (v.x - posx) ** 2 + (v.y - posy) ** 2 < graph.DRAG_RADIUS ** 2:
-                if self.dragging is None:
-                    self.dragging = []
-                self.dragging.append(v)
-                v.pinned = True
+        for v in graph.vertices_near(posx, posy, graph.DRAG_RADIUS):
+            if self.dragging is None:
+                self.dragging = []
+            self.dragging.append(v)
+            v.pinned = True
+            graph.wake(v)
 
     def handle_graph_mouse(self, graph: SpringMassGraph, event: pygame.event.Event) -> tuple:
         """Handle dragging of graphs."""
         if event.type == pygame.MOUSEBUTTONDOWN:
-            pos = pygame.mouse.get_pos()
+            pos = event.pos
             self.check_drag_on_mousedown(graph, pos)
             self.lastmouse = pos
 
         if event.type == pygame.MOUSEMOTION:
             if self.dragging is not None:
-                newmouse = pygame.mouse.get_pos()
+                newmouse = event.pos
                 for v in self.dragging:
                     v.x += newmouse[0] - self.lastmouse[0]
                     v.y += newmouse[1] - self.lastmouse[1]
+                    graph.wake(v)
                 self.lastmouse = newmouse
 
         if event.type == pygame.MOUSEBUTTONUP:
-            pos = pygame.mouse.get_pos()
+            pos = event.pos
             if self.allow_click(pos):
                 self.add_new_vertex(graph, pos)
 
@@ -85,9 +103,20 @@ class GraphEventHandler:
         if self.dragging is None:
             graph.add_new_vertex(pos[0], pos[1])
         else:
-            for v in self.dragging:
-                v.pinned = False
-            self.dragging = None
+            self.stop_dragging(graph)
+
+    def stop_dragging(self, graph: SpringMassGraph) -> None:
+        """Let go of the vertices being dragged, if any.
+
+        Removing a vertex moves another into its place, so this must be called before removing
+        any vertex: afterwards self.dragging could name the wrong vertices.
+        """
+        if self.dragging is None:
+            return
+        for v in self.dragging:
+            v.pinned = False
+            graph.wake(v)
+        self.dragging = None
 
     def allow_click(self, pos: tuple) -> bool:
         """Prevent vertex creation near sliders."""
@@ -97,39 +126,94 @@ class GraphEventHandler:
         else:
             return True
 
+    def load_file(self, graph: SpringMassGraph, file_name: str) -> None:
+        """Replace graph with the graph stored in file_name."""
+        self.stop_dragging(graph)
+        load_graph(graph, file_name)
+
+    def reset_graph(self, graph: SpringMassGraph) -> None:
+        """Remove every vertex and edge of graph."""
+        self.stop_dragging(graph)
+        graph.reset()
+
+    def remove_last_vertex(self, graph: SpringMassGraph) -> None:
+        """Remove the last vertex added to graph."""
+        self.stop_dragging(graph)
+        graph.remove_last_vertex()
+
+    def remove_vertices_near(self, graph: SpringMassGraph, pos: tuple) -> None:
+        """Remove the vertices within dragging distance of pos."""
+        self.stop_dragging(graph)
+        posx, posy = pos
+        for v in reversed(graph.vertices_near(posx, posy, graph.DRAG_RADIUS)):
+            graph.remove_vertex(v)
+
+    def toggle_profiler(self, graph: SpringMassGraph) -> None:
+        """Start profiling graph if it isn't being profiled, and stop otherwise."""
+        graph.profiler = Profiler() if graph.profiler is None else None
+
+    def toggle_recording(self, simulation: SimulationThread) -> None:
+        """Start recording simulation to a trajectory file if it isn't being recorded, and stop
+        otherwise."""
+        if self.recording:
+            simulation.record(None)
+            self.recording = False
+        else:
+            file_name = self.file_dialog.ask_file()
+            if file_name is not None:
+                simulation.record(file_name.name)
+                self.recording = True
+
     def handle_event(
         self,
-        graph: SpringMassGraph,
+        simulation: SimulationThread,
         event: pygame.event.Event
     ) -> None:
-        """Handle pygame events for main."""
+        """Handle pygame events for main, submitting changes to the graph to simulation."""
         if event.type == pygame.KEYDOWN:
             # save the graph configuration
             if event.key == pygame.K_s:
                 file_name = self.file_dialog.ask_file()
                 if file_name is not None:
-                    save_to_csv(graph, file_name.name)
+                    simulation.submit(save_graph, file_name.name)
             # load a graph configuration
             if event.key == pygame.K_l:
                 file_name = self.file_dialog.prompt_file()
-                load_from_csv(graph, file_name)
+                simulation.submit(self.load_file, file_name)
+            # start or stop recording a trajectory
+            if event.key == pygame.K_t:
+                self.toggle_recording(simulation)
 
         if event.type == pygame.KEYDOWN:
             # remove last vertex added
             if event.key == pygame.key.key_code("z"):
-                graph.remove_last_vertex()
+                simulation.submit(self.remove_last_vertex)
+
+            # remove vertices under the mouse
+            if event.key == pygame.key.key_code("x"):
+                simulation.submit(self.remove_vertices_near, pygame.mouse.get_pos())
 
             # reset graph
             if event.key == pygame.key.key_code("r"):
-                graph.reset()
+                simulation.submit(self.reset_graph)
+
+            # toggle profiling
+            if event.key == pygame.key.key_code("p"):
+                simulation.submit(self.toggle_profiler)
 
-        self.handle_graph_mouse(graph, event)
+        if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEMOTION, pygame.MOUSEBUTTONUP):
+            simulation.submit(self.handle_graph_mouse, event)
 
 
 def main(graph: SpringMassGraph) -> None:
     """
     Initialize pygame, create the screen, initialize
     our graph, and execute the simulation's main loop.
+
+    The physics runs on a SimulationThread, so drawing and input stay at 60 frames per second
+    however long the physics takes, and the physics' own rate is shown with the energies.
+    Everything shown is read from the frames it publishes, and the sliders' values are
+    submitted to it as commands, so this thread never touches the graph while it runs.
     """
     WIDTH, HEIGHT = 800, 600
 
@@ -149,34 +233,57 @@ def main(graph: SpringMassGraph) -> None:
     metrics = Metrics(screen)
 
     textboxes = load_slider_textboxes()
+    constants = (graph.gravity, graph.friction, graph.spring_constant)
+
+    # the energies are shown for the latest frame, so they are summed on every frame
+    graph.energy.subscribe(every=1, capacity=1)
+    simulation = SimulationThread(graph)
+    simulation.start()
 
     while running:
         ev = pygame.event.get()
 
         # handle events
         for event in ev:
-            event_handler.handle_event(graph, event)
+            event_handler.handle_event(simulation, event)
 
             # handle quitting
             if event.type == pygame.QUIT:
                 running = False
 
-        graph.run_substeps()
-        graph.draw(screen)
-
-        # update slider, draw slider text, and update graph attributes
-        update_sliders(graph, (sliders[0], sliders[2], sliders[4]),
-                       (sliders[1], sliders[3], sliders[5]), ev)
-        metrics.update_widgets(graph, screen)
+        if simulation.error is not None:
+            raise simulation.error
+
+        with simulation.frame() as frame:
+            profiler = frame.profiler
+            timed(profiler, "draw", graph_drawing.draw_state, frame.state, screen,
+                  frame.all_pairs)
+            energies = frame.metrics
+
+        # update slider, draw slider text, and submit any change to the graph's constants
+        slider_constants = timed(profiler, "update_sliders", update_sliders,
+                                 (sliders[0], sliders[2], sliders[4]),
+                                 (sliders[1], sliders[3], sliders[5]), ev)
+        if slider_constants != constants:
+            constants = slider_constants
+            simulation.submit(set_constants, *constants)
+        timed(profiler, "update_widgets", metrics.update_widgets, screen, energies,
+              simulation.rate, profiler)
 
         draw_slider_text(screen, textboxes[0], textboxes[1], textboxes[2])
 
         pygame.display.update()
+        if profiler is not None:
+            profiler.end_frame()
         clock.tick(60)
 
+    simulation.stop()
+
 
 if __name__ == "__main__":
     # Also, try ClothGraph, WheelGraph, CompleteGraph, or SpringMassGraph for a blank graph
+    # For large graphs, build them straight into the numpy backend,
+    # like ClothGraph(50, 25, 10, backend="numpy")
     my_graph = PyramidGraph(6, 50)
     main(my_graph)
 
@@ -187,8 +294,8 @@ if __name__ == "__main__":
     python_ta.check_all(
         config={
             "extra-imports": [
-                "pygame", "pygame_widgets", "file_dialog", "graph",
-                "graph_io", "graph_types", "sliders", "metrics"
+                "pygame", "pygame_widgets", "file_dialog", "graph", "graph_drawing",
+                "graph_io", "graph_types", "sliders", "metrics", "profiler", "simulation_thread"
             ],
             "allowed-io": [],
             "max-line-length": 100,
@@ -9,6 +9,9 @@ Copyright Information
 =====================
 This file is licensed under the MIT License
 """
+import os
+from concurrent.futures import ProcessPoolExecutor
+from ensemble import Ensemble
 from graph_types import PyramidGraph, SpringMassGraph
 
 
@@ -17,42 +20,88 @@ def calculate_potential_score(graph: SpringMassGraph) -> float:
     it stops moving and the potential energy is no longer changing
     """
     potential_score = 0.0
-    for _i in range(10 * 60 * 16):
-        old_potential_energy = graph.metrics.elastic_potential_energy
-        graph.step()
-        if round(old_potential_energy, 5) == round(graph.metrics.elastic_potential_energy, 5) and \
-                round(graph.metrics.kinetic_energy, 5) == 0.0:
-            break
-        potential_score += graph.metrics.elastic_potential_energy / (60.0 * 16.0)
+    # every step is a frame of its own, so this samples the energies after every step
+    energies = graph.energy.subscribe(every=1, capacity=1)
+    old_potential_energy = graph.metrics.elastic_potential_energy
+    try:
+        for _i in range(10 * 60 * 16):
+            graph.step()
+            _, potential_energy, kinetic_energy = energies.latest()
+            if round(old_potential_energy, 5) == round(potential_energy, 5) and \
+                    round(kinetic_energy, 5) == 0.0:
+                break
+            potential_score += potential_energy / (60.0 * 16.0)
+            old_potential_energy = potential_energy
+    finally:
+        graph.energy.unsubscribe(energies)
 
     return round(potential_score, 4)
 
 
 def run_with_config(graph: SpringMassGraph, config: list[float]) -> float:
-    """Run simulation with given constants"""
+    """Run simulation with given constants
+
+    The graph's vertices are restored afterwards, so every call starts from the same state
+    and the results don't depend on the order of the calls.
+    """
     spring_constant, friction, gravity = config
     graph.spring_constant = spring_constant
     graph.friction = friction
     graph.gravity = gravity
-    return calculate_potential_score(graph)
+    snapshot = graph.snapshot()
+    potential_score = calculate_potential_score(graph)
+    graph.restore(snapshot)
+    return potential_score
+
+
+def evaluate_configs(configs: list[tuple[float, float, float]]) -> list[float]:
+    """Return the potential score of a fresh PyramidGraph(6, 50) run with each config.
+
+    All configs are run together as one Ensemble, which is much faster than calling
+    run_with_config for each. This is a top level function so that it can be sent to
+    worker processes.
+    """
+    return Ensemble(PyramidGraph(6, 50), configs).potential_scores()
 
 
-def main() -> None:
-    """The main measurements function"""
+def main(max_workers: int | None = None) -> None:
+    """The main measurements function
+
+    Each round probes every parameter to the left and right of the current config and moves
+    each parameter towards its better probe. All six probes of a round start from the same
+    config on their own fresh graph, so they are independent: they are split between a pool
+    of max_workers processes (one per CPU by default), each running its share as an Ensemble.
+    Executor.map returns results in submission order, so the outcome doesn't depend on which
+    worker finishes first.
+    """
     config = [0.03, 0.98, 0.01]
     clamps = ((0.01, 0.1), (0.9, 0.99), (0.01, 0.2))
-    graph = PyramidGraph(6, 50)
-    for _j in range(40):
-        for i in range(3):
-            # Use gradient descent to optimize the three parameters
-            left = max(clamps[i][0], config[i] - (clamps[i][1] - clamps[i][0]) / 20)
-            right = min(clamps[i][1], config[i] + (clamps[i][1] - clamps[i][0]) / 20)
-            config[i] = left
-            left_run = run_with_config(graph, config)
-            config[i] = right
-            right_run = run_with_config(graph, config)
-            if left_run < right_run:
-                config[i] = left
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        for _j in range(40):
+            probes = []
+            for i in range(3):
+                # Use gradient descent to optimize the three parameters
+                left = max(clamps[i][0], config[i] - (clamps[i][1] - clamps[i][0]) / 20)
+                right = min(clamps[i][1], config[i] + (clamps[i][1] - clamps[i][0]) / 20)
+                probes.append((left, right))
+
+            probe_configs = []
+            for i, (left, right) in enumerate(probes):
+                for value in (left, right):
+                    probe_config = list(config)
+                    probe_config[i] = value
+                    probe_configs.append(tuple(probe_config))
+
+            # split the probes into contiguous chunks, one per worker, keeping their order
+            chunk_size = -(-len(probe_configs) // workers)
+            chunks = [probe_configs[c:c + chunk_size]
+                      for c in range(0, len(probe_configs), chunk_size)]
+            scores = [score for chunk in executor.map(evaluate_configs, chunks) for score in chunk]
+
+            for i, (left, right) in enumerate(probes):
+                left_run, right_run = scores[2 * i], scores[2 * i + 1]
+                config[i] = left if left_run < right_run else right
     print(config)
 
 
@@ -65,7 +114,7 @@ if __name__ == "__main__":
     import python_ta
     python_ta.check_all(
         config={
-            "extra-imports": ["graph_types"],
+            "extra-imports": ["os", "concurrent.futures", "ensemble", "graph_types"],
             "max-line-length": 120,
             "allowed-io": ["main"]
         }
@@ -9,7 +9,8 @@ Copyright Information
 This file is licensed under the MIT License.
 """
 import pygame
-from graph import SpringMassGraph
+from graph import Metrics as GraphMetrics
+from profiler import Profiler
 
 
 class Metrics:
@@ -23,15 +24,38 @@ class Metrics:
 
     POTENTIAL_ENERGY_LOCATION: tuple[int, int] = (5, 5)
     KINETIC_ENERGY_LOCATION: tuple[int, int] = (5, 35)
+    SUBSTEPS_LOCATION: tuple[int, int] = (5, 65)
+    SIMULATION_RATE_LOCATION: tuple[int, int] = (5, 95)
+    PROFILE_LOCATION: tuple[int, int] = (5, 125)
+    PROFILE_LINE_HEIGHT: int = 20
 
     def __init__(self, screen: pygame.Surface) -> None:
         """Initialize metrics class"""
         self.font = pygame.font.SysFont('Comic Sans MS', 15)
         self._render(0.0, 0.0, screen)
 
-    def update_widgets(self, graph: SpringMassGraph, screen: pygame.Surface) -> None:
-        """Update widgets to reflect results of computation"""
-        self._render(graph.metrics.elastic_potential_energy, graph.metrics.kinetic_energy, screen)
+    def update_widgets(self, screen: pygame.Surface, energies: GraphMetrics,
+                       simulation_rate: float | None = None,
+                       profiler: Profiler | None = None) -> None:
+        """Update widgets to reflect results of computation, including how many substeps the
+        last frame was split into
+
+        energies are the metrics of the frame being drawn, taken from the published frame
+        rather than the graph since the physics runs on another thread. The number of physics
+        frames run per second, and the recent times of profiler, are shown too if given.
+        """
+        self._render(energies.elastic_potential_energy, energies.kinetic_energy, screen)
+        substeps_text = self.font.render(
+            'Substeps: ' + str(energies.substeps), False, (0, 0, 0)
+        )
+        screen.blit(substeps_text, self.SUBSTEPS_LOCATION)
+        if simulation_rate is not None:
+            simulation_rate_text = self.font.render(
+                'Simulation: ' + str(round(simulation_rate, 1)) + ' frames/s', False, (0, 0, 0)
+            )
+            screen.blit(simulation_rate_text, self.SIMULATION_RATE_LOCATION)
+        if profiler is not None:
+            self._render_profile(profiler, screen)
 
     def _render(self, potential_energy: float, kinetic_energy: float, screen: pygame.Surface) -> None:
         """Render widgets"""
@@ -45,6 +69,16 @@ class Metrics:
         )
         screen.blit(kinetic_energy_text, self.KINETIC_ENERGY_LOCATION)
 
+    def _render_profile(self, profiler: Profiler, screen: pygame.Surface) -> None:
+        """Render the recent percentile times of every profiled phase, below the energies"""
+        x, y = self.PROFILE_LOCATION
+        for phase, percentiles in profiler.summary().items():
+            times = ', '.join(f'p{percentile} {milliseconds:.2f}'
+                              for percentile, milliseconds in percentiles.items())
+            phase_text = self.font.render(f'{phase}: {times} ms', False, (0, 0, 0))
+            screen.blit(phase_text, (x, y))
+            y += self.PROFILE_LINE_HEIGHT
+
 
 if __name__ == "__main__":
     import doctest
@@ -55,7 +89,8 @@ if __name__ == "__main__":
         config={
             "extra-imports": [
                 "pygame",
-                "graph"
+                "graph",
+                "profiler"
             ],
             "max-line-length": 120,
         }
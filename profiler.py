@@ -0,0 +1,128 @@
+"""CSC 111 Final Project: Phase Profiler
+
+Module Description
+==================
+To tell which part of a frame is slow, a Profiler records how long each phase (updating edges,
+drawing, ...) takes. Times recorded during a frame are added up per phase, and end_frame keeps
+the totals of the last few frames so that percentiles over recent frames can be reported.
+
+A graph is only profiled when its profiler attribute is set, so that an unprofiled step only
+pays for checking that attribute. Times may be recorded from several threads, such as the
+physics thread of a SimulationThread and the window's thread.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from collections import deque
+import threading
+import time
+from typing import Any, Callable
+import numpy as np
+
+# the number of recent frames percentiles are computed over
+FRAME_WINDOW = 120
+# the percentiles reported by Profiler.summary
+PERCENTILES = (50, 95, 99)
+# the name of the phase holding the time between consecutive calls to end_frame
+FRAME = "frame"
+
+
+class Profiler:
+    """Rolling per-phase timings over recent frames.
+
+    Instance Attributes:
+    - frames: for each phase, its total time in seconds in each recent frame, oldest first
+
+    Representation Invariants:
+    - every deque in self.frames has at most FRAME_WINDOW entries
+    """
+    frames: dict[str, deque[float]]
+    _current: dict[str, float]
+    _last_frame_end: float | None
+    _window: int
+    _lock: threading.Lock
+
+    def __init__(self, window: int = FRAME_WINDOW) -> None:
+        self.frames = {}
+        self._current = {}
+        self._last_frame_end = None
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float) -> None:
+        """Add seconds to the time phase has taken in the current frame."""
+        with self._lock:
+            self._current[phase] = self._current.get(phase, 0.0) + seconds
+
+    def time(self, phase: str, function: Callable[..., Any], *args: Any) -> Any:
+        """Call function with args, record how long it took as phase, and return its result."""
+        start = time.perf_counter()
+        result = function(*args)
+        self.record(phase, time.perf_counter() - start)
+        return result
+
+    def end_frame(self) -> None:
+        """Finish the current frame, keeping its phase totals and the time since the last call
+        to end_frame as the FRAME phase."""
+        now = time.perf_counter()
+        with self._lock:
+            current, self._current = self._current, {}
+        if self._last_frame_end is not None:
+            current[FRAME] = now - self._last_frame_end
+        self._last_frame_end = now
+
+        for phase, seconds in current.items():
+            if phase not in self.frames:
+                self.frames[phase] = deque(maxlen=self._window)
+            self.frames[phase].append(seconds)
+
+    def percentiles(self, phase: str,
+                    percentiles: tuple[float, ...] = PERCENTILES) -> dict[float, float]:
+        """Return the given percentiles, in milliseconds, of phase's time per recent frame.
+
+        Frames in which phase didn't run are not counted.
+
+        >>> profiler = Profiler()
+        >>> for seconds in (0.001, 0.002, 0.003):
+        ...     profiler.record("draw", seconds)
+        ...     profiler.end_frame()
+        >>> profiler.percentiles("draw", (0, 50, 100))
+        {0: 1.0, 50: 2.0, 100: 3.0}
+        """
+        values = np.percentile(np.array(self.frames[phase]) * 1000, percentiles)
+        return {percentile: round(float(value), 6)
+                for percentile, value in zip(percentiles, values)}
+
+    def summary(self) -> dict[str, dict[float, float]]:
+        """Return percentiles(phase) for every phase recorded so far."""
+        return {phase: self.percentiles(phase) for phase in self.frames}
+
+    def clear(self) -> None:
+        """Forget every recorded time."""
+        with self._lock:
+            self.frames = {}
+            self._current = {}
+            self._last_frame_end = None
+
+
+def timed(profiler: Profiler | None, phase: str, function: Callable[..., Any], *args: Any) -> Any:
+    """Call function with args, timing it as phase if profiler is not None, and return its
+    result."""
+    if profiler is None:
+        return function(*args)
+    return profiler.time(phase, function, *args)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["collections", "threading", "time", "typing", "numpy"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -0,0 +1,95 @@
+"""CSC 111 Final Project: Trajectory Replay
+
+Module Description
+==================
+Play back a trajectory file recorded from main.py (by pressing "t") or by headless.py --record,
+drawing each frame with SpringMassGraph.draw, without running any physics.
+
+Example:
+    python replay.py run.smt --fps 60
+
+Controls:
+1. Space pauses and resumes.
+2. The left and right arrow keys step back and forward a frame, or ten frames while holding
+   shift.
+3. Home and end jump to the first and last frame.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import argparse
+import sys
+import pygame
+from trajectory import TrajectoryPlayer
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line arguments in argv."""
+    parser = argparse.ArgumentParser(description="Play back a recorded trajectory file.")
+    parser.add_argument("trajectory", help="trajectory file to play (.smt)")
+    parser.add_argument("--fps", type=int, default=60, help="frames shown per second")
+    parser.add_argument("--start", type=int, default=0, help="frame to start from")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=600)
+    return parser.parse_args(argv)
+
+
+def seek(player: TrajectoryPlayer, frame: int, event: pygame.event.Event) -> int:
+    """Return the frame to show after the key press event, given the frame shown now."""
+    jump = 10 if event.mod & pygame.KMOD_SHIFT else 1
+    if event.key == pygame.K_LEFT:
+        frame -= jump
+    elif event.key == pygame.K_RIGHT:
+        frame += jump
+    elif event.key == pygame.K_HOME:
+        frame = 0
+    elif event.key == pygame.K_END:
+        frame = player.n_frames - 1
+    return min(max(frame, 0), player.n_frames - 1)
+
+
+def main(argv: list[str]) -> None:
+    """Play the trajectory file named in argv in a window until it is closed."""
+    args = parse_args(argv)
+    with TrajectoryPlayer(args.trajectory) as player:
+        if player.n_frames == 0:
+            print(f"{args.trajectory} has no frames")
+            return
+        player.graph.update_width_and_height(args.width, args.height)
+
+        pygame.init()
+        screen = pygame.display.set_mode((args.width, args.height))
+        pygame.display.set_caption(args.trajectory)
+        font = pygame.font.SysFont('Comic Sans MS', 15)
+        clock = pygame.time.Clock()
+
+        frame = min(max(args.start, 0), player.n_frames - 1)
+        paused = False
+        running = True
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.type == pygame.KEYDOWN:
+                    frame = seek(player, frame, event)
+
+            if player.frame != frame:
+                player.show(frame)
+            player.graph.draw(screen)
+            label = f"frame {frame + 1} / {player.n_frames}" + (" (paused)" if paused else "")
+            screen.blit(font.render(label, False, (0, 0, 0)), (10, 10))
+            pygame.display.update()
+
+            if not paused and frame < player.n_frames - 1:
+                frame += 1
+            clock.tick(args.fps)
+        pygame.quit()
+
+
+if __name__ == "__main__":
+    # this is a command line tool, so like headless.py it doesn't run doctest and python_ta
+    # after main
+    main(sys.argv[1:])
@@ -0,0 +1,246 @@
+"""CSC 111 Final Project: Background Simulation
+
+Module Description
+==================
+Running the physics and the drawing one after the other in the same loop means slow physics
+makes the window slow to draw and respond. A SimulationThread runs the physics of a graph on its
+own thread instead, at up to a fixed number of frames per second.
+
+The two sides only meet in two places:
+- after each physics frame the worker copies the vertex positions (and the edges) into the back
+    one of two Frame buffers and swaps it to the front, and the window draws the front Frame
+- changes to the graph, like mouse edits, are submitted as commands to a queue, which the
+    worker runs between physics frames, so the graph is never changed halfway through a step
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from collections import deque
+from dataclasses import dataclass, field
+import dataclasses
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator
+from contextlib import contextmanager
+import numpy as np
+import array_physics
+from all_pairs import AllPairsSprings
+from array_physics import ArrayState
+from graph import Metrics, SpringMassGraph
+from profiler import Profiler
+from trajectory import TrajectoryRecorder
+
+# the default number of physics frames (of SpringMassGraph.SUBSTEPS steps) per second
+FRAME_RATE = 60
+# the simulation rate is measured over this many seconds
+RATE_WINDOW = 1.0
+# while running, threads take turns holding the interpreter at least this often, in seconds.
+# python's default of 5 ms lets a python backend step starve the window thread.
+SWITCH_INTERVAL = 0.001
+
+
+@dataclass
+class Frame:
+    """The state of a graph after a physics frame, as copied for drawing.
+
+    Instance Attributes:
+    - state: the graph's vertices and edges; the velocities are not copied
+    - metrics: a copy of the graph's metrics
+    - number: how many physics frames had been run when this was copied
+    - all_pairs: the graph's all-pairs springs, or None. They are never changed once made, so
+        they are shared rather than copied
+    - profiler: the graph's profiler, or None if it isn't being profiled
+    """
+    state: ArrayState
+    metrics: Metrics = field(default_factory=Metrics)
+    number: int = 0
+    all_pairs: AllPairsSprings | None = None
+    profiler: Profiler | None = None
+
+
+class SimulationThread:
+    """Runs the physics of a graph on a background thread.
+
+    Instance Attributes:
+    - graph: the graph being simulated. Only the worker thread may change it, or read anything
+        but its constants, while the thread is running; use submit instead.
+    - frame_rate: the most physics frames run per second
+    - error: the exception that stopped the worker, if any
+    - recorder: the recorder every physics frame is recorded to, or None if not recording.
+        Only the worker thread may change it; use record instead.
+
+    Representation Invariants:
+    - self.frame_rate > 0
+    """
+    graph: SpringMassGraph
+    frame_rate: float
+    error: BaseException | None
+    recorder: TrajectoryRecorder | None
+    _commands: queue.SimpleQueue
+    _front: Frame
+    _back: Frame
+    _swap_lock: threading.Lock
+    _frame_times: deque[float]
+    _stopping: threading.Event
+    _thread: threading.Thread | None
+    _old_switch_interval: float
+
+    def __init__(self, graph: SpringMassGraph, frame_rate: float = FRAME_RATE) -> None:
+        self.graph = graph
+        self.frame_rate = frame_rate
+        self.error = None
+        self.recorder = None
+        self._commands = queue.SimpleQueue()
+        self._front = Frame(_empty_state())
+        self._back = Frame(_empty_state())
+        self._swap_lock = threading.Lock()
+        self._frame_times = deque()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._old_switch_interval = sys.getswitchinterval()
+        self._publish(0)
+
+    def start(self) -> None:
+        """Start running the physics on a new daemon thread."""
+        self._stopping.clear()
+        self._old_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(SWITCH_INTERVAL, self._old_switch_interval))
+        self._thread = threading.Thread(target=self._run, name="simulation", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the worker thread, after the frame and commands it is running, and wait for it."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            sys.setswitchinterval(self._old_switch_interval)
+        self._set_recorder(self.graph, None)
+
+    def submit(self, command: Callable[..., Any], *args: Any) -> None:
+        """Run command(self.graph, *args) on the worker thread before its next physics frame.
+
+        Commands run in the order they were submitted.
+        """
+        self._commands.put((command, args))
+
+    def record(self, filename: str | None, velocities: bool = False) -> None:
+        """Start recording every physics frame to the trajectory file filename, after closing
+        the file being recorded to, if any. Stop recording if filename is None."""
+        self.submit(self._set_recorder, filename, velocities)
+
+    @contextmanager
+    def frame(self) -> Iterator[Frame]:
+        """Return the most recent Frame, which stays unchanged until the with block using it
+        ends.
+
+        The worker can't swap buffers until then, so the block should only read the frame.
+        """
+        with self._swap_lock:
+            yield self._front
+
+    @property
+    def rate(self) -> float:
+        """The number of physics frames run per second, over the last RATE_WINDOW seconds."""
+        frame_times = list(self._frame_times)
+        if len(frame_times) < 2:
+            return 0.0
+        return (len(frame_times) - 1) / max(frame_times[-1] - frame_times[0], 1e-9)
+
+    def _run(self) -> None:
+        """Run commands and physics frames until stopped, at most frame_rate frames a second."""
+        number = self._front.number
+        next_frame = time.perf_counter()
+        try:
+            while not self._stopping.is_set():
+                self._run_commands()
+                self.graph.run_substeps()
+                if self.recorder is not None:
+                    self.recorder.record(self.graph)
+                number += 1
+                self._publish(number)
+
+                now = time.perf_counter()
+                self._frame_times.append(now)
+                while self._frame_times[0] < now - RATE_WINDOW:
+                    self._frame_times.popleft()
+
+                # wait for the next frame's turn, unless we have fallen behind
+                next_frame = max(next_frame + 1 / self.frame_rate, now)
+                self._stopping.wait(next_frame - now)
+        except Exception as error:  # pylint: disable=broad-except
+            # the window checks error, since an exception can't cross threads by itself
+            self.error = error
+
+    def _run_commands(self) -> None:
+        """Run every submitted command, in order."""
+        while True:
+            try:
+                command, args = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            command(self.graph, *args)
+
+    def _set_recorder(self, _graph: SpringMassGraph, filename: str | None,
+                      velocities: bool = False) -> None:
+        """Close the current recorder, if any, and start recording to filename unless it is
+        None."""
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+        if filename is not None:
+            self.recorder = TrajectoryRecorder(filename, velocities)
+
+    def _publish(self, number: int) -> None:
+        """Copy the graph into the back buffer and swap it to the front."""
+        back = self._back
+        graph = self.graph
+        if graph.store is not None:
+            _copy_state(graph.store, back.state)
+        else:
+            back.state = array_physics.gather(graph.vertices, graph.edges)
+        back.metrics = dataclasses.replace(graph.metrics)
+        back.number = number
+        back.all_pairs = graph.all_pairs
+        back.profiler = graph.profiler
+
+        with self._swap_lock:
+            self._front, self._back = back, self._front
+
+
+def _empty_state() -> ArrayState:
+    """Return an ArrayState with no vertices or edges."""
+    empty = np.zeros(0)
+    return ArrayState(empty, empty, empty, empty, empty, np.zeros(0, dtype=np.bool_),
+                      np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), empty)
+
+
+def _copy_state(source: ArrayState, target: ArrayState) -> None:
+    """Copy the positions, masses, pins and edges of source into target, reusing target's
+    arrays when they are the right size."""
+    for name in ("x", "y", "mass", "pinned", "start", "end", "rest"):
+        array = getattr(source, name)
+        buffer = getattr(target, name)
+        if buffer.shape == array.shape and buffer.dtype == array.dtype:
+            np.copyto(buffer, array)
+        else:
+            setattr(target, name, np.array(array))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["collections", "dataclasses", "queue", "sys", "threading", "time",
+                              "typing", "contextlib", "numpy", "all_pairs", "array_physics",
+                              "graph", "profiler", "trajectory"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -0,0 +1,244 @@
+"""CSC 111 Final Project: Sleeping Islands
+
+Module Description
+==================
+Most of a large graph is usually at rest, yet every substep updates every edge and vertex.
+A SleepTracker lets run_substeps skip the parts of a graph that have settled.
+
+The free vertices of a graph are split into islands, the groups of free vertices joined by
+edges between free vertices. Pinned vertices never move by themselves, so they don't join the
+islands around them. A vertex is still in a frame if its speed and its acceleration (see
+substepping.motion) are both below a threshold, and once every vertex of an island has been
+still for SLEEP_FRAMES frames in a row, the island falls asleep: its velocities are set to 0
+and its vertices and edges are skipped until it is woken up.
+
+Since a sleeping island has no edges to a moving free vertex, nothing but changes from outside
+the physics can move it. An island wakes up when one of its vertices, or a pinned vertex next to
+it, is passed to wake (which the window does for dragged vertices), or gets a new edge.
+Removing vertices or edges, or changing the graph's constants, wakes every island.
+
+The elastic potential energy of the sleeping edges doesn't change while they sleep, so it is
+computed once when they fall asleep and added to that of the awake edges.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import numpy as np
+from array_physics import ArrayState
+from substepping import Motion
+
+# the number of frames in a row every vertex of an island must be still for it to fall asleep
+SLEEP_FRAMES = 30
+# a vertex is still when its speed, in pixels per step, is below SLEEP_SPEED
+SLEEP_SPEED = 0.001
+# and its acceleration, in pixels per step per step, is below SLEEP_ACCELERATION
+SLEEP_ACCELERATION = 0.0001
+
+
+def islands(pinned: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Return the island of each vertex, named by the lowest index of a vertex in it.
+
+    Free vertices joined by an edge are in the same island, and every pinned vertex is in an
+    island of its own.
+
+    >>> islands(np.array([False, False, True, False, False]), np.array([0, 1, 3]),
+    ...         np.array([1, 2, 2]))
+    array([0, 0, 2, 3, 4])
+    """
+    labels = np.arange(len(pinned))
+    both_free = ~(pinned[start] | pinned[end])
+    start, end = start[both_free], end[both_free]
+    while True:
+        # join each edge's endpoints, and the islands they were in, to the lower label,
+        # then let every vertex skip ahead to its label's label
+        lowest = np.minimum(labels[start], labels[end])
+        joined = labels.copy()
+        for index in (start, end, labels[start], labels[end]):
+            np.minimum.at(joined, index, lowest)
+        joined = joined[joined]
+        if np.array_equal(joined, labels):
+            return labels
+        labels = joined
+
+
+def is_still(motion: Motion) -> np.ndarray:
+    """Return whether each vertex of a graph with the given motion is still."""
+    return (motion.speed < SLEEP_SPEED) & (motion.acceleration < SLEEP_ACCELERATION)
+
+
+class SleepTracker:
+    """Which islands of a graph are asleep.
+
+    Vertices and edges are named by their index in the graph, and may only be appended to the
+    graph while it is tracked.
+
+    Instance Attributes:
+    - constants: the (spring_constant, friction, gravity, size) of the graph being tracked
+    - still_frames: for each vertex, how many frames in a row it has been still
+    - island: the island of each vertex (see islands)
+    - asleep: whether each vertex is in a sleeping island. Pinned vertices never are.
+    - awake_vertices: the indices of the vertices to simulate: the free vertices of awake
+        islands, and the pinned vertices with an edge to one
+    - awake_edges: the indices of the edges to simulate: those with an endpoint in an awake
+        island, and those between two pinned vertices
+    - sleeping_energy: the elastic potential energy of the other edges
+    - stale: whether the islands or awake vertices and edges must be found again, by refresh
+
+    Representation Invariants:
+    - len(self.still_frames) == len(self.island) == len(self.asleep)
+    """
+    constants: tuple
+    still_frames: np.ndarray
+    island: np.ndarray
+    asleep: np.ndarray
+    awake_vertices: np.ndarray
+    awake_edges: np.ndarray
+    sleeping_energy: float
+    stale: bool
+    _pinned: np.ndarray
+    _start: np.ndarray
+    _end: np.ndarray
+    _n_edges: int
+    _islands_stale: bool
+
+    def __init__(self, constants: tuple) -> None:
+        self.constants = constants
+        self.still_frames = np.zeros(0, dtype=np.int64)
+        self.island = np.zeros(0, dtype=np.intp)
+        self.asleep = np.zeros(0, dtype=np.bool_)
+        self.awake_vertices = np.zeros(0, dtype=np.intp)
+        self.awake_edges = np.zeros(0, dtype=np.intp)
+        self.sleeping_energy = 0.0
+        self.stale = True
+        self._pinned = np.zeros(0, dtype=np.bool_)
+        self._start = self._end = np.zeros(0, dtype=np.intp)
+        self._n_edges = 0
+        self._islands_stale = True
+
+    @property
+    def all_awake(self) -> bool:
+        """Whether no island is asleep."""
+        return not np.any(self.asleep)
+
+    def can_track(self, n_vertices: int, n_edges: int) -> bool:
+        """Return whether the graph, which now has n_vertices vertices and n_edges edges, has
+        only had vertices and edges appended since the last refresh."""
+        return n_vertices >= len(self.island) and n_edges >= self._n_edges
+
+    def needs_refresh(self, n_vertices: int, n_edges: int) -> bool:
+        """Return whether refresh must be called before simulating the graph, which now has
+        n_vertices vertices and n_edges edges."""
+        return self.stale or n_vertices != len(self.island) or n_edges != self._n_edges
+
+    def wake(self, vertices: np.ndarray) -> None:
+        """Wake the islands of the given vertices, and those next to the pinned ones.
+
+        The vertices may have been pinned or unpinned, so the islands are found again.
+        """
+        # vertices appended since the last refresh are awake already
+        vertices = vertices[vertices < len(self.island)]
+        start, end = self._start, self._end
+        self.still_frames[vertices] = 0
+        self.still_frames[end[np.isin(start, vertices)]] = 0
+        self.still_frames[start[np.isin(end, vertices)]] = 0
+        self.stale = True
+        self._islands_stale = True
+
+    def refresh(self, state: ArrayState, spring_constant: float) -> None:
+        """Find the islands and awake vertices and edges of the graph, whose vertices and edges
+        are those of state, again.
+
+        Vertices and edges appended since the last refresh wake the islands they join.
+        """
+        pinned, start, end = state.pinned, state.start, state.end
+        n, old_n = len(pinned), len(self.island)
+        if n != old_n or len(start) != self._n_edges:
+            self.still_frames = np.concatenate(
+                [self.still_frames, np.zeros(n - old_n, dtype=np.int64)]
+            )
+            new_edges = slice(self._n_edges, len(start))
+            self.still_frames[start[new_edges]] = 0
+            self.still_frames[end[new_edges]] = 0
+            self._n_edges = len(start)
+            self._islands_stale = True
+        if self._islands_stale:
+            self.island = islands(pinned, start, end)
+            self._islands_stale = False
+
+        self._pinned = pinned.copy()
+        self._start, self._end = start.copy(), end.copy()
+        self.asleep = self._sleeping_islands()
+
+        awake = ~pinned & ~self.asleep
+        edge_awake = awake[start] | awake[end] | (pinned[start] & pinned[end])
+        self.awake_edges = np.flatnonzero(edge_awake)
+        vertex_awake = awake.copy()
+        vertex_awake[start[edge_awake]] = True
+        vertex_awake[end[edge_awake]] = True
+        self.awake_vertices = np.flatnonzero(vertex_awake)
+
+        sleeping = ~edge_awake
+        dx = state.x[start[sleeping]] - state.x[end[sleeping]]
+        dy = state.y[start[sleeping]] - state.y[end[sleeping]]
+        distance = np.sqrt(dx * dx + dy * dy)
+        distance[distance == 0] = 0.0001
+        stretch = distance - state.rest[sleeping]
+        self.sleeping_energy = float(np.sum(spring_constant * (stretch * stretch)))
+        self.stale = False
+
+    def record(self, still: np.ndarray) -> np.ndarray:
+        """Record which of the awake vertices were still in the last frame, given in the order
+        of self.awake_vertices, or for every vertex of the graph when all of it was stepped.
+        Return the indices of the vertices whose islands fell asleep, whose velocities should
+        be set to 0.
+
+        A pinned vertex without edges is in no awake island, so it isn't one of the awake
+        vertices even when every island is awake:
+
+        >>> state = ArrayState(np.array([0.0, 10.0, 50.0]), np.zeros(3), np.zeros(3),
+        ...                    np.zeros(3), np.ones(3), np.array([False, False, True]),
+        ...                    np.array([0]), np.array([1]), np.array([10.0]))
+        >>> tracker = SleepTracker((0.03, 0.98, 0.01, (800, 600)))
+        >>> tracker.refresh(state, 0.03)
+        >>> tracker.awake_vertices, tracker.all_awake
+        (array([0, 1]), True)
+        >>> for _ in range(SLEEP_FRAMES):
+        ...     falling_asleep = tracker.record(np.ones(3, dtype=np.bool_))
+        >>> falling_asleep
+        array([0, 1])
+        """
+        awake_vertices = self.awake_vertices
+        if len(still) == len(self.island):
+            still = still[awake_vertices]
+        still_frames = np.where(still, self.still_frames[awake_vertices] + 1, 0)
+        self.still_frames[awake_vertices] = still_frames
+
+        # an island can only fall asleep in the frame one of its vertices reaches SLEEP_FRAMES
+        if not np.any(still_frames == SLEEP_FRAMES):
+            return np.zeros(0, dtype=np.intp)
+        falling_asleep = self._sleeping_islands() & ~self.asleep
+        self.stale = self.stale or bool(np.any(falling_asleep))
+        return np.flatnonzero(falling_asleep)
+
+    def _sleeping_islands(self) -> np.ndarray:
+        """Return whether each vertex is free and in an island whose vertices have all been
+        still for at least SLEEP_FRAMES frames."""
+        # the vertex of an island that has been still the least decides
+        island_still_frames = np.full(len(self.island), np.iinfo(np.int64).max)
+        np.minimum.at(island_still_frames, self.island, self.still_frames)
+        return (island_still_frames[self.island] >= SLEEP_FRAMES) & ~self._pinned
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["numpy", "array_physics", "substepping"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
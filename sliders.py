@@ -68,26 +68,34 @@ def load_slider_textboxes() -> SliderTextboxTuple:
     return (gravity_text, friction_text, spring_text)
 
 
-def update_sliders(graph: SpringMassGraph, sliders: Slider,
-                   outputs: Outputs, ev: pygame.event.Event) -> None:
-    """Update sliders and change graph attributes."""
+def update_sliders(sliders: Slider, outputs: Outputs,
+                   ev: pygame.event.Event) -> tuple[float, float, float]:
+    """Update sliders and return the gravity, friction and spring constant they are set to.
+
+    The graph isn't changed here, since it may be running on another thread: pass the values to
+    set_constants, as a command of the SimulationThread running it.
+    """
     # get sliders and outputs
     gravity_slider, friction_slider, spring_slider = sliders
     gravity_output, friction_output, spring_output = outputs
 
-    # update slider and graph attributes
     gravity = gravity_slider.getValue()
     friction = friction_slider.getValue()
     spring = spring_slider.getValue()
 
-    graph.gravity = gravity
-    graph.friction = friction
-    graph.spring_constant = spring
-
     gravity_output.setText(gravity_slider.getValue())
     friction_output.setText(friction_slider.getValue())
     spring_output.setText(spring_slider.getValue())
     pygame_widgets.update(ev)
+    return gravity, friction, spring
+
+
+def set_constants(graph: SpringMassGraph, gravity: float, friction: float,
+                  spring_constant: float) -> None:
+    """Set the constants of graph to those returned by update_sliders."""
+    graph.gravity = gravity
+    graph.friction = friction
+    graph.spring_constant = spring_constant
 
 
 def draw_slider_text(screen: pygame.Surface, gravity_text: TextBox,
@@ -0,0 +1,91 @@
+"""CSC 111 Final Project: Spatial Index
+
+Module Description
+==================
+Clicking, dragging and drawing the hover circle all need "which vertices are within r of this
+point". Scanning every vertex for each of these is O(V) per question, so this module keeps a
+uniform grid of cells instead: vertices are sorted by the cell they fall in, and a radius query
+only looks at the cells overlapping the query circle.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import math
+import numpy as np
+
+# cell coordinates are packed into one integer key as cell_x * CELL_KEY_SCALE + cell_y
+CELL_KEY_SCALE = 1 << 32
+
+
+class SpatialHash:
+    """A uniform grid over a set of points, built once and queried many times.
+
+    Instance Attributes:
+    - cell_size: the side length of each grid cell
+    - x, y: the positions of the points, as they were when the grid was built
+
+    Representation Invariants:
+    - self.cell_size > 0
+    - self._keys is sorted and self._keys[i] is the cell key of point self._order[i]
+    """
+    cell_size: float
+    x: np.ndarray
+    y: np.ndarray
+    _order: np.ndarray
+    _keys: np.ndarray
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell_size: float) -> None:
+        """Build the grid for the points (x[i], y[i]). This takes O(n log n) numpy time."""
+        self.cell_size = cell_size
+        self.x = np.array(x, dtype=np.float64)
+        self.y = np.array(y, dtype=np.float64)
+
+        keys = self._cell_keys(np.floor(self.x / cell_size), np.floor(self.y / cell_size))
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def query(self, px: float, py: float, radius: float) -> np.ndarray:
+        """Return the sorted indices of the points strictly within radius of (px, py).
+
+        Only the cells overlapping the circle are visited, so the cost depends on the number of
+        nearby points rather than the total number of points.
+        """
+        size = self.cell_size
+        cells_x = np.arange(math.floor((px - radius) / size), math.floor((px + radius) / size) + 1)
+        cells_y = np.arange(math.floor((py - radius) / size), math.floor((py + radius) / size) + 1)
+        keys = self._cell_keys(*np.meshgrid(cells_x, cells_y)).ravel()
+
+        lows = np.searchsorted(self._keys, keys, side="left")
+        highs = np.searchsorted(self._keys, keys, side="right")
+        candidates = [self._order[low:high] for low, high in zip(lows, highs) if low < high]
+        if not candidates:
+            return np.empty(0, dtype=np.intp)
+
+        candidates = np.concatenate(candidates)
+        distance = (self.x[candidates] - px) ** 2 + (self.y[candidates] - py) ** 2
+        return np.sort(candidates[distance < radius ** 2])
+
+    @staticmethod
+    def _cell_keys(cells_x: np.ndarray, cells_y: np.ndarray) -> np.ndarray:
+        """Pack cell coordinates into single integer keys."""
+        cells_x = np.asarray(cells_x, dtype=np.int64)
+        cells_y = np.asarray(cells_y, dtype=np.int64)
+        return cells_x * CELL_KEY_SCALE + (cells_y + CELL_KEY_SCALE // 2)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["math", "numpy"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
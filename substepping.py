@@ -0,0 +1,175 @@
+"""CSC 111 Final Project: Adaptive Substepping
+
+Module Description
+==================
+Every frame advances a graph by the same amount of simulated time, SpringMassGraph.SUBSTEPS
+steps of the original length. Running all of those steps is wasted work on a graph at rest, and
+not enough for a stiff cloth being dragged around, so run_substeps instead splits the frame into
+however many substeps choose_substeps picks from the graph's current motion. Each substep then
+has length dt = SUBSTEPS / substeps, and 16 substeps of length 1 are exactly the old steps.
+
+The number of substeps is the smallest one for which both:
+- the estimated position error of one substep, dt ** 2 / 2 * (a + omega * v), is at most the
+    error target for every free vertex. Here a is the vertex's acceleration (the pull of its
+    springs plus gravity, which is 0 at rest) and v its speed, scaled by how fast the springs
+    pull back (omega) since moving vertices change the pull during the substep.
+- omega * dt is at most STABILITY, since larger substeps make the springs overshoot and blow up.
+    omega, the fastest the springs can vibrate, is bounded using each vertex's total spring
+    stiffness over its mass.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+from dataclasses import dataclass
+import math
+from typing import TYPE_CHECKING
+import numpy as np
+from array_physics import ArrayState, MAX_FORCE
+
+if TYPE_CHECKING:
+    from all_pairs import AllPairsSprings
+
+# the default fewest and most substeps per frame
+MIN_SUBSTEPS = 1
+MAX_SUBSTEPS = 64
+# the default largest estimated position error of one substep, in pixels
+ERROR_TARGET = 0.05
+# the largest omega * dt allowed. Steps are unstable past 2, so this leaves a margin.
+STABILITY = 1.5
+
+
+@dataclass
+class Substepping:
+    """How many substeps SpringMassGraph.run_substeps may split a frame into.
+
+    Setting min_substeps and max_substeps both to SpringMassGraph.SUBSTEPS turns adaptive
+    substepping off and runs the original steps.
+
+    Instance Attributes:
+    - min_substeps: the fewest substeps per frame
+    - max_substeps: the most substeps per frame, even if the error target needs more
+    - error_target: the largest estimated position error of one substep, in pixels
+
+    Representation Invariants:
+    - 1 <= self.min_substeps <= self.max_substeps
+    - self.error_target > 0
+    """
+    min_substeps: int = MIN_SUBSTEPS
+    max_substeps: int = MAX_SUBSTEPS
+    error_target: float = ERROR_TARGET
+
+
+@dataclass
+class Motion:
+    """How fast the vertices of a graph are moving and being pulled, as found by motion.
+
+    Instance Attributes:
+    - acceleration: the size of each vertex's acceleration, measured from rest, or 0 if pinned
+    - speed: each vertex's speed, or 0 if pinned
+    - omega: an upper bound on how fast the springs of the free vertices can vibrate
+    """
+    acceleration: np.ndarray
+    speed: np.ndarray
+    omega: float
+
+
+def motion(state: ArrayState, constants: tuple, size: tuple[int, int],
+           all_pairs: "AllPairsSprings | None" = None) -> Motion:
+    """Return the Motion of state, with the springs of all_pairs as well as its edges if given.
+
+    constants is (spring_constant, friction, gravity), as for array_physics.step.
+    """
+    spring_constant, friction, gravity = constants
+    free = ~state.pinned
+    width, height = size
+    x, y = state.x, state.y
+    start, end = state.start, state.end
+    n = x.shape[-1]
+
+    # the net pull of the springs, as array_physics._update_edges applies it
+    dx = x[start] - x[end]
+    dy = y[start] - y[end]
+    distance = np.sqrt(dx * dx + dy * dy)
+    distance[distance == 0] = 0.0001
+    pull = np.clip(spring_constant * (distance - state.rest), -MAX_FORCE, MAX_FORCE) / distance
+    start_pinned, end_pinned = state.pinned[start], state.pinned[end]
+    active = ~(start_pinned & end_pinned)
+    start_multiplier = np.where(end_pinned, 1.0, 0.5) * active
+    end_multiplier = np.where(start_pinned, 1.0, 0.5) * active
+    fx = (np.bincount(end, end_multiplier * pull * dx, n)
+          - np.bincount(start, start_multiplier * pull * dx, n))
+    fy = (np.bincount(end, end_multiplier * pull * dy, n)
+          - np.bincount(start, start_multiplier * pull * dy, n))
+    # the squared frequency of any vibration is at most the largest, over the free vertices, of
+    # the stiffness of its springs plus that of its springs to other free vertices
+    # (the Gershgorin bound of the springs' stiffness matrix)
+    stiffness = (np.bincount(start, start_multiplier * (1 + ~end_pinned), n)
+                 + np.bincount(end, end_multiplier * (1 + ~start_pinned), n))
+    if all_pairs is not None:
+        pairs_fx, pairs_fy, pairs_stiffness = all_pairs.pull(state, spring_constant)
+        # np.bincount gives integers when there are no edges
+        fx, fy, stiffness = (array.astype(np.float64) for array in (fx, fy, stiffness))
+        fx[:all_pairs.n] += pairs_fx
+        fy[:all_pairs.n] += pairs_fy
+        stiffness[:all_pairs.n] += pairs_stiffness
+
+    # a free vertex is at rest when its springs pull up by mass * gravity / friction
+    # (see equilibrium.py), so measure its acceleration from there
+    ax = fx / state.mass
+    ay = fy / state.mass + gravity / friction
+    # the walls and the floor stop vertices being pushed into them
+    ax = np.where(((x <= 0) & (ax < 0)) | ((x >= width) & (ax > 0)), 0.0, ax)
+    on_floor = y >= height
+    ay = np.where(on_floor & (ay > 0), 0.0, ay)
+    acceleration = np.hypot(ax, ay) * free
+
+    # vertices on the floor keep a downward velocity that the floor cancels every step,
+    # so like the kinetic energy, only count their horizontal velocity
+    vy = np.where(on_floor, 0.0, state.vy)
+    speed = np.hypot(state.vx, vy) * free
+
+    omega = math.sqrt(spring_constant * float(np.max(stiffness / state.mass * free, initial=0)))
+    return Motion(acceleration, speed, omega)
+
+
+def choose_substeps(graph_motion: Motion, frame_time: float, settings: Substepping) -> int:
+    """Return how many substeps to split the next frame_time of simulated time of a graph
+    with the given motion into.
+
+    >>> state = ArrayState(np.array([0.0, 0.0]), np.array([0.0, 20.0]), np.zeros(2),
+    ...                    np.zeros(2), np.array([5.0, 5.0]), np.array([True, False]),
+    ...                    np.array([0]), np.array([1]), np.array([20.0]))
+    >>> constants = (0.03, 0.98, 0.0)
+    >>> choose_substeps(motion(state, constants, (800, 600)), 16, Substepping())
+    1
+    >>> state.vy[1] = 5.0
+    >>> choose_substeps(motion(state, constants, (800, 600)), 16, Substepping())
+    32
+    >>> choose_substeps(motion(state, constants, (800, 600)), 16, Substepping(1, 16))
+    16
+    """
+    omega = graph_motion.omega
+    rate = float(np.max(graph_motion.acceleration + omega * graph_motion.speed, initial=0))
+    dt = frame_time
+    if rate > 0:
+        dt = min(dt, math.sqrt(2 * settings.error_target / rate))
+    if omega > 0:
+        dt = min(dt, STABILITY / omega)
+    substeps = math.ceil(frame_time / dt - 1e-9)
+    return max(settings.min_substeps, min(substeps, settings.max_substeps))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["dataclasses", "math", "typing", "numpy", "all_pairs",
+                              "array_physics"],
+            "allowed-io": [],
+            "max-line-length": 100,
+        }
+    )
@@ -0,0 +1,423 @@
+"""CSC 111 Final Project: Trajectory Recording and Replay
+
+Module Description
+==================
+A TrajectoryRecorder streams the vertex positions (and optionally velocities) of a graph after
+every frame into a trajectory file, and a TrajectoryPlayer seeks to any frame of one and puts
+its vertices there, ready to draw, without running any physics.
+
+A trajectory file (TRAJECTORY_EXTENSION) is a FILE_HEADER followed by records, each a
+RECORD_HEADER and its payload:
+- a graph record (GRAPH_RECORD) holds the graph, compressed, in the binary format of graph_io.
+    One is written before the first frame, and again whenever the vertices, edges, rest lengths
+    or pins change, and applies to the frames after it. Changes are spotted by comparing a hash
+    of the edges, rest lengths and pins from frame to frame
+- a chunk record (CHUNK_RECORD) holds up to CHUNK_FRAMES consecutive frames, each the x and y
+    (and vx and vy) of every vertex in single precision, which is plenty for drawing. The bytes
+    of the floats are shuffled (every first byte, then every second byte, and so on) before
+    compressing, which compresses much better than the floats themselves
+- an index record (INDEX_RECORD), written when the recorder is closed, lists where every chunk
+    and graph record starts, and is found through the FOOTER at the very end of the file
+
+A file whose recorder never closed, say because the program crashed, has no index, and is read
+by walking its records from the start instead.
+
+Compressing and writing happen on a thread of their own, so recording a frame only costs the
+physics thread a copy of the positions.
+
+Copyright Information
+=====================
+This file is licensed under the MIT License
+"""
+import hashlib
+import io
+import os
+import queue
+import struct
+import threading
+from typing import Any, BinaryIO
+import zlib
+import numpy as np
+import array_physics
+import graph_io
+from graph import SpringMassGraph
+
+TRAJECTORY_EXTENSION = ".smt"
+# magic bytes, format version and whether velocities are recorded
+FILE_HEADER = struct.Struct("<8sII")
+FILE_MAGIC = b"SPRTRAJ\0"
+FILE_VERSION = 1
+# record kind, number of frames, first frame and payload size in bytes
+RECORD_HEADER = struct.Struct("<4sIqq")
+GRAPH_RECORD = b"GRPH"
+CHUNK_RECORD = b"CHNK"
+INDEX_RECORD = b"INDX"
+# the offset of the index record, and magic bytes
+FOOTER = struct.Struct("<q8s")
+FOOTER_MAGIC = b"SPRTEND\0"
+
+# the number of frames in each chunk, and how hard chunks are compressed (1 is fastest)
+CHUNK_FRAMES = 64
+COMPRESSION_LEVEL = 1
+# the most chunks waiting to be compressed before recording blocks
+MAX_PENDING_CHUNKS = 8
+
+
+class TrajectoryRecorder:
+    """Records the frames of a graph to a trajectory file.
+
+    Instance Attributes:
+    - filename: the trajectory file being written
+    - velocities: whether velocities are recorded as well as positions
+    - n_frames: the number of frames recorded so far
+    - chunk_frames: the number of frames in each chunk
+
+    Representation Invariants:
+    - self.chunk_frames >= 1
+
+    Changing the edges of the graph records it again, even if their number stays the same:
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> filename = os.path.join(directory.name, "run" + TRAJECTORY_EXTENSION)
+    >>> graph = SpringMassGraph(backend="numpy")
+    >>> graph.extend(np.array([0.0, 10.0, 20.0]), np.zeros(3), np.array([0]), np.array([1]))
+    >>> with TrajectoryRecorder(filename) as recorder:
+    ...     recorder.record(graph)
+    ...     graph.remove_edge(graph.edges[0])
+    ...     graph.extend(np.zeros(0), np.zeros(0), np.array([2]), np.array([0]))
+    ...     recorder.record(graph)
+    >>> with TrajectoryPlayer(filename) as player:
+    ...     player.show(1)
+    ...     print(player.graph.store.start, player.graph.store.end)
+    [2] [0]
+    >>> directory.cleanup()
+    """
+    filename: str
+    velocities: bool
+    n_frames: int
+    chunk_frames: int
+    _file: BinaryIO | None
+    _topology: bytes | None
+    _chunk: np.ndarray | None
+    _chunk_start: int
+    _queue: queue.Queue
+    _writer: threading.Thread
+    _error: BaseException | None
+    _index: list[tuple[bytes, int, int, int]]
+
+    def __init__(self, filename: str, velocities: bool = False,
+                 chunk_frames: int = CHUNK_FRAMES) -> None:
+        self.filename = filename
+        self.velocities = velocities
+        self.n_frames = 0
+        self.chunk_frames = chunk_frames
+        self._file = open(filename, "wb")
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, int(velocities)))
+        self._topology = None
+        self._chunk = None
+        self._chunk_start = 0
+        self._queue = queue.Queue(MAX_PENDING_CHUNKS)
+        self._error = None
+        self._index = []
+        self._writer = threading.Thread(target=self._write_records, name="trajectory",
+                                        daemon=True)
+        self._writer.start()
+
+    def __enter__(self) -> "TrajectoryRecorder":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def record(self, graph: SpringMassGraph) -> None:
+        """Record the current state of graph as the next frame.
+
+        Raise ValueError if self is closed, and the error that stopped the writer thread if
+        writing failed.
+        """
+        if self._file is None:
+            raise ValueError("the recorder is closed")
+        if self._error is not None:
+            raise self._error
+
+        topology = _topology_hash(graph)
+        if topology != self._topology:
+            self._flush()
+            self._topology = topology
+            buffer = io.BytesIO()
+            graph_io.write_binary(graph, buffer)
+            self._queue.put((GRAPH_RECORD, self.n_frames, 0, buffer.getvalue()))
+
+        if self._chunk is None:
+            fields = 4 if self.velocities else 2
+            self._chunk = np.empty((self.chunk_frames, fields, len(graph.vertices)),
+                                   dtype=np.float32)
+            self._chunk_start = self.n_frames
+        frame = self._chunk[self.n_frames - self._chunk_start]
+        if graph.store is not None:
+            store = graph.store
+            columns = (store.x, store.y, store.vx, store.vy)
+            for row, column in zip(frame, columns):
+                row[:] = column
+        else:
+            frame[:] = graph.snapshot().vertex_state[:, :len(frame)].T
+        self.n_frames += 1
+        if self.n_frames - self._chunk_start == self.chunk_frames:
+            self._flush()
+
+    def close(self) -> None:
+        """Write the frames still buffered and the index, and close the file.
+
+        Does nothing if self is already closed. Raise the error that stopped the writer
+        thread, if any.
+        """
+        if self._file is None:
+            return
+        self._flush()
+        self._queue.put(None)
+        self._writer.join()
+        file, self._file = self._file, None
+        try:
+            if self._error is None:
+                index_offset = file.tell()
+                index = np.array([(offset, first, frames, kind == GRAPH_RECORD)
+                                  for kind, first, frames, offset in self._index],
+                                 dtype=np.int64).reshape(-1, 4)
+                payload = index.astype("<i8").tobytes()
+                file.write(RECORD_HEADER.pack(INDEX_RECORD, len(index), 0, len(payload)))
+                file.write(payload)
+                file.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
+        finally:
+            file.close()
+        if self._error is not None:
+            raise self._error
+
+    def _flush(self) -> None:
+        """Hand the frames of the current chunk to the writer thread."""
+        if self._chunk is None:
+            return
+        frames = self.n_frames - self._chunk_start
+        if frames > 0:
+            self._queue.put((CHUNK_RECORD, self._chunk_start, frames, self._chunk[:frames]))
+        self._chunk = None
+
+    def _write_records(self) -> None:
+        """Compress and write the records put in the queue, in order, until sent None."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # keep emptying the queue so that record and close never block
+            kind, first, frames, data = item
+            try:
+                payload = zlib.compress(data if kind == GRAPH_RECORD else _shuffle(data),
+                                        COMPRESSION_LEVEL)
+                offset = self._file.tell()
+                self._file.write(RECORD_HEADER.pack(kind, frames, first, len(payload)))
+                self._file.write(payload)
+                self._index.append((kind, first, frames, offset))
+            except Exception as error:  # pylint: disable=broad-except
+                # the recording thread raises it, since an exception can't cross threads
+                self._error = error
+
+
+class TrajectoryPlayer:
+    """Shows the frames of a trajectory file on a graph.
+
+    Instance Attributes:
+    - filename: the trajectory file being played
+    - velocities: whether the file has velocities as well as positions
+    - graph: a graph with the numpy backend holding the vertices and edges of the frame last
+        shown, ready to draw
+    - frame: the frame last shown, or -1 if none has been
+
+    Representation Invariants:
+    - -1 <= self.frame < self.n_frames
+    """
+    filename: str
+    velocities: bool
+    graph: SpringMassGraph
+    frame: int
+    _file: BinaryIO
+    _chunks: list[tuple[int, int, int]]
+    _graphs: list[tuple[int, int]]
+    _graph_offset: int
+    _cached: tuple[int, np.ndarray] | None
+
+    def __init__(self, filename: str) -> None:
+        """Open the trajectory file filename. Raise ValueError if it isn't one."""
+        self.filename = filename
+        self._file = open(filename, "rb")
+        header = self._file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != FILE_MAGIC \
+                or FILE_HEADER.unpack(header)[1] != FILE_VERSION:
+            self._file.close()
+            raise ValueError(f"{filename} is not a version {FILE_VERSION} trajectory file")
+        self.velocities = bool(FILE_HEADER.unpack(header)[2])
+        self.graph = SpringMassGraph(backend="numpy")
+        self.frame = -1
+        self._graph_offset = -1
+        self._cached = None
+
+        records = self._read_index()
+        if records is None:
+            records = self._scan_records()
+        # (first frame, frames, offset) of every chunk, and (first frame, offset) of every graph
+        self._chunks = [(first, frames, offset) for offset, first, frames, is_graph in records
+                        if not is_graph]
+        self._graphs = [(first, offset) for offset, first, _, is_graph in records if is_graph]
+
+    def __enter__(self) -> "TrajectoryPlayer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    @property
+    def n_frames(self) -> int:
+        """The number of frames in the file."""
+        if not self._chunks:
+            return 0
+        first, frames, _ = self._chunks[-1]
+        return first + frames
+
+    def frame_arrays(self, frame: int) -> np.ndarray:
+        """Return the x and y (and vx and vy) of every vertex in the given frame, one row each.
+
+        Raise IndexError if there is no such frame.
+        """
+        if not 0 <= frame < self.n_frames:
+            raise IndexError(f"frame {frame} is not in 0 to {self.n_frames - 1}")
+        chunk = _last_at_or_before([first for first, _, _ in self._chunks], frame)
+        first, frames, offset = self._chunks[chunk]
+        if self._cached is None or self._cached[0] != chunk:
+            payload = self._read_payload(offset)
+            fields = 4 if self.velocities else 2
+            data = _unshuffle(payload, np.float32, frames * fields)
+            self._cached = (chunk, data.reshape(frames, fields, -1))
+        return self._cached[1][frame - first]
+
+    def show(self, frame: int) -> None:
+        """Put the vertices of self.graph where they were in the given frame, loading the graph
+        the frame was recorded from first if it isn't loaded yet.
+
+        Raise IndexError if there is no such frame.
+        """
+        arrays = self.frame_arrays(frame)
+        graph_offset = self._graphs[_last_at_or_before([first for first, _ in self._graphs],
+                                                       frame)][1]
+        if graph_offset != self._graph_offset:
+            graph_io.read_binary(self.graph, self._read_payload(graph_offset))
+            self._graph_offset = graph_offset
+        store = self.graph.store
+        columns = (store.x, store.y, store.vx, store.vy)
+        for column, row in zip(columns, arrays):
+            column[:] = row
+        self.graph.vertices_moved()
+        self.frame = frame
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+
+    def _read_payload(self, offset: int) -> bytes:
+        """Return the decompressed payload of the record at offset."""
+        self._file.seek(offset)
+        _, _, _, size = RECORD_HEADER.unpack(self._file.read(RECORD_HEADER.size))
+        return zlib.decompress(self._file.read(size))
+
+    def _read_index(self) -> list[tuple] | None:
+        """Return the (offset, first frame, frames, is graph) of every record listed in the
+        file's index, or None if the file has no index."""
+        file = self._file
+        size = file.seek(0, os.SEEK_END)
+        if size < FILE_HEADER.size + FOOTER.size:
+            return None
+        file.seek(size - FOOTER.size)
+        index_offset, magic = FOOTER.unpack(file.read(FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            return None
+        file.seek(index_offset)
+        kind, count, _, payload_size = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+        if kind != INDEX_RECORD:
+            return None
+        index = np.frombuffer(file.read(payload_size), "<i8").reshape(count, 4)
+        return [(offset, first, frames, bool(is_graph))
+                for offset, first, frames, is_graph in index.tolist()]
+
+    def _scan_records(self) -> list[tuple]:
+        """Return the (offset, first frame, frames, is graph) of every complete chunk and graph
+        record, found by walking the file's records from the start."""
+        file = self._file
+        size = file.seek(0, os.SEEK_END)
+        records = []
+        offset = FILE_HEADER.size
+        while offset + RECORD_HEADER.size <= size:
+            file.seek(offset)
+            kind, frames, first, payload_size = RECORD_HEADER.unpack(
+                file.read(RECORD_HEADER.size))
+            end = offset + RECORD_HEADER.size + payload_size
+            if kind not in (GRAPH_RECORD, CHUNK_RECORD) or end > size:
+                break
+            records.append((offset, first, frames, kind == GRAPH_RECORD))
+            offset = end
+        return records
+
+
+def _topology_hash(graph: SpringMassGraph) -> bytes:
+    """Return a hash of everything about graph a graph record holds but a frame doesn't: its
+    edges, their rest lengths, which vertices are pinned, and its all-pairs springs."""
+    state = graph.store if graph.store is not None \
+        else array_physics.gather(graph.vertices, graph.edges)
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (state.pinned, state.start, state.end, state.rest):
+        digest.update(np.ascontiguousarray(array).data)
+        digest.update(struct.pack("<q", len(array)))
+    if graph.all_pairs is not None:
+        digest.update(np.ascontiguousarray(graph.all_pairs.rest_x).data)
+        digest.update(np.ascontiguousarray(graph.all_pairs.rest_y).data)
+    return digest.digest()
+
+
+def _shuffle(frames: np.ndarray) -> bytes:
+    """Return the bytes of frames with the first byte of every value first, then every second
+    byte, and so on.
+
+    >>> _unshuffle(_shuffle(np.array([1.5, -2.0], dtype=np.float32)), np.float32, 1)
+    array([[ 1.5, -2. ]], dtype=float32)
+    """
+    values = np.ascontiguousarray(frames).reshape(-1)
+    return values.view(np.uint8).reshape(len(values), values.itemsize).T.tobytes()
+
+
+def _unshuffle(data: bytes, dtype: type, rows: int) -> np.ndarray:
+    """Undo _shuffle, returning the values of data as an array of dtype with rows rows."""
+    itemsize = np.dtype(dtype).itemsize
+    shuffled = np.frombuffer(data, np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(shuffled.T).view(dtype).reshape(rows, -1)
+
+
+def _last_at_or_before(firsts: list[int], frame: int) -> int:
+    """Return the index of the last of the sorted firsts that is at most frame.
+
+    >>> _last_at_or_before([0, 64, 128], 64), _last_at_or_before([0, 64, 128], 127)
+    (1, 1)
+    """
+    return int(np.searchsorted(firsts, frame, side="right")) - 1
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(
+        config={
+            "extra-imports": ["hashlib", "io", "os", "queue", "struct", "threading", "typing",
+                              "zlib", "numpy", "array_physics", "graph_io", "graph"],
+            "allowed-io": ["TrajectoryRecorder.__init__", "TrajectoryPlayer.__init__"],
+            "max-line-length": 100,
+        }
+    )
@@ -10,6 +10,9 @@ This file is licensed under the MIT License
 """
 import random
 
+# the mass (and radius) given to new vertices
+DEFAULT_MASS = 5
+
 
 class Vertex:
     """
@@ -30,7 +33,7 @@ class Vertex:
     pinned: bool
 
     def __init__(self, x: float, y: float, randomize: bool = False) -> None:
-        self.mass = 5
+        self.mass = DEFAULT_MASS
         if randomize:
             # We use the 1 - random.random() trick to ensure 0 is not a possible value
             # This is because random.random() returns a value in the range [0, 1)
@@ -43,15 +46,17 @@ class Vertex:
         self.vy = 0
         self.pinned = False
 
-    def update(self, friction: float, gravity: float, size: tuple[int, int]) -> float:
-        """Update self using graph friction, graph gravity.
+    def update(self, friction: float, gravity: float, size: tuple[int, int],
+               dt: float = 1.0) -> float:
+        """Update self using graph friction, graph gravity, for a step of length dt.
+        friction and gravity are those of one step of length dt (see array_physics.per_substep).
         Returns the applied velocity."""
         self.vx *= friction
         self.vy *= friction
         if not self.pinned:
             self.vy += gravity
-            self.x += self.vx
-            self.y += self.vy
+            self.x += self.vx * dt
+            self.y += self.vy * dt
             return (self.vx ** 2 + self.vy ** 2) ** 0.5 if self.y < size[1] else abs(self.vx)
         else:
             return 0.0